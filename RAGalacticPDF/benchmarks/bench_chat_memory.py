@@ -0,0 +1,77 @@
+# Compare prompt growth over a long conversation for the chat memory modes:
+# - buffer: whole history sent with each question (up to 10k tokens)
+# - rolling_summary: last --recent-turns turns verbatim, older turns folded by a background summarizer
+# The LLM is simulated: its latency is proportional to the prompt tokens (--ms-per-token), answers have a fixed length.
+#
+# Usage: python RAGalacticPDF/benchmarks/bench_chat_memory.py --turns 30 --recent-turns 4
+import argparse
+import time
+from typing import Any
+
+from bench_utils import SRC_PATH  # noqa: F401 (adds the app modules to sys.path)
+
+from llama_index.core.llms import CustomLLM, CompletionResponse, CompletionResponseGen, LLMMetadata, ChatMessage
+from llama_index.core.llms.callbacks import llm_completion_callback
+from llama_index.core.utils import get_tokenizer
+
+from chat_memory import new_chat_memory
+
+
+TOKENIZER = get_tokenizer()
+# Retrieved chunks sent with every question (context assembly budget)
+CONTEXT_TOKENS = 1536
+
+
+def n_tokens(text:str):
+    return len(TOKENIZER(text))
+
+
+class FakeLLM(CustomLLM):
+    ms_per_token: float = 0.05
+    answer_words: int = 120
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return LLMMetadata(model_name='fake')
+
+    @llm_completion_callback()
+    def complete(self, prompt:str, formatted:bool=False, **kwargs:Any) -> CompletionResponse:
+        time.sleep(n_tokens(prompt) * self.ms_per_token / 1000)
+        return CompletionResponse(text=' '.join(['summary'] * (self.answer_words // 2)))
+
+    @llm_completion_callback()
+    def stream_complete(self, prompt:str, formatted:bool=False, **kwargs:Any) -> CompletionResponseGen:
+        yield self.complete(prompt)
+
+
+def run_conversation(mode:str, turns:int, recent_turns:int, ms_per_token:float):
+    llm = FakeLLM(ms_per_token=ms_per_token)
+    memory = new_chat_memory(mode, llm=llm, recent_turns=recent_turns, token_limit=10000)
+    rows = []
+    for turn in range(turns):
+        question = f'Question {turn}: what does section {turn} of the document say about the results of experiment {turn}?'
+        memory.put(ChatMessage(role='user', content=question))
+        history_tokens = sum(n_tokens(message.content or '') for message in memory.get(input=question))
+        prompt_tokens = CONTEXT_TOKENS + history_tokens
+        # Answer generation: prompt processing dominates on a local model
+        start = time.perf_counter()
+        time.sleep(prompt_tokens * ms_per_token / 1000)
+        latency_ms = (time.perf_counter() - start) * 1000
+        memory.put(ChatMessage(role='assistant', content=' '.join([f'answer{turn}'] * llm.answer_words)))
+        rows.append((turn + 1, prompt_tokens, latency_ms))
+    if hasattr(memory, 'wait_idle'):
+        memory.wait_idle(timeout=60)
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Prompt tokens and latency per turn of the chat memory modes.')
+    parser.add_argument('--turns', type=int, default=30)
+    parser.add_argument('--recent-turns', type=int, default=4)
+    parser.add_argument('--ms-per-token', type=float, default=0.05)
+    args = parser.parse_args()
+
+    results = {mode: run_conversation(mode, args.turns, args.recent_turns, args.ms_per_token) for mode in ('buffer', 'rolling_summary')}
+    print(f"{'turn':>5} {'buffer tokens':>14} {'buffer ms':>10} {'rolling tokens':>15} {'rolling ms':>11}")
+    for (turn, buffer_tokens, buffer_ms), (_, rolling_tokens, rolling_ms) in zip(results['buffer'], results['rolling_summary']):
+        print(f'{turn:>5} {buffer_tokens:>14} {buffer_ms:>10.1f} {rolling_tokens:>15} {rolling_ms:>11.1f}')
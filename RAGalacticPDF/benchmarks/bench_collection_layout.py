@@ -0,0 +1,159 @@
+# Startup time, memory and query latency of the two chroma collection layouts (config.COLLECTION_LAYOUT) against the
+# number of users:
+# - per_user: one collection per user
+# - shared: a single collection partitioned by the user_id metadata
+# For every layout and user count, a store of --chunks-per-user random chunks per user is written with chromadb, then
+# measured in a fresh process (cold chroma, offline stand-ins of offline.py): shared resources startup, first session,
+# retrieval latency of sessions of --queried-users distinct users (first query of each user, then a second one), and
+# RSS growth. The retrieved nodes are also checked to belong to the querying user.
+#
+# Usage: python RAGalacticPDF/benchmarks/bench_collection_layout.py --users 100 10000 50000 --output layouts.json
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import subprocess
+
+import numpy as np
+
+from bench_utils import SRC_PATH, current_rss_mb  # noqa: F401 (adds the app modules to sys.path)
+
+
+def dir_size_mb(path:str):
+    size = 0
+    for root, _, files in os.walk(path):
+        size += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return size / (1024 * 1024)
+
+
+def user_ids(n_users:int):
+    return [f'user_{i:06d}' for i in range(n_users)]
+
+
+def populate(layout:str, n_users:int, chunks_per_user:int, dim:int, chroma_dir:str, batch_size:int=5000):
+    import chromadb
+    from config import SHARED_COLLECTION_NAME
+    client = chromadb.PersistentClient(path=chroma_dir)
+    rng = np.random.default_rng(0)
+
+    def chunks(user_id:str):
+        vectors = rng.standard_normal((chunks_per_user, dim)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        # Same metadata as the nodes written by RAGalacticPDF
+        metadatas = [{'file_name': f'file_{i % 2}.pdf', 'user_id': user_id} for i in range(chunks_per_user)]
+        ids = [f'{user_id}_{i}' for i in range(chunks_per_user)]
+        documents = [f'chunk {i} of {user_id}' for i in range(chunks_per_user)]
+        return ids, vectors.tolist(), metadatas, documents
+
+    start = time.perf_counter()
+    if layout == 'per_user':
+        for user_id in user_ids(n_users):
+            ids, embeddings, metadatas, documents = chunks(user_id)
+            client.get_or_create_collection(name=user_id).add(ids=ids, embeddings=embeddings, metadatas=metadatas, documents=documents)
+    else:
+        collection = client.get_or_create_collection(name=SHARED_COLLECTION_NAME)
+        batch = ([], [], [], [])
+        for user_id in user_ids(n_users):
+            for values, user_values in zip(batch, chunks(user_id)):
+                values.extend(user_values)
+            if len(batch[0]) >= batch_size:
+                collection.add(ids=batch[0], embeddings=batch[1], metadatas=batch[2], documents=batch[3])
+                batch = ([], [], [], [])
+        if batch[0]:
+            collection.add(ids=batch[0], embeddings=batch[1], metadatas=batch[2], documents=batch[3])
+    return time.perf_counter() - start
+
+
+def percentiles(samples_s):
+    ordered = sorted(samples_s)
+    def at(fraction):
+        return 1000 * ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+    return {'p50_ms': at(0.50), 'p95_ms': at(0.95), 'p99_ms': at(0.99)}
+
+
+def measure(args):
+    # Runs in its own process: the store on disk is opened cold
+    from offline import offline_environment, install_offline_resources
+    offline_environment(args.workdir, 'http://127.0.0.1:9', RAGALACTIC_COLLECTION_LAYOUT=args.layout,
+                        RAGALACTIC_CHROMA_DB_DIR=os.path.join(args.workdir, 'chroma_db_data'))
+    rss_start = current_rss_mb()
+    start = time.perf_counter()
+    install_offline_resources()
+    startup_s = time.perf_counter() - start
+    from rag import RAGalacticPDF
+
+    users = random.Random(0).sample(user_ids(args.n_users), min(args.queried_users, args.n_users))
+    start = time.perf_counter()
+    rag = RAGalacticPDF()
+    rag.set_user_id(users[0])
+    first_session_s = time.perf_counter() - start
+    rss_after_startup = current_rss_mb()
+
+    def session_query(user_id:str, question:str):
+        # What a request of the user pays: session setup and retrieval over the user's nodes
+        start = time.perf_counter()
+        rag.set_user_id(user_id)
+        index = rag.engine_cache.indexes.get_or_create((user_id,), lambda: rag._get_index(rag.vector_store))
+        nodes = index.as_retriever(similarity_top_k=3, **rag._get_retriever_filters(None)).retrieve(question)
+        elapsed = time.perf_counter() - start
+        return elapsed, sum(node.node.metadata.get('user_id') != user_id for node in nodes), len(nodes)
+
+    results = {}
+    for name in ('first_query', 'second_query'):
+        samples, foreign, retrieved = [], 0, 0
+        for i, user_id in enumerate(users):
+            elapsed, n_foreign, n_nodes = session_query(user_id, f'chunk {i} of the document about topic {i % 7}')
+            samples.append(elapsed)
+            foreign, retrieved = foreign + n_foreign, retrieved + n_nodes
+        results[name] = {**percentiles(samples), 'foreign_nodes': foreign, 'retrieved_nodes': retrieved}
+    print(json.dumps({'startup_s': startup_s, 'first_session_s': first_session_s,
+                      'rss_startup_mb': rss_after_startup - rss_start,
+                      'rss_queries_mb': current_rss_mb() - rss_after_startup,
+                      **results}))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Per-user vs shared chroma collection layout against the number of users.')
+    parser.add_argument('--users', type=int, nargs='+', default=[100, 10000, 50000])
+    parser.add_argument('--layouts', nargs='+', default=['per_user', 'shared'], choices=['per_user', 'shared'])
+    parser.add_argument('--chunks-per-user', type=int, default=20)
+    parser.add_argument('--queried-users', type=int, default=200)
+    parser.add_argument('--dim', type=int, default=384)
+    parser.add_argument('--workdir', default=None)
+    parser.add_argument('--output', default=None)
+    # Internal: measurement of an existing store in a child process
+    parser.add_argument('--measure', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--layout', help=argparse.SUPPRESS)
+    parser.add_argument('--n-users', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        measure(args)
+        sys.exit(0)
+
+    root = args.workdir or tempfile.mkdtemp(prefix='ragalactic_layouts_')
+    results = []
+    for n_users in args.users:
+        for layout in args.layouts:
+            workdir = os.path.join(root, f'{layout}_{n_users}')
+            chroma_dir = os.path.join(workdir, 'chroma_db_data')
+            populate_s = populate(layout, n_users, args.chunks_per_user, args.dim, chroma_dir)
+            child = subprocess.run([sys.executable, os.path.abspath(__file__), '--measure', '--layout', layout, '--n-users', str(n_users),
+                                    '--queried-users', str(args.queried_users), '--workdir', workdir],
+                                   capture_output=True, text=True, check=True)
+            result = {'layout': layout, 'users': n_users, 'populate_s': populate_s, 'disk_mb': dir_size_mb(chroma_dir),
+                      **json.loads(child.stdout.strip().splitlines()[-1])}
+            results.append(result)
+            print(f"{layout:<9} users={n_users:<6} startup={result['startup_s']:.2f}s first_session={1000 * result['first_session_s']:.0f}ms "
+                  f"query p50/p95 first={result['first_query']['p50_ms']:.1f}/{result['first_query']['p95_ms']:.1f}ms "
+                  f"second={result['second_query']['p50_ms']:.1f}/{result['second_query']['p95_ms']:.1f}ms "
+                  f"rss +{result['rss_startup_mb']:.0f}MB startup +{result['rss_queries_mb']:.0f}MB queries disk={result['disk_mb']:.0f}MB "
+                  f"foreign_nodes={result['first_query']['foreign_nodes'] + result['second_query']['foreign_nodes']}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'args': vars(args), 'results': results}, f, indent=2)
+        print(f'Results written to {args.output}')
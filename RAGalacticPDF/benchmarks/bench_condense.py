@@ -0,0 +1,90 @@
+# Time to first token of condense_plus_context answers for each condense strategy (and with a smaller condense model).
+# The LLMs are simulated: latency proportional to the prompt tokens (--ms-per-token, divided by --small-model-speedup
+# for the condense model), the retriever returns fixed chunks. The conversation is replayed twice (second pass: same
+# questions after the same exchanges, as when several users follow the same path) so that the 'cached' strategy can hit.
+#
+# Usage: python RAGalacticPDF/benchmarks/bench_condense.py --ms-per-token 0.5
+import argparse
+import time
+from typing import Any, List
+
+from bench_utils import SRC_PATH  # noqa: F401 (adds the app modules to sys.path)
+
+from llama_index.core.llms import CustomLLM, CompletionResponse, CompletionResponseGen, LLMMetadata
+from llama_index.core.llms.callbacks import llm_completion_callback
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import NodeWithScore, TextNode, QueryBundle
+from llama_index.core.memory import ChatMemoryBuffer
+from llama_index.core.utils import get_tokenizer
+
+from condense import QuestionCondenser, CONDENSE_STRATEGIES
+from llm_scheduler import PrioritizedCondensePlusContextChatEngine
+
+
+TOKENIZER = get_tokenizer()
+
+CONVERSATION = [
+    'What is the main contribution of the paper about retrieval augmented generation?',
+    'How was it evaluated?',
+    'Which datasets are used in the experiments on open domain question answering?',
+    'What about the baselines?',
+    'Does the retrieval augmented model outperform the closed book model on every benchmark?',
+    'Why?',
+]
+
+
+class FakeLLM(CustomLLM):
+    ms_per_token: float = 0.5
+    answer_words: int = 80
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return LLMMetadata(model_name='fake')
+
+    @llm_completion_callback()
+    def complete(self, prompt:str, formatted:bool=False, **kwargs:Any) -> CompletionResponse:
+        time.sleep(len(TOKENIZER(prompt)) * self.ms_per_token / 1000)
+        return CompletionResponse(text='Standalone question about retrieval augmented generation?')
+
+    @llm_completion_callback()
+    def stream_complete(self, prompt:str, formatted:bool=False, **kwargs:Any) -> CompletionResponseGen:
+        # Prompt processing before the first token, then fast token generation
+        time.sleep(len(TOKENIZER(prompt)) * self.ms_per_token / 1000)
+        text = ''
+        for word in ['answer'] * self.answer_words:
+            text += word + ' '
+            yield CompletionResponse(text=text, delta=word + ' ')
+
+
+class FixedRetriever(BaseRetriever):
+    def _retrieve(self, query_bundle:QueryBundle) -> List[NodeWithScore]:
+        return [NodeWithScore(node=TextNode(text=' '.join(['context'] * 300)), score=1.0) for _ in range(3)]
+
+
+def run(strategy:str, llm:FakeLLM, condense_llm:FakeLLM):
+    condenser = QuestionCondenser(condense_llm, strategy=strategy)
+    for _ in range(2):
+        engine = PrioritizedCondensePlusContextChatEngine.from_defaults(retriever=FixedRetriever(), llm=llm,
+                                                                          memory=ChatMemoryBuffer.from_defaults(token_limit=10000),
+                                                                          condenser=condenser)
+        for question in CONVERSATION:
+            response = engine.stream_chat(question)
+            for _ in response.response_gen:
+                pass
+            # The answer is written to the memory by a background thread at the end of the stream
+            while not response.is_done:
+                time.sleep(0.001)
+    return condenser.metrics()[strategy]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Time to first token per condense strategy.')
+    parser.add_argument('--ms-per-token', type=float, default=0.5)
+    parser.add_argument('--small-model-speedup', type=float, default=4.0)
+    args = parser.parse_args()
+
+    llm = FakeLLM(ms_per_token=args.ms_per_token)
+    small_llm = FakeLLM(ms_per_token=args.ms_per_token / args.small_model_speedup)
+    for strategy in CONDENSE_STRATEGIES:
+        print(f'{strategy:<10} same model   {run(strategy, llm, llm)}')
+        print(f'{strategy:<10} small model  {run(strategy, llm, small_llm)}')
@@ -0,0 +1,94 @@
+# Throughput, latency and retrieval overlap of the CPU embedding backends against the reference (full precision torch) backend
+#
+# Usage: python RAGalacticPDF/benchmarks/bench_embedding_backends.py --backends torch_int8 onnx onnx_int8 --pdf paper.pdf
+#        (without --pdf a synthetic corpus is generated)
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+import numpy as np
+
+from bench_utils import SRC_PATH  # noqa: F401 (adds the app modules to sys.path)
+from synthetic_pdf import make_pdf
+
+from config import PROJECT_ROOT
+from parsers import LocalPDFParser
+from embedding_backends import get_embedding_model
+from llama_index.core.node_parser import SentenceSplitter
+
+
+SAMPLE_QUERIES = [
+    'What is the main contribution of the paper?',
+    'How is the measurement operator defined?',
+    'Explain quantum entanglement between two qubits.',
+    'What are the conclusions of the study?',
+    'Which algorithm is used for error correction?',
+    'How does decoherence affect the system?',
+    'Summarize the section about the hamiltonian.',
+    'What is the probability amplitude of a state?',
+]
+
+
+def load_corpus(pdf_path:str, chunk_size:int):
+    docs = LocalPDFParser().load_data(pdf_path)
+    return [node.get_content() for node in SentenceSplitter(chunk_size=chunk_size, chunk_overlap=chunk_size // 8).get_nodes_from_documents(docs)]
+
+
+def bench_backend(backend:str, model_name:str, corpus, queries, cache_dir:str):
+    start = time.perf_counter()
+    model = get_embedding_model(backend, model_name, cache_dir=cache_dir)
+    load_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    doc_embeddings = np.asarray(model._get_text_embeddings(corpus), dtype=np.float32)
+    corpus_s = time.perf_counter() - start
+
+    query_latencies, query_embeddings = [], []
+    for query in queries:
+        start = time.perf_counter()
+        query_embeddings.append(model._get_query_embedding(query))
+        query_latencies.append(time.perf_counter() - start)
+    return {
+        'load_s': load_s,
+        'chunks_per_s': len(corpus) / corpus_s,
+        'query_p50_ms': 1000 * statistics.median(query_latencies),
+        'query_max_ms': 1000 * max(query_latencies),
+    }, doc_embeddings, np.asarray(query_embeddings, dtype=np.float32)
+
+
+def top_k(doc_embeddings, query_embeddings, k:int):
+    return np.argsort(-(query_embeddings @ doc_embeddings.T), axis=1)[:, :k]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compare CPU embedding backends.')
+    parser.add_argument('--model', default='BAAI/bge-small-en-v1.5')
+    parser.add_argument('--reference', default='torch')
+    parser.add_argument('--backends', nargs='+', default=['torch_int8', 'onnx', 'onnx_int8'])
+    parser.add_argument('--pdf', default=None)
+    parser.add_argument('--pages', type=int, default=50, help='Pages of the synthetic corpus when no --pdf is given.')
+    parser.add_argument('--chunk-size', type=int, default=512)
+    parser.add_argument('--top-k', type=int, default=3)
+    parser.add_argument('--cache-dir', default=os.path.join(PROJECT_ROOT, 'models_cache'))
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pdf_path = args.pdf or make_pdf(os.path.join(tmp_dir, 'corpus.pdf'), n_pages=args.pages)
+        corpus = load_corpus(pdf_path, args.chunk_size)
+    print(f'corpus: {len(corpus)} chunks, {len(SAMPLE_QUERIES)} queries, top_k={args.top_k}')
+
+    reference_stats, reference_docs, reference_queries = bench_backend(args.reference, args.model, corpus, SAMPLE_QUERIES, args.cache_dir)
+    reference_top_k = top_k(reference_docs, reference_queries, args.top_k)
+    print(f'{args.reference:<12} {reference_stats}')
+
+    for backend in args.backends:
+        stats, docs, queries = bench_backend(backend, args.model, corpus, SAMPLE_QUERIES, args.cache_dir)
+        backend_top_k = top_k(docs, queries, args.top_k)
+        # Retrieval overlap: share of the reference top-k chunks also retrieved by the backend
+        stats['top_k_overlap'] = float(np.mean([len(set(ref) & set(res)) / args.top_k for ref, res in zip(reference_top_k, backend_top_k)]))
+        # Agreement of the embeddings themselves (both are L2 normalized)
+        stats['mean_doc_cosine'] = float(np.mean(np.sum(reference_docs * docs, axis=1)))
+        stats['speedup'] = stats['chunks_per_s'] / reference_stats['chunks_per_s']
+        print(f'{backend:<12} {stats}')
@@ -0,0 +1,112 @@
+# Latency and recall@k of the exact search tier (exact_search.py) against the chroma HNSW index, for users of growing size.
+# Each user is a per_user collection of --files files of random normalized vectors written through ChromaVectorStore (same
+# stored layout as the app). Queries are noisy copies of stored vectors, over every file and over a selection of
+# --selected-files files (metadata filters of load_existing_pdf). Recall@k is measured against a float32 brute force.
+# The first query of each store (chroma index load, exact tier copy) is reported separately from the warm latencies.
+#
+# Usage: python RAGalacticPDF/benchmarks/bench_exact_search.py --sizes 1000 5000 20000 --output exact_search.json
+import os
+import json
+import time
+import argparse
+import tempfile
+
+import numpy as np
+
+from bench_utils import SRC_PATH  # noqa: F401 (adds the app modules to sys.path)
+
+import chromadb
+from llama_index.core.schema import TextNode
+from llama_index.core.vector_stores.types import VectorStoreQuery, MetadataFilter, MetadataFilters, FilterCondition
+from llama_index.vector_stores.chroma import ChromaVectorStore
+
+from catalog import PDFCatalog
+from exact_search import ExactSearchTier, ExactSearchVectorStore
+
+
+def populate(collection, catalog, user_id:str, n_vectors:int, n_files:int, dim:int, rng, batch_size:int=2000):
+    vectors = rng.standard_normal((n_vectors, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    file_names = np.array([f'file_{i % n_files}.pdf' for i in range(n_vectors)])
+    store = ChromaVectorStore(chroma_collection=collection)
+    for start in range(0, n_vectors, batch_size):
+        store.add([TextNode(id_=f'{user_id}_{i}', text=f'chunk {i}', embedding=vectors[i].tolist(),
+                            metadata={'file_name': str(file_names[i]), 'user_id': user_id})
+                   for i in range(start, min(start + batch_size, n_vectors))])
+    for i in range(n_files):
+        catalog.add_file(user_id, f'file_{i}.pdf', content_hash=f'{user_id}_{i}')
+    return vectors, file_names
+
+
+def percentiles(samples_s):
+    ordered = sorted(samples_s)
+    def at(fraction):
+        return 1000 * ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+    return {'p50_ms': at(0.50), 'p95_ms': at(0.95)}
+
+
+def run_store(store, queries, filters, ground_truth, top_k:int):
+    def query(embedding):
+        return store.query(VectorStoreQuery(query_embedding=embedding.tolist(), similarity_top_k=top_k, filters=filters))
+    start = time.perf_counter()
+    query(queries[0])
+    first_query_s = time.perf_counter() - start
+    samples, hits = [], 0
+    for embedding, expected in zip(queries, ground_truth):
+        start = time.perf_counter()
+        result = query(embedding)
+        samples.append(time.perf_counter() - start)
+        hits += len(set(result.ids) & expected)
+    return {'first_query_ms': 1000 * first_query_s, **percentiles(samples), 'recall': hits / (top_k * len(queries))}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Exact search tier vs chroma HNSW: latency and recall@k per user size.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 5000, 20000])
+    parser.add_argument('--files', type=int, default=10)
+    parser.add_argument('--selected-files', type=int, default=2)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--top-k', type=int, default=5)
+    parser.add_argument('--dim', type=int, default=384)
+    parser.add_argument('--noise', type=float, default=0.5, help='query = stored vector + noise of this norm')
+    parser.add_argument('--workdir', default=None)
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    os.environ.setdefault('ANONYMIZED_TELEMETRY', 'False')
+    workdir = args.workdir or tempfile.mkdtemp(prefix='ragalactic_exact_search_')
+    client = chromadb.PersistentClient(path=os.path.join(workdir, 'chroma_db_data'))
+    catalog = PDFCatalog(os.path.join(workdir, 'catalog.sqlite3'))
+    tier = ExactSearchTier(os.path.join(workdir, 'exact_search'), catalog, max_vectors=max(args.sizes))
+    rng = np.random.default_rng(0)
+
+    results = []
+    for n_vectors in args.sizes:
+        user_id = f'user_{n_vectors}'
+        collection = client.get_or_create_collection(name=user_id)
+        vectors, file_names = populate(collection, catalog, user_id, n_vectors, args.files, args.dim, rng)
+        picked = rng.integers(0, n_vectors, args.queries)
+        noise = rng.standard_normal((args.queries, args.dim)).astype(np.float32)
+        queries = vectors[picked] + args.noise * noise / np.linalg.norm(noise, axis=1, keepdims=True)
+        selected = [f'file_{i}.pdf' for i in range(args.selected_files)]
+        for selection, names in [('all_files', None), (f'{args.selected_files}_files', selected)]:
+            filters = None
+            if names is not None:
+                filters = MetadataFilters(filters=[MetadataFilter(key='file_name', value=name) for name in names], condition=FilterCondition.OR)
+            # Float32 brute force over the selected rows (chroma default space: squared l2)
+            rows = np.arange(n_vectors) if names is None else np.flatnonzero(np.isin(file_names, names))
+            distances = (vectors[rows] ** 2).sum(1)[None, :] - 2 * queries @ vectors[rows].T
+            ground_truth = [{f'{user_id}_{rows[i]}' for i in np.argsort(row)[:args.top_k]} for row in distances]
+            for name, store in [('chroma', ChromaVectorStore(chroma_collection=collection)),
+                                ('exact', ExactSearchVectorStore(chroma_collection=collection, tier=tier))]:
+                result = {'vectors': n_vectors, 'selection': selection, 'store': name,
+                          **run_store(store, queries, filters, ground_truth, args.top_k)}
+                results.append(result)
+                print(f"{name:<6} vectors={n_vectors:<6} {selection:<9} first={result['first_query_ms']:.1f}ms "
+                      f"p50/p95={result['p50_ms']:.2f}/{result['p95_ms']:.2f}ms recall@{args.top_k}={result['recall']:.3f}")
+    print(f'exact tier: {tier.stats()}')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'args': vars(args), 'results': results}, f, indent=2)
+        print(f'Results written to {args.output}')
@@ -0,0 +1,46 @@
+# Pages/second of the local (pypdf, process pool) parser backend against the number of worker processes
+#
+# Usage: python RAGalacticPDF/benchmarks/bench_local_parser.py --pages 600 --workers 1 2 4 8
+#        python RAGalacticPDF/benchmarks/bench_local_parser.py --pdf path/to/large.pdf
+import argparse
+import os
+import tempfile
+import time
+
+from bench_utils import SRC_PATH  # noqa: F401 (adds the app modules to sys.path)
+from synthetic_pdf import make_pdf
+
+from parsers import LocalPDFParser
+
+
+def bench_parser(pdf_path:str, workers:int, pages_per_task:int, repeats:int):
+    parser = LocalPDFParser(max_workers=workers, pages_per_task=pages_per_task)
+    # Warm up the process pool so that its startup is not counted in the parse time
+    parser.load_data(pdf_path)
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        docs = parser.load_data(pdf_path)
+        timings.append(time.perf_counter() - start)
+    parser.shutdown()
+    best = min(timings)
+    return {'workers': workers, 'pages': len(docs), 'best_s': round(best, 3), 'pages_per_s': round(len(docs) / best, 1)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Local parser throughput against core count.')
+    parser.add_argument('--pdf', default=None, help='PDF to parse (a synthetic one is generated otherwise).')
+    parser.add_argument('--pages', type=int, default=600, help='Number of pages of the synthetic PDF.')
+    parser.add_argument('--workers', type=int, nargs='+', default=None)
+    parser.add_argument('--pages-per-task', type=int, default=16)
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+
+    cpu_count = os.cpu_count() or 1
+    workers_list = args.workers or sorted({1, 2, 4, 8, cpu_count} & set(range(1, cpu_count + 1)))
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pdf_path = args.pdf or make_pdf(os.path.join(tmp_dir, 'synthetic.pdf'), n_pages=args.pages)
+        print(f'cpu_count={cpu_count} pdf={pdf_path}')
+        for workers in workers_list:
+            print(bench_parser(pdf_path, workers, args.pages_per_task, args.repeats))
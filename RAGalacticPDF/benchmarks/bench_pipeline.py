@@ -0,0 +1,221 @@
+# Offline micro-benchmarks of the RAG pipeline (fake Ollama server, local parser, hashed embeddings, see offline.py):
+# - ingestion: synthetic PDFs of increasing size through load_new_pdf (pages/s, chunks/s)
+# - retrieval: Chroma query latency against the collection size (random vectors, with and without a file filter)
+# - engines: chat / query engine construction, cold (caches dropped) and warm
+# - tags: get_user_pdfs tag queries against the number of files in the catalog
+# - chat: time to first token and total time of streamed answers
+# Results are written as json (--output) with the commit they were measured on; --baseline prints the ratio
+# of every number to a previous results file.
+#
+# Usage: python RAGalacticPDF/benchmarks/bench_pipeline.py --output results.json
+#        python RAGalacticPDF/benchmarks/bench_pipeline.py --retrieval-sizes 1000 10000 100000 1000000 --baseline results.json
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+
+from offline import FakeOllamaServer, UploadedPDF, offline_environment, install_offline_resources
+from synthetic_pdf import make_pdf_bytes
+
+
+def percentiles(samples_s):
+    ordered = sorted(samples_s)
+    def at(fraction):
+        return 1000 * ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+    return {'p50_ms': at(0.50), 'p95_ms': at(0.95), 'p99_ms': at(0.99), 'mean_ms': 1000 * statistics.fmean(ordered)}
+
+
+def timed(fn, repeats:int):
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def bench_ingestion(page_counts, user_id:str='bench_ingestion'):
+    from rag import RAGalacticPDF
+    rag = RAGalacticPDF()
+    # Warm up (tokenizer, parser pool, collection creation) on another user
+    rag.set_user_id(f'{user_id}_warmup')
+    rag.load_new_pdf(UploadedPDF('warmup.pdf', make_pdf_bytes(1)))
+    rag.set_user_id(user_id)
+    results = {}
+    for n_pages in page_counts:
+        pdf = UploadedPDF(f'synthetic_{n_pages}_pages.pdf', make_pdf_bytes(n_pages, seed=n_pages))
+        start = time.perf_counter()
+        rag.load_new_pdf(pdf)
+        elapsed = time.perf_counter() - start
+        n_chunks = rag.chroma_collection.count()
+        results[f'{n_pages}_pages'] = {'seconds': elapsed, 'pages_per_s': n_pages / elapsed, 'chunks_per_s': n_chunks / elapsed, 'chunks': n_chunks}
+        # Next PDF measured alone
+        rag.chroma_client.delete_collection(user_id)
+        rag.engine_cache.collections.invalidate(lambda key: key == user_id)
+        rag.set_user_id(user_id)
+    return results
+
+
+def bench_retrieval(sizes, dim:int, repeats:int, top_k:int=3, batch_size:int=5000):
+    import chromadb
+    client = chromadb.PersistentClient(path=os.path.join(os.environ['RAGALACTIC_CHROMA_DB_DIR'], 'retrieval_bench'))
+    collection = client.get_or_create_collection('retrieval_bench')
+    rng = np.random.default_rng(0)
+    results, n_files = {}, 20
+    for size in sorted(sizes):
+        # The collection grows to each size in turn
+        start_insert = time.perf_counter()
+        while collection.count() < size:
+            start = collection.count()
+            n = min(batch_size, size - start)
+            vectors = rng.standard_normal((n, dim)).astype(np.float32)
+            vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+            collection.add(ids=[str(start + i) for i in range(n)], embeddings=vectors.tolist(),
+                           metadatas=[{'file_name': f'file_{(start + i) % n_files}.pdf'} for i in range(n)],
+                           documents=[f'chunk {start + i}' for i in range(n)])
+        insert_s = time.perf_counter() - start_insert
+        queries = rng.standard_normal((repeats, dim)).astype(np.float32)
+        plain, filtered = [], []
+        for query in queries:
+            start = time.perf_counter()
+            collection.query(query_embeddings=[query.tolist()], n_results=top_k)
+            plain.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            collection.query(query_embeddings=[query.tolist()], n_results=top_k, where={'file_name': 'file_0.pdf'})
+            filtered.append(time.perf_counter() - start)
+        results[str(size)] = {'insert_s': insert_s, 'query': percentiles(plain), 'query_file_filter': percentiles(filtered)}
+    return results
+
+
+def bench_engines(repeats:int, user_id:str='bench_engines'):
+    from rag import RAGalacticPDF
+    rag = RAGalacticPDF()
+    rag.set_user_id(user_id)
+    pdf = UploadedPDF('engine.pdf', make_pdf_bytes(5, seed=1))
+    rag.load_new_pdf(pdf)
+    results = {}
+    for llm_mode in ('Conversation', 'Query'):
+        rag._set_engine_feature(engine_mode=llm_mode, llm_knowledge_base=False, streaming=True)
+        def cold():
+            rag.engine_cache.invalidate_user(user_id)
+            rag.load_existing_pdf([pdf.name])
+        results[llm_mode] = {'cold': percentiles(timed(cold, repeats)),
+                             'warm': percentiles(timed(lambda: rag.load_existing_pdf([pdf.name]), repeats))}
+    return results
+
+
+def bench_tags(file_counts, repeats:int):
+    from rag import RAGalacticPDF
+    rag = RAGalacticPDF()
+    results = {}
+    for n_files in file_counts:
+        user_id = f'bench_tags_{n_files}'
+        rag.set_user_id(user_id)
+        for i in range(n_files):
+            rag.catalog.add_file(user_id, f'file_{i}.pdf', tags=[{'topic': f'topic_{i % 10}'}, {'year': str(2000 + i % 25)}], content_hash=str(i))
+        all_tags = [{'topic': 'topic_1'}, {'year': '2001'}]
+        results[str(n_files)] = {
+            'all_files': percentiles(timed(lambda: rag.get_user_pdfs(), repeats)),
+            'tagged_with_all': percentiles(timed(lambda: rag.get_user_pdfs(tagged_with_all=all_tags), repeats)),
+            'tagged_with_at_least_one': percentiles(timed(lambda: rag.get_user_pdfs(tagged_with_at_least_one=all_tags), repeats)),
+            'user_tags': percentiles(timed(lambda: rag.get_users_tags(), repeats)),
+        }
+    return results
+
+
+def bench_chat(repeats:int, user_id:str='bench_engines'):
+    from rag import RAGalacticPDF
+    rag = RAGalacticPDF()
+    rag.set_user_id(user_id)
+    rag._set_engine_feature(engine_mode='Conversation', llm_knowledge_base=False, streaming=True)
+    engine = rag.load_existing_pdf(['engine.pdf'])
+    ttft, total = [], []
+    for i in range(repeats):
+        question = f'What does section {i + 1} say about the quantum state of the system number {i}?'
+        rag.manage_chat_history(to_append=('user', question))
+        start = time.perf_counter()
+        response = rag.run_chat(engine, question)
+        first = None
+        for _ in response.response_gen:
+            if first is None:
+                first = time.perf_counter() - start
+        ttft.append(first or 0.0)
+        total.append(time.perf_counter() - start)
+        rag.manage_chat_history(to_append=('assistant', str(response)))
+    return {'ttft': percentiles(ttft), 'total': percentiles(total)}
+
+
+def _flatten(data, prefix=''):
+    flat = {}
+    for key, value in data.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f'{prefix}{key}.'))
+        elif isinstance(value, (int, float)):
+            flat[f'{prefix}{key}'] = value
+    return flat
+
+
+def compare(results, baseline_path:str):
+    with open(baseline_path, 'r') as f:
+        baseline = json.load(f)
+    current, previous = _flatten(results['results']), _flatten(baseline['results'])
+    print(f"\nCompared to {baseline_path} ({baseline['meta'].get('commit')}):")
+    for key in sorted(current):
+        if key in previous and previous[key]:
+            print(f'{key:<70} {previous[key]:>12.3f} -> {current[key]:>12.3f}  x{current[key] / previous[key]:.2f}')
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(__file__), text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Offline micro-benchmarks of the RAG pipeline.')
+    parser.add_argument('--output', default='bench_pipeline_results.json')
+    parser.add_argument('--baseline', default=None, help='previous results file to compare with')
+    parser.add_argument('--workdir', default=None, help='data directory (a temporary one by default)')
+    parser.add_argument('--pages', type=int, nargs='+', default=[5, 50, 200])
+    parser.add_argument('--retrieval-sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--tag-files', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--repeats', type=int, default=20)
+    parser.add_argument('--ttft-ms', type=float, default=50.0)
+    parser.add_argument('--ms-per-token', type=float, default=5.0)
+    parser.add_argument('--skip', nargs='*', default=[], choices=['ingestion', 'retrieval', 'engines', 'tags', 'chat'])
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='ragalactic_bench_')
+    server = FakeOllamaServer(ttft_ms=args.ttft_ms, ms_per_token=args.ms_per_token).start()
+    offline_environment(workdir, server.base_url)
+    resources = install_offline_resources()
+
+    results = {}
+    if 'ingestion' not in args.skip:
+        results['ingestion'] = bench_ingestion(args.pages)
+    if 'retrieval' not in args.skip:
+        results['retrieval'] = bench_retrieval(args.retrieval_sizes, dim=resources.base_embed_model.embed_dim, repeats=args.repeats)
+    if 'engines' not in args.skip:
+        results['engines'] = bench_engines(args.repeats)
+    if 'tags' not in args.skip:
+        results['tags'] = bench_tags(args.tag_files, args.repeats)
+    if 'chat' not in args.skip and 'engines' not in args.skip:
+        results['chat'] = bench_chat(min(args.repeats, 10))
+    server.stop()
+
+    output = {'meta': {'commit': git_commit(), 'timestamp': time.time(), 'python': platform.python_version(),
+                       'machine': platform.machine(), 'cpus': os.cpu_count(), 'args': vars(args), 'workdir': workdir},
+              'results': results}
+    with open(args.output, 'w') as f:
+        json.dump(output, f, indent=2)
+    print(json.dumps(results, indent=2))
+    print(f'Results written to {args.output}')
+    if args.baseline:
+        compare(output, args.baseline)
@@ -0,0 +1,61 @@
+# Compare memory and startup cost of N sessions:
+# - shared: N lightweight RAGalacticPDF handles over the process-wide SharedResources registry
+# - per_session: N full copies of the heavy resources (what each Streamlit session used to build)
+#
+# Usage: python RAGalacticPDF/benchmarks/bench_sessions.py --sessions 1 5 10
+import argparse
+import gc
+import time
+
+from bench_utils import current_rss_mb
+
+from resources import SharedResources
+from rag import RAGalacticPDF
+
+
+def bench_shared(n_sessions:int):
+    rss_before = current_rss_mb()
+    start = time.perf_counter()
+    first_ready = None
+    handles = []
+    for _ in range(n_sessions):
+        handles.append(RAGalacticPDF())
+        if first_ready is None:
+            first_ready = time.perf_counter() - start
+    total = time.perf_counter() - start
+    # The registry is built by the first session only
+    return {'first_session_s': first_ready, 'next_sessions_avg_s': (total - first_ready) / max(n_sessions - 1, 1),
+            'total_s': total, 'rss_growth_mb': current_rss_mb() - rss_before}
+
+
+def bench_per_session(n_sessions:int):
+    rss_before = current_rss_mb()
+    start = time.perf_counter()
+    first_ready = None
+    copies = []
+    for _ in range(n_sessions):
+        copies.append(SharedResources())
+        if first_ready is None:
+            first_ready = time.perf_counter() - start
+    total = time.perf_counter() - start
+    result = {'first_session_s': first_ready, 'next_sessions_avg_s': (total - first_ready) / max(n_sessions - 1, 1),
+              'total_s': total, 'rss_growth_mb': current_rss_mb() - rss_before}
+    del copies
+    gc.collect()
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Memory and startup comparison of shared vs per-session resources.')
+    parser.add_argument('--sessions', type=int, nargs='+', default=[1, 5, 10])
+    # Run each mode in its own process for clean RSS numbers (freed weights are not always returned to the OS)
+    parser.add_argument('--mode', choices=['shared', 'per_session', 'both'], default='both')
+    args = parser.parse_args()
+
+    if args.mode in ('per_session', 'both'):
+        for n in args.sessions:
+            print(f'per_session  N={n:<4} {bench_per_session(n)}')
+    if args.mode in ('shared', 'both'):
+        # The first handle of the first run pays for the registry, every later handle is a reference copy
+        for n in args.sessions:
+            print(f'shared       N={n:<4} {bench_shared(n)}')
@@ -0,0 +1,23 @@
+# Helpers shared by the benchmark scripts
+import os
+import sys
+import resource
+
+# Make the app modules (flat imports such as `from rag import RAGalacticPDF`) importable from the benchmarks
+SRC_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src'))
+if SRC_PATH not in sys.path:
+    sys.path.insert(0, SRC_PATH)
+
+
+def current_rss_mb():
+    # Resident set size of the current process (Linux), falls back to the peak RSS elsewhere
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
@@ -0,0 +1,179 @@
+# Headless load test: N simulated users drive the RAGalacticPDF API concurrently, as N Streamlit sessions would
+# (one handle and one thread per user), against the offline stand-ins of offline.py (fake Ollama server, local parser,
+# hashed embeddings). Each user:
+# - uploads a synthetic PDF with tags and waits for its background ingestion job
+# - lists its tags and filters its PDFs by tag
+# - chats for --turns turns (engine fetched on every turn as on a rerun, streamed answers)
+# Concurrency ramps up through --users levels. Every level reports p50/p95/p99 latency per operation, throughput,
+# RSS growth and error rate; the ramp stops early once the error rate or the chat p95 exceeds its limit.
+#
+# Usage: python RAGalacticPDF/benchmarks/load_test.py --users 1 4 16 64 --turns 3 --output load_test.json
+import argparse
+import json
+import tempfile
+import threading
+import time
+import traceback
+from collections import defaultdict
+
+from bench_utils import current_rss_mb
+from offline import FakeOllamaServer, UploadedPDF, offline_environment, install_offline_resources
+from synthetic_pdf import make_pdf_bytes
+
+
+QUESTIONS = ['What is the main topic of section {turn}?', 'Which measurements are described there?',
+             'How does the energy of the system evolve in section {turn}?', 'Summarize the previous answer.']
+
+
+def percentiles(samples_s):
+    if not samples_s:
+        return {}
+    ordered = sorted(samples_s)
+    def at(fraction):
+        return 1000 * ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+    return {'count': len(ordered), 'p50_ms': at(0.50), 'p95_ms': at(0.95), 'p99_ms': at(0.99)}
+
+
+class Recorder():
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def time(self, operation:str, fn):
+        start = time.perf_counter()
+        try:
+            result = fn()
+        except Exception:
+            with self._lock:
+                self.errors[operation] += 1
+            print(f'[{operation}] error: {traceback.format_exc(limit=3).splitlines()[-1]}')
+            raise
+        with self._lock:
+            self.samples[operation].append(time.perf_counter() - start)
+        return result
+
+    def add(self, operation:str, value_s:float):
+        with self._lock:
+            self.samples[operation].append(value_s)
+
+
+def simulated_user(user_idx:int, level:int, args, recorder:Recorder):
+    from rag import RAGalacticPDF
+    user_id = f'load_{level}_{user_idx}'
+    rag = recorder.time('session_start', RAGalacticPDF)
+    recorder.time('set_user_id', lambda: rag.set_user_id(user_id))
+    rag._set_engine_feature(engine_mode='Conversation', llm_knowledge_base=False, streaming=True)
+
+    # Upload: same content for users sharing a seed (ingestion cache hits across users)
+    seed = user_idx % args.distinct_pdfs
+    pdf = UploadedPDF(f'paper_{seed}.pdf', make_pdf_bytes(args.pages, seed=seed))
+    tags = [{'topic': f'topic_{user_idx % 3}'}, {'year': str(2020 + user_idx % 5)}]
+    def upload():
+        job = rag.submit_new_pdf(pdf, tags=tags)
+        while job is not None and job['status'] in ('queued', 'running'):
+            time.sleep(0.05)
+            job = rag.get_ingestion_job(job['job_id'])
+        if job is not None and job['status'] == 'failed':
+            raise RuntimeError(job['error'])
+    recorder.time('upload_until_ready', upload)
+
+    # Tag selection
+    user_tags = recorder.time('get_users_tags', rag.get_users_tags)
+    recorder.time('get_user_pdfs_by_tag', lambda: rag.get_user_pdfs(tagged_with_at_least_one=user_tags[:1]))
+
+    # Multi-turn chat
+    for turn in range(args.turns):
+        engine = recorder.time('get_engine', lambda: rag.load_existing_pdf([pdf.name]))
+        question = QUESTIONS[turn % len(QUESTIONS)].format(turn=turn + 1)
+        rag.manage_chat_history(to_append=('user', question))
+        def chat():
+            start = time.perf_counter()
+            response = rag.run_chat(engine, question)
+            first = None
+            for _ in response.response_gen:
+                if first is None:
+                    first = time.perf_counter() - start
+            recorder.add('chat_ttft', first or 0.0)
+            return response
+        response = recorder.time('chat_turn', chat)
+        rag.manage_chat_history(to_append=('assistant', str(response)))
+
+
+def run_level(level:int, args):
+    recorder = Recorder()
+    rss_before = current_rss_mb()
+    failed_users = []
+    def user_thread(user_idx):
+        try:
+            simulated_user(user_idx, level, args, recorder)
+        except Exception:
+            failed_users.append(user_idx)
+    threads = [threading.Thread(target=user_thread, args=(i,), name=f'user-{i}') for i in range(level)]
+    started_at = time.perf_counter()
+    for thread in threads:
+        thread.start()
+        # Users arrive spread over --arrival-s seconds
+        time.sleep(args.arrival_s / max(1, level))
+    for thread in threads:
+        thread.join()
+    wall_s = time.perf_counter() - started_at
+
+    n_operations = sum(len(samples) for operation, samples in recorder.samples.items() if operation != 'chat_ttft')
+    n_errors = sum(recorder.errors.values())
+    return {
+        'users': level,
+        'wall_s': wall_s,
+        'throughput_ops_per_s': n_operations / wall_s,
+        'chat_turns_per_s': len(recorder.samples['chat_turn']) / wall_s,
+        'error_rate': n_errors / max(1, n_operations + n_errors),
+        'errors': dict(recorder.errors),
+        'failed_users': len(failed_users),
+        'rss_growth_mb': current_rss_mb() - rss_before,
+        'rss_mb': current_rss_mb(),
+        'latency': {operation: percentiles(samples) for operation, samples in recorder.samples.items()},
+    }
+
+
+def print_level(result):
+    chat, ttft, upload = (result['latency'].get(name, {}) for name in ('chat_turn', 'chat_ttft', 'upload_until_ready'))
+    print(f"users={result['users']:<5} ops/s={result['throughput_ops_per_s']:<8.1f} turns/s={result['chat_turns_per_s']:<7.2f} "
+          f"errors={100 * result['error_rate']:.1f}%  rss={result['rss_mb']:.0f}MB (+{result['rss_growth_mb']:.0f})  "
+          f"chat p50/p95/p99={chat.get('p50_ms', 0):.0f}/{chat.get('p95_ms', 0):.0f}/{chat.get('p99_ms', 0):.0f}ms  "
+          f"ttft p95={ttft.get('p95_ms', 0):.0f}ms  upload p95={upload.get('p95_ms', 0):.0f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Concurrent simulated users against the RAGalacticPDF API (offline stand-ins).')
+    parser.add_argument('--users', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument('--turns', type=int, default=3)
+    parser.add_argument('--pages', type=int, default=5)
+    parser.add_argument('--distinct-pdfs', type=int, default=4)
+    parser.add_argument('--arrival-s', type=float, default=1.0, help='time over which the users of a level arrive')
+    parser.add_argument('--ttft-ms', type=float, default=200.0)
+    parser.add_argument('--ms-per-token', type=float, default=20.0)
+    parser.add_argument('--max-error-rate', type=float, default=0.05)
+    parser.add_argument('--max-chat-p95-s', type=float, default=60.0)
+    parser.add_argument('--workdir', default=None)
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    server = FakeOllamaServer(ttft_ms=args.ttft_ms, ms_per_token=args.ms_per_token).start()
+    offline_environment(args.workdir or tempfile.mkdtemp(prefix='ragalactic_load_'), server.base_url)
+    install_offline_resources()
+
+    results = []
+    for level in args.users:
+        result = run_level(level, args)
+        results.append(result)
+        print_level(result)
+        chat_p95_s = result['latency'].get('chat_turn', {}).get('p95_ms', 0) / 1000
+        if result['error_rate'] > args.max_error_rate or chat_p95_s > args.max_chat_p95_s:
+            print(f'Stopping the ramp at {level} users (error rate {100 * result["error_rate"]:.1f}%, chat p95 {chat_p95_s:.1f}s)')
+            break
+    server.stop()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'args': vars(args), 'levels': results}, f, indent=2)
+        print(f'Results written to {args.output}')
@@ -0,0 +1,204 @@
+# Local stand-ins letting the benchmarks build RAGalacticPDF without network access:
+# - FakeOllamaServer: Ollama HTTP API (/api/chat, /api/generate, streamed or not) answering with a configurable latency
+# - HashEmbedding: hashed bag-of-words embedding model (no model download)
+# - the local pypdf parser backend instead of LlamaParse (no API key)
+#
+# Usage from a benchmark script (the environment must be set before the app modules are imported, config reads it once):
+#     server = FakeOllamaServer(ttft_ms=50, ms_per_token=10).start()
+#     offline_environment(workdir, server.base_url)
+#     resources = install_offline_resources()
+#     from rag import RAGalacticPDF
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, List
+
+import numpy as np
+
+from bench_utils import SRC_PATH  # noqa: F401 (adds the app modules to sys.path)
+
+from llama_index.core.base.embeddings.base import BaseEmbedding
+
+
+class _QuietHTTPServer(ThreadingHTTPServer):
+    def handle_error(self, request, client_address):
+        # Clients dropping keep-alive connections (pool shutdown, cancelled streams) are expected
+        pass
+
+
+class FakeOllamaServer():
+    # Answers answer_tokens tokens. The first one comes after ttft_ms plus prompt_ms_per_token per prompt word
+    # (prompt processing), the next ones every ms_per_token.
+    def __init__(self, ttft_ms:float=50.0, ms_per_token:float=10.0, prompt_ms_per_token:float=0.0, answer_tokens:int=64,
+                 host:str='127.0.0.1', port:int=0):
+        self.ttft_ms, self.ms_per_token, self.prompt_ms_per_token = ttft_ms, ms_per_token, prompt_ms_per_token
+        self.answer_tokens = answer_tokens
+        self.n_requests = 0
+        self._lock = threading.Lock()
+        self._server = _QuietHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, name='fake-ollama', daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _tokens(self, prompt:str):
+        # Deterministic answer mentioning words of the prompt
+        words = re.findall(r'\w+', prompt)[-self.answer_tokens:] or ['answer']
+        return [f'{words[i % len(words)]} ' for i in range(self.answer_tokens)]
+
+    def _handler(self):
+        server = self
+
+        class OllamaHandler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                # /api/tags (models list)
+                self._send_json({'models': [{'name': 'llama3'}]})
+
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                with server._lock:
+                    server.n_requests += 1
+                is_chat = self.path.startswith('/api/chat')
+                prompt = ' '.join(message.get('content') or '' for message in payload.get('messages', [])) if is_chat else payload.get('prompt', '')
+                time.sleep((server.ttft_ms + server.prompt_ms_per_token * len(prompt.split())) / 1000)
+                tokens = server._tokens(prompt)
+                if not payload.get('stream', True):
+                    time.sleep(server.ms_per_token * (len(tokens) - 1) / 1000)
+                    self._send_json(self._chunk(is_chat, ''.join(tokens), done=True))
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/x-ndjson')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                for i, token in enumerate(tokens):
+                    if i:
+                        time.sleep(server.ms_per_token / 1000)
+                    self._write_chunk(json.dumps(self._chunk(is_chat, token, done=False)) + '\n')
+                self._write_chunk(json.dumps(self._chunk(is_chat, '', done=True)) + '\n')
+                self.wfile.write(b'0\r\n\r\n')
+
+            def _chunk(self, is_chat:bool, text:str, done:bool):
+                if is_chat:
+                    return {'model': 'llama3', 'message': {'role': 'assistant', 'content': text}, 'done': done}
+                return {'model': 'llama3', 'response': text, 'done': done}
+
+            def _write_chunk(self, text:str):
+                data = text.encode('utf-8')
+                self.wfile.write(f'{len(data):x}\r\n'.encode() + data + b'\r\n')
+                self.wfile.flush()
+
+            def _send_json(self, body):
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return OllamaHandler
+
+
+class HashEmbedding(BaseEmbedding):
+    # Signed feature hashing of the words, L2-normalized: texts sharing words are close, no model weights involved
+    embed_dim: int = 384
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "HashEmbedding"
+
+    def _vector(self, text:str) -> List[float]:
+        vector = np.zeros(self.embed_dim, dtype=np.float32)
+        for word in re.findall(r'\w+', text.lower()):
+            digest = int.from_bytes(hashlib.md5(word.encode('utf-8')).digest()[:8], 'little')
+            vector[digest % self.embed_dim] += 1.0 if (digest >> 32) & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def _get_query_embedding(self, query:str) -> List[float]:
+        return self._vector(query)
+
+    async def _aget_query_embedding(self, query:str) -> List[float]:
+        return self._vector(query)
+
+    def _get_text_embedding(self, text:str) -> List[float]:
+        return self._vector(text)
+
+    def _get_text_embeddings(self, texts:List[str]) -> List[List[float]]:
+        return [self._vector(text) for text in texts]
+
+
+class UploadedPDF():
+    # Same interface as the Streamlit UploadedFile used by RAGalacticPDF (name, getvalue)
+    def __init__(self, name:str, data:bytes):
+        self.name = name
+        self._data = data
+
+    def getvalue(self):
+        return self._data
+
+
+def offline_environment(workdir:str, ollama_base_url:str, **overrides:Any):
+    # Every persistent path in workdir, local parser, LLM calls to the fake server. overrides: extra RAGALACTIC_* settings
+    os.makedirs(workdir, exist_ok=True)
+    env = {
+        'OLLAMA_BASE_URL': ollama_base_url,
+        # No chromadb usage reporting (network)
+        'ANONYMIZED_TELEMETRY': 'False',
+        'RAGALACTIC_PARSER_BACKEND': 'local',
+        # Label of the embedding backend (part of the ingestion cache keys), the model itself is set by install_offline_resources
+        'RAGALACTIC_EMBED_BACKEND': 'hash',
+        'RAGALACTIC_CHROMA_DB_DIR': os.path.join(workdir, 'chroma_db_data'),
+        'RAGALACTIC_INGESTION_CACHE_DIR': os.path.join(workdir, 'ingestion_cache'),
+        'RAGALACTIC_CATALOG_PATH': os.path.join(workdir, 'catalog.sqlite3'),
+        'RAGALACTIC_EXTRACTOR_CHECKPOINT_DIR': os.path.join(workdir, 'extractor_checkpoints'),
+        'RAGALACTIC_EXACT_SEARCH_DIR': os.path.join(workdir, 'exact_search'),
+        'RAGALACTIC_LOG_LEVEL': 'WARNING',
+    }
+    env.update({name: str(value) for name, value in overrides.items()})
+    os.environ.update(env)
+    return env
+
+
+def install_offline_resources(embed_dim:int=384):
+    # Shared resources with the hashed embedding model and without the transforms needing model downloads
+    from llama_index.core.extractors import TitleExtractor, QuestionsAnsweredExtractor, SummaryExtractor, KeywordExtractor
+    from llama_index.core.node_parser import SentenceSplitter
+    from resources import SharedResources, set_shared_resources
+
+    class OfflineResources(SharedResources):
+        def _get_embed_model(self):
+            return HashEmbedding(embed_dim=embed_dim)
+
+        def _get_custom_transforms(self):
+            # Same as the app's custom transforms without the EntityExtractor (downloads a span-marker model)
+            return [
+                SentenceSplitter(separator=" ", chunk_size=1024, chunk_overlap=128),
+                SummaryExtractor(summaries=["prev", "self", "next"]),
+                QuestionsAnsweredExtractor(questions=3),
+                TitleExtractor(nodes=5),
+                KeywordExtractor(),
+                self.embed_model,
+            ]
+
+    resources = OfflineResources()
+    set_shared_resources(resources)
+    return resources
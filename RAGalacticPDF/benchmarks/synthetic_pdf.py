@@ -0,0 +1,51 @@
+# Dependency-free generator of text PDFs of arbitrary size, used as benchmark inputs
+import random
+
+_WORDS = ('quantum state energy wave particle measurement operator matrix vector eigenvalue probability '
+          'amplitude entanglement qubit circuit gate algorithm error correction decoherence hamiltonian '
+          'spin field momentum position uncertainty interference superposition basis observable system').split()
+
+
+def _escape(text:str):
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def _page_lines(rng:random.Random, page_idx:int, lines_per_page:int):
+    lines = [f'{page_idx + 1}. SECTION {page_idx + 1}']
+    for _ in range(lines_per_page - 1):
+        lines.append(' '.join(rng.choice(_WORDS) for _ in range(12)).capitalize() + '.')
+    return lines
+
+
+def make_pdf_bytes(n_pages:int, lines_per_page:int=40, seed:int=0) -> bytes:
+    rng = random.Random(seed)
+    # Objects 1: catalog, 2: page tree, 3: font, then (page, content stream) pairs
+    objects = [None, None, b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>']
+    page_ids = []
+    for page_idx in range(n_pages):
+        text_ops = ' T* '.join(f'({_escape(line)}) Tj' for line in _page_lines(rng, page_idx, lines_per_page))
+        stream = f'BT /F1 10 Tf 14 TL 50 800 Td {text_ops} ET'.encode('latin-1')
+        content_id = len(objects) + 2
+        page_ids.append(len(objects) + 1)
+        objects.append(f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Resources << /Font << /F1 3 0 R >> >> /Contents {content_id} 0 R >>'.encode('latin-1'))
+        objects.append(b'<< /Length ' + str(len(stream)).encode() + b' >>\nstream\n' + stream + b'\nendstream')
+    objects[0] = b'<< /Type /Catalog /Pages 2 0 R >>'
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(f'{page_id} 0 R' for page_id in page_ids)}] /Count {n_pages} >>".encode('latin-1')
+
+    output = bytearray(b'%PDF-1.4\n')
+    offsets = []
+    for obj_idx, obj in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += f'{obj_idx} 0 obj\n'.encode() + obj + b'\nendobj\n'
+    xref_offset = len(output)
+    output += f'xref\n0 {len(objects) + 1}\n0000000000 65535 f \n'.encode()
+    for offset in offsets:
+        output += f'{offset:010d} 00000 n \n'.encode()
+    output += f'trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n'.encode()
+    return bytes(output)
+
+
+def make_pdf(path:str, n_pages:int, lines_per_page:int=40, seed:int=0):
+    with open(path, 'wb') as f:
+        f.write(make_pdf_bytes(n_pages, lines_per_page=lines_per_page, seed=seed))
+    return path
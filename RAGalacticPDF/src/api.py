@@ -0,0 +1,372 @@
+# Async HTTP API over RAGalacticPDF, alternative front end to the Streamlit app (app.py).
+# Same shared resources (models, chroma client, catalog, caches, LLM scheduler) for every request of the process.
+# Blocking work (retrieval, condense step, chroma / catalog access) runs in worker threads, answers are streamed to the
+# clients as server-sent events: the event loop only relays tokens pulled by a bounded pool of stream workers
+# (config.API_MAX_STREAMS streams at once, the next ones wait for a free worker; a disconnected client frees its worker
+# and cancels the LLM stream, releasing its scheduler slot).
+#
+# Run: uvicorn api:app --app-dir RAGalacticPDF/src --host 0.0.0.0 --port 8000   (or python RAGalacticPDF/src/api.py)
+#
+# Endpoints:
+#   PUT    /users/{user_id}/pdfs/{file_name}       body: pdf bytes (Content-Type: application/pdf), ?tags=name::value&tags=...
+#                                                  -> 202 + ingestion job (background), 200 if already loaded, 400 if unreadable
+#                                                  ?replace=true: new version of a loaded file (only changed chunks re-embedded)
+#   DELETE /users/{user_id}/pdfs/{file_name}
+#   GET    /users/{user_id}/jobs[/{job_id}]        ingestion jobs progress
+#   GET    /users/{user_id}/pdfs                   ?tagged_with_all=name::value ... / ?tagged_with_at_least_one=name::value ...
+#   GET    /users/{user_id}/tags
+#   POST   /users/{user_id}/query                  {"question", "pdf_names", "llm_knowledge_base", "stream"}
+#   POST   /users/{user_id}/conversations/{conversation_id}/messages   {"message", "pdf_names", "llm_knowledge_base", "stream"}
+#   DELETE /users/{user_id}/conversations/{conversation_id}
+#   GET    /metrics, /health
+# Streamed answers: 'token' events ({"delta"}), then a 'done' event ({"response", "sources"}) or an 'error' event ({"error"}).
+import startup_profile  # noqa: F401 (first import: times the imports below when RAGALACTIC_STARTUP_PROFILE is set)
+import io
+import json
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+
+from fastapi import FastAPI, HTTPException, Path, Query, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel
+from typing_extensions import Annotated
+
+from pydantic_valids import validate_pdf_input
+from rag import RAGalacticPDF
+from resources import get_shared_resources
+from engine_cache import TTLLRUCache
+from llm_scheduler import llm_stream_cancel
+from telemetry import registry
+from config import API_HOST, API_PORT, API_MAX_CONVERSATIONS, API_CONVERSATION_TTL_S, API_MAX_STREAMS, LOG_LEVEL
+
+import logging
+logging.basicConfig(level=LOG_LEVEL)
+
+
+# Tag format of the app: 'name::value'
+TAG_NAME_VALUE_SEP = '::'
+
+_END_OF_STREAM = object()
+
+# User ids name the users' chroma collections: 3-63 characters, alphanumeric at both ends, '_' or '-' in between
+UserId = Annotated[str, Path(pattern=r'^[A-Za-z0-9][A-Za-z0-9_-]{1,61}[A-Za-z0-9]$')]
+
+
+class QueryRequest(BaseModel):
+    question: str
+    # None: every PDF of the user
+    pdf_names: Optional[List[str]] = None
+    llm_knowledge_base: bool = False
+    stream: bool = True
+
+
+class ChatRequest(BaseModel):
+    message: str
+    pdf_names: Optional[List[str]] = None
+    llm_knowledge_base: bool = False
+    stream: bool = True
+
+
+class _RequestPDF():
+    # Same interface as the Streamlit UploadedFile (name, type, getvalue) for the request body
+    def __init__(self, name:str, content_type:str, data:bytes):
+        self.name = name
+        self.type = content_type
+        self.data = data
+
+    def getvalue(self):
+        return self.data
+
+
+class _Conversation():
+    # Session handle of a conversation (chat history and memory), turns of a conversation run one at a time
+    def __init__(self, handle:RAGalacticPDF):
+        self.handle = handle
+        self.lock = asyncio.Lock()
+
+
+# Conversations of every user, (user_id, conversation_id) -> _Conversation
+conversations = TTLLRUCache(max_size=API_MAX_CONVERSATIONS, ttl_s=API_CONVERSATION_TTL_S)
+
+# Workers pulling the tokens of the streamed answers
+stream_executor = ThreadPoolExecutor(max_workers=API_MAX_STREAMS, thread_name_prefix='sse-stream')
+
+
+@asynccontextmanager
+async def lifespan(app:FastAPI):
+    # Models and clients built once before serving (not on the first request)
+    await asyncio.to_thread(get_shared_resources)
+    yield
+
+
+app = FastAPI(title='RAGalactic', lifespan=lifespan)
+
+
+###                 ###
+###     HELPERS     ###
+###                 ###
+
+def _new_handle(user_id:UserId, llm_mode:str, llm_knowledge_base:bool, streaming:bool):
+    # Lightweight handle over the shared resources (blocking: the user's collection may be opened)
+    handle = RAGalacticPDF()
+    handle.set_user_id(user_id)
+    handle._set_engine_feature(engine_mode=llm_mode, llm_knowledge_base=llm_knowledge_base, streaming=streaming)
+    return handle
+
+
+def _parse_tags(tags:Optional[List[str]]):
+    if not tags:
+        return None
+    try:
+        return [{name: value} for tag in tags for name, value in [tag.split(TAG_NAME_VALUE_SEP)]]
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid tag entry, expected 'name{TAG_NAME_VALUE_SEP}value'")
+
+
+def _check_readable_pdf(data:bytes):
+    # Rejected before a job is created: bytes pypdf cannot open, or a PDF without pages
+    from pypdf import PdfReader
+    try:
+        n_pages = len(PdfReader(io.BytesIO(data)).pages)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f'Unreadable PDF: {e}')
+    if not n_pages:
+        raise HTTPException(status_code=400, detail='Empty PDF (no pages)')
+
+
+def _sources(response):
+    # Names of the PDFs the answer was built from (empty for answers served from the answer cache)
+    file_names = [node.metadata.get('file_name') for node in getattr(response, 'source_nodes', None) or []]
+    return list(dict.fromkeys(name for name in file_names if name))
+
+
+def _sse(event:str, data:Dict):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def _stream_in_thread(gen, llm_cancel:threading.Event):
+    # Async view of a blocking token generator: a stream worker pulls the tokens and hands them to the event loop,
+    # so a waiting stream holds neither the event loop nor a worker of the default executor.
+    # The consumer going away (client disconnect cancels the response) stops the worker at the next token and sets
+    # llm_cancel, the cancel event of the LLM streams started for the answer (see llm_scheduler.llm_stream_cancel)
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    cancelled = threading.Event()
+
+    def put(item):
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, item)
+        except RuntimeError:
+            # Event loop closed (server shutdown)
+            cancelled.set()
+
+    def pump():
+        error = None
+        try:
+            # Checked before each token: a stream cancelled while waiting for a worker never starts its LLM call
+            while not cancelled.is_set():
+                chunk = next(gen, _END_OF_STREAM)
+                if chunk is _END_OF_STREAM:
+                    break
+                put((chunk, None))
+        except Exception as e:
+            error = e
+        finally:
+            # Ends a query engine's LLM stream. A chat engine's LLM stream is consumed by its history writer thread
+            # and only stops through llm_cancel
+            if hasattr(gen, 'close'):
+                gen.close()
+            put((_END_OF_STREAM, error))
+
+    stream_executor.submit(pump)
+    try:
+        while True:
+            chunk, error = await queue.get()
+            if chunk is _END_OF_STREAM:
+                if error is not None:
+                    raise error
+                return
+            yield chunk
+    finally:
+        cancelled.set()
+        llm_cancel.set()
+
+
+async def _answer_events(response, llm_cancel:threading.Event, on_complete=None, **labels):
+    # 'token' events while the answer is generated, then 'done' (or 'error')
+    chunks = []
+    with registry.span('api_stream', **labels):
+        try:
+            async for chunk in _stream_in_thread(iter(response.response_gen), llm_cancel):
+                chunks.append(chunk)
+                yield _sse('token', {'delta': chunk})
+        except Exception as e:
+            logging.exception('API: answer stream failed')
+            yield _sse('error', {'error': str(e)})
+            return
+    text = ''.join(chunks)
+    if on_complete is not None:
+        on_complete(text)
+    yield _sse('done', {'response': text, 'sources': _sources(response)})
+
+
+def _sse_response(events):
+    # No proxy buffering: tokens reach the client as they are generated
+    return StreamingResponse(events, media_type='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+def _json_answer(response):
+    return {'response': str(response), 'sources': _sources(response)}
+
+
+
+###                 ###
+###    ENDPOINTS    ###
+###                 ###
+
+@app.get('/health')
+async def health():
+    return {'status': 'ok'}
+
+
+@app.get('/metrics', response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(await asyncio.to_thread(registry.export_prometheus), media_type='text/plain; version=0.0.4')
+
+
+@app.put('/users/{user_id}/pdfs/{file_name}')
+async def upload_pdf(user_id:UserId, file_name:str, request:Request, tags:Optional[List[str]] = Query(None), retry:bool=False,
+                     replace:bool=False):
+    pdf_input = _RequestPDF(file_name, request.headers.get('content-type', ''), await request.body())
+    try:
+        validate_pdf_input(pdf_input)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    await asyncio.to_thread(_check_readable_pdf, pdf_input.getvalue())
+    parsed_tags = _parse_tags(tags)
+
+    def submit():
+        handle = RAGalacticPDF()
+        handle.set_user_id(user_id)
+        return handle.submit_new_pdf(pdf_input, tags=parsed_tags, retry=retry, replace=replace)
+    # Ingestion runs in the background job manager, poll /users/{user_id}/jobs/{job_id}
+    job = await asyncio.to_thread(submit)
+    if job is None:
+        return {'status': 'already_loaded', 'file_name': file_name}
+    return JSONResponse(job, status_code=202)
+
+
+@app.delete('/users/{user_id}/pdfs/{file_name}')
+async def delete_pdf(user_id:UserId, file_name:str):
+    def delete():
+        handle = RAGalacticPDF()
+        handle.set_user_id(user_id)
+        return handle.delete_pdf(file_name)
+    if not await asyncio.to_thread(delete):
+        raise HTTPException(status_code=404, detail='Unknown pdf')
+    return {'deleted': file_name}
+
+
+@app.get('/users/{user_id}/jobs')
+async def list_jobs(user_id:UserId, active_only:bool=False):
+    return get_shared_resources().job_manager.get_user_jobs(user_id, active_only=active_only)
+
+
+@app.get('/users/{user_id}/jobs/{job_id}')
+async def get_job(user_id:UserId, job_id:str):
+    job = get_shared_resources().job_manager.get_job(job_id)
+    if job is None or job['user_id'] != user_id:
+        raise HTTPException(status_code=404, detail='Unknown job')
+    return job
+
+
+@app.get('/users/{user_id}/pdfs')
+async def list_pdfs(user_id:UserId, tagged_with_all:Optional[List[str]] = Query(None), tagged_with_at_least_one:Optional[List[str]] = Query(None)):
+    catalog = get_shared_resources().catalog
+    files = await asyncio.to_thread(catalog.get_files, user_id, tagged_with_all=_parse_tags(tagged_with_all),
+                                    tagged_with_at_least_one=_parse_tags(tagged_with_at_least_one))
+    return {'pdfs': files or []}
+
+
+@app.get('/users/{user_id}/tags')
+async def list_tags(user_id:UserId):
+    tags = await asyncio.to_thread(get_shared_resources().catalog.get_tags, user_id)
+    return {'tags': [f'{name}{TAG_NAME_VALUE_SEP}{value}' for tag in tags or [] for name, value in tag.items()]}
+
+
+@app.post('/users/{user_id}/query')
+async def query(user_id:UserId, body:QueryRequest):
+    llm_cancel = threading.Event()
+
+    def run():
+        # Stateless: a fresh handle per request (engines and answers still come from the shared caches)
+        handle = _new_handle(user_id, 'Questions', body.llm_knowledge_base, body.stream)
+        engine = handle.load_existing_pdf(body.pdf_names)
+        with llm_stream_cancel(llm_cancel):
+            return handle.run_query(engine, body.question)
+    response = await asyncio.to_thread(run)
+    if not body.stream:
+        return _json_answer(response)
+    return _sse_response(_answer_events(response, llm_cancel, endpoint='query'))
+
+
+@app.post('/users/{user_id}/conversations/{conversation_id}/messages')
+async def chat(user_id:UserId, conversation_id:str, body:ChatRequest):
+    key = (user_id, conversation_id)
+    conversation = conversations.get(key)
+    if conversation is None:
+        # Concurrent first messages of a conversation: the first one stored is kept, the other handles are dropped
+        conversation = conversations.setdefault(key, _Conversation(await asyncio.to_thread(_new_handle, user_id, 'Conversation',
+                                                                                         body.llm_knowledge_base, body.stream)))
+    handle = conversation.handle
+    llm_cancel = threading.Event()
+
+    def run():
+        # Changing the knowledge base flag restarts the conversation, as in the app
+        if body.llm_knowledge_base != handle.llm_knowledge_base:
+            handle._set_engine_feature(llm_knowledge_base=body.llm_knowledge_base)
+        # Streaming or not is per request and keeps the conversation
+        handle.streaming = body.stream
+        engine = handle.load_existing_pdf(body.pdf_names)
+        handle.manage_chat_history(to_append=('user', body.message))
+        with llm_stream_cancel(llm_cancel):
+            return handle.run_chat(engine, body.message)
+
+    def on_complete(text:str):
+        handle.manage_chat_history(to_append=('assistant', text))
+
+    if not body.stream:
+        # Turns of a conversation are serialized (each one builds on the previous answer)
+        async with conversation.lock:
+            response = await asyncio.to_thread(run)
+            on_complete(str(response))
+        return _json_answer(response)
+
+    async def events():
+        # The turn holds the conversation until its answer is fully streamed
+        async with conversation.lock:
+            try:
+                response = await asyncio.to_thread(run)
+            except Exception as e:
+                logging.exception('API: chat turn failed')
+                yield _sse('error', {'error': str(e)})
+                return
+            async for event in _answer_events(response, llm_cancel, on_complete=on_complete, endpoint='chat'):
+                yield event
+    return _sse_response(events())
+
+
+@app.delete('/users/{user_id}/conversations/{conversation_id}')
+async def delete_conversation(user_id:UserId, conversation_id:str):
+    n_deleted = conversations.invalidate(lambda key: key == (user_id, conversation_id))
+    if not n_deleted:
+        raise HTTPException(status_code=404, detail='Unknown conversation')
+    return {'deleted': conversation_id}
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host=API_HOST, port=API_PORT)
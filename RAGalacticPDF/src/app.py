@@ -1,3 +1,4 @@
+import startup_profile  # noqa: F401 (first import: times the imports below when RAGALACTIC_STARTUP_PROFILE is set)
 import os
 import yaml 
 import base64
@@ -8,15 +9,20 @@ import streamlit as st
 from streamlit_cookies_manager import EncryptedCookieManager
 from pydantic_valids import validate_pdf_input
 from rag import RAGalacticPDF
+from config import INGESTION_JOB_POLL_INTERVAL_S, LOG_LEVEL
+from telemetry import registry
 
 from typing import List, Dict, Tuple
 import logging
-logging.basicConfig(level=logging.DEBUG)
+logging.basicConfig(level=LOG_LEVEL)
     
 logging.debug(f'CHECK MAIN')
 
 from llama_index.core.llms import ChatMessage
 
+# Part of the page rerun on its own (st.fragment since streamlit 1.37, experimental before)
+_fragment = getattr(st, 'fragment', None) or st.experimental_fragment
+
 
 class RAGPDFapp():
     def __init__(self):
@@ -66,11 +72,16 @@ class RAGPDFapp():
         ###                    ###
         ###       RUN APP      ###
         ###                    ###
-        self.ask_app_parameters()
-        self.ask_input()
-        logging.debug(f'CLASS INIT: {st.session_state}')
-        self.run_chatbot()
-        logging.debug(f'AFTER CHAT MESSAGE: {st.session_state}')
+        rerun_started_at = time.perf_counter()
+        with registry.span('app_rerun'):
+            self.ask_app_parameters()
+            self.ask_input()
+            self.run_chatbot()
+        # Sampled summary of the rerun (instead of dumping the whole session state)
+        registry.event('rerun', user_id=self.user_id, llm_mode=st.session_state.llm_mode, input_source=st.session_state.input_source,
+                       streaming=st.session_state.streaming, n_messages=len(st.session_state.messages),
+                       duration_s=round(time.perf_counter() - rerun_started_at, 3))
+        self.show_ingestion_jobs()
 
 
 
@@ -313,10 +324,20 @@ class RAGPDFapp():
         if st.session_state.get('pdf_input', None):
             # Validate pdf input through pydantic
             validate_pdf_input(st.session_state.pdf_input)
-            engine = st.session_state.RAG_CLS_INST.load_new_pdf(st.session_state.pdf_input, tags=st.session_state.tags_pdf_input)
+            # Ingestion runs in a background job: submitting returns immediately (and returns the same job on every rerun)
+            job = st.session_state.RAG_CLS_INST.submit_new_pdf(st.session_state.pdf_input, tags=st.session_state.tags_pdf_input)
             #for session_attr in ['tags_str', 'tags_pdf_input']:
             #    self._manage_session_state(session_attr, reset=True)     
-            self._chat_with_pdf(engine)
+            if job is None or job['status'] == 'done':
+                engine = st.session_state.RAG_CLS_INST.load_existing_pdf([st.session_state.pdf_input.name])
+                self._chat_with_pdf(engine)
+            elif job['status'] == 'failed':
+                st.error(f"Ingestion of {job['file_name']} failed: {job['error']}")
+                if st.button('Retry ingestion'):
+                    st.session_state.RAG_CLS_INST.submit_new_pdf(st.session_state.pdf_input, tags=st.session_state.tags_pdf_input, retry=True)
+                    st.rerun()
+            else:
+                st.info(f"{job['file_name']} is being ingested, you can start chatting once it is done (progress in the sidebar).")
     
     def previously_loaded_pdf(self, files=None):
         logging.debug(f'PREVIOUSLY LOADED PDF FOR CHAT')
@@ -331,7 +352,6 @@ class RAGPDFapp():
             self._chat_with_pdf(engine)
             
     def _chat_with_pdf(self, engine):
-        logging.debug(f'HISTORY: {st.session_state.RAG_CLS_INST.chat_history}')
         if prompt := st.chat_input("Start chatting with your PDF."):
             st.session_state.messages.append({"role": "user", "content": prompt}) 
             
@@ -348,8 +368,31 @@ class RAGPDFapp():
                 st.session_state.messages.append({"role": "assistant", "content": str(response)})
                 self._add_to_chat_history('system', str(rag_response))
 
+    def show_ingestion_jobs(self):
+        # Progress of the user's queued / running ingestion jobs (also the ones submitted by previous reruns or sessions)
+        if not st.session_state.RAG_CLS_INST.get_ingestion_jobs(active_only=True):
+            return
+        with st.sidebar:
+            self._ingestion_jobs_panel()
+
+    @_fragment(run_every=INGESTION_JOB_POLL_INTERVAL_S)
+    def _ingestion_jobs_panel(self):
+        # Only this panel is redrawn while jobs are pending
+        jobs = st.session_state.RAG_CLS_INST.get_ingestion_jobs(active_only=True)
+        if not jobs:
+            # Every job finished: a full rerun shows their outcome (chat enabled, errors)
+            st.rerun()
+        st.write('Ingestion in progress:')
+        for job in jobs:
+            if job['status'] == 'queued':
+                text = f"{job['file_name']}: queued"
+            else:
+                stage_progress = f" ({job['stage_done']}/{job['stage_total']})" if job['stage_total'] > 1 else ''
+                text = f"{job['file_name']}: {job['stage'] or 'starting'}{stage_progress}"
+            st.progress(job['fraction'], text=text)
+
     def _add_to_chat_history(self, who:str, message:str):
-        logging.debug(f'HISTORY: {st.session_state.RAG_CLS_INST.chat_history}')
+        registry.event('chat_message', user_id=self.user_id, role=who, n_chars=len(message), history_length=len(st.session_state.chat_history) + 1)
         st.session_state.chat_history.append(ChatMessage(role=who, content=message))
         st.session_state.RAG_CLS_INST.chat_history = st.session_state.chat_history
             
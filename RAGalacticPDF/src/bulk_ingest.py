@@ -0,0 +1,261 @@
+# Bulk ingestion of a directory of PDFs for a user (e.g. onboarding a team's shared library), outside of the Streamlit app.
+# Files go through the pipeline by windows of --window files:
+# - parsing in a process pool, one file per task (the next windows are parsed while the current one is embedded)
+# - chunking (and custom transforms' extraction, with its checkpoints) per file, then embedding of the nodes of the
+#   whole window in large batches (--embed-batch-size)
+# - a single bulk add of the window's nodes in chroma, then the catalog entries
+# Each completed file is appended to a checkpoint (one json line): a rerun skips completed files. Files already in the
+# catalog with the same content are skipped too, and identical bytes already ingested (ingestion cache) are neither
+# parsed nor embedded again. Same metadata, tags and ingestion cache entries as uploads through the app.
+#
+# Usage: python RAGalacticPDF/src/bulk_ingest.py ./library --user-id team_lab --tags topic::physics lab::optics [--recursive]
+import os
+import json
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List
+
+from config import EXTRACTOR_CHECKPOINT_DIR, PARSER_BACKEND
+
+import logging
+
+
+# Tag format of the app: 'name::value'
+TAG_NAME_VALUE_SEP = '::'
+
+# Parser of each pool worker process, built on its first file
+_worker_parsers = {}
+
+
+def _parse_file(file_path:str, parser_backend:str):
+    # Runs in the pool workers. Same reader call as RAGalacticPDF._parse_pdf, the local parser being single-process here
+    # (files are the unit of parallelism). Returns (number of pages, documents).
+    from pypdf import PdfReader
+    from llama_index.core import SimpleDirectoryReader
+    from parsers import get_parser
+    if parser_backend not in _worker_parsers:
+        _worker_parsers[parser_backend] = get_parser(parser_backend, local_max_workers=1)
+    docs = SimpleDirectoryReader(input_files=[file_path], filename_as_id=True,
+                                 file_extractor={".pdf": _worker_parsers[parser_backend]}).load_data()
+    return len(PdfReader(file_path).pages), docs
+
+
+def _noop():
+    pass
+
+
+def parse_tags(tags:List[str]):
+    try:
+        return [{name: value} for tag in tags or [] for name, value in [tag.split(TAG_NAME_VALUE_SEP)]]
+    except ValueError:
+        raise ValueError(f"Invalid tag entry in {tags}, expected 'name{TAG_NAME_VALUE_SEP}value'")
+
+
+def list_pdfs(directory:str, recursive:bool=False):
+    # File names relative to the directory (the names shown in the app), sorted for a stable order across reruns
+    if not recursive:
+        return sorted(name for name in os.listdir(directory) if name.lower().endswith('.pdf') and os.path.isfile(os.path.join(directory, name)))
+    names = []
+    for root, _, files in os.walk(directory):
+        names.extend(os.path.relpath(os.path.join(root, name), directory).replace(os.sep, '/') for name in files if name.lower().endswith('.pdf'))
+    return sorted(names)
+
+
+class BulkCheckpoint():
+    # Append-only json lines file of the completed files, {file_name, content_hash, pages, chunks}
+    def __init__(self, path:str):
+        self.path = path
+        self.completed = set()
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Line cut by an interruption
+                        continue
+                    self.completed.add((entry['file_name'], entry['content_hash']))
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def is_completed(self, file_name:str, content_hash:str):
+        return (file_name, content_hash) in self.completed
+
+    def record(self, file_name:str, content_hash:str, **stats):
+        with open(self.path, 'a') as f:
+            f.write(json.dumps({'file_name': file_name, 'content_hash': content_hash, **stats, 'completed_at': time.time()}) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self.completed.add((file_name, content_hash))
+
+
+class BulkIngestion():
+    def __init__(self, rag, executor, checkpoint:BulkCheckpoint, tags:List[Dict]=None, window:int=32, embed_batch_size:int=256,
+                 replace:bool=False):
+        self.rag = rag
+        self.executor = executor
+        self.checkpoint = checkpoint
+        self.tags = tags
+        self.window = window
+        self.replace = replace
+        # The embedding model itself, without the micro-batching service sized for interactive queries
+        self.embed_model = rag.resources.base_embed_model
+        self.embed_model.embed_batch_size = embed_batch_size
+        self.flavour = rag._transforms_flavour()
+        self.stats = {'files': 0, 'pages': 0, 'chunks': 0, 'skipped': 0, 'replaced': 0, 'failed': 0}
+
+    def _start(self, directory:str, file_name:str, pdf_hash:str):
+        # Pending item of the pipeline: parsed documents (future), cached documents or cached nodes
+        from pypdf import PdfReader
+        file_path = os.path.join(directory, file_name)
+        item = {'file_name': file_name, 'file_path': file_path, 'pdf_hash': pdf_hash, 'nodes': None, 'docs': None, 'future': None}
+        item['nodes'] = self.rag.ingestion_cache.get_nodes(pdf_hash, flavour=self.flavour)
+        if item['nodes'] is None:
+            item['docs'] = self.rag.ingestion_cache.get_documents(pdf_hash, parser_backend=self.rag.parser_backend)
+        if item['nodes'] is None and item['docs'] is None:
+            item['future'] = self.executor.submit(_parse_file, file_path, self.rag.parser_backend)
+        else:
+            item['pages'] = len(PdfReader(file_path).pages)
+        return item
+
+    def _chunk(self, item):
+        # Chunked (and extracted) nodes of the item, not embedded yet when not from the ingestion cache.
+        # Raises ValueError when the file yields no text or no chunks (counted as failed, retried by the next run).
+        if item['future'] is not None:
+            item['pages'], item['docs'] = item['future'].result()
+            if not any((doc.text or '').strip() for doc in item['docs']):
+                raise ValueError(f"No text could be extracted from {item['file_name']} (unreadable or empty PDF)")
+            self.rag.ingestion_cache.put_documents(item['pdf_hash'], item['docs'], parser_backend=self.rag.parser_backend)
+        if item['nodes'] is not None:
+            return item['nodes'], False
+        nodes = self.rag._create_nodes(item['docs'], checkpoint_key=self.rag._checkpoint_key(item['file_name'], item['pdf_hash'], self.flavour),
+                                        embed=False)
+        if not nodes:
+            raise ValueError(f"No chunks were produced from {item['file_name']}")
+        return nodes, True
+
+    def _ingest_window(self, items:List[Dict]):
+        ready, to_embed = [], []
+        for item in items:
+            try:
+                nodes, needs_embedding = self._chunk(item)
+            except Exception as e:
+                logging.error(f"BULK INGEST: {item['file_name']} failed: {e}")
+                self.stats['failed'] += 1
+                continue
+            if needs_embedding:
+                to_embed.extend(nodes)
+            ready.append((item, nodes, needs_embedding))
+        if to_embed:
+            self.embed_model(to_embed)
+        window_nodes = []
+        for item, nodes, needs_embedding in ready:
+            if needs_embedding:
+                self.rag.ingestion_cache.put_nodes(item['pdf_hash'], nodes, flavour=self.flavour)
+            # Nodes left by an interrupted run (written but not yet in the catalog) are replaced
+            self.rag.chroma_collection.delete(where=self.rag._file_where(item['file_name']))
+            window_nodes.extend(self.rag._add_metadata_tags(nodes, file_name=item['file_name'], tags=self.tags))
+        if window_nodes:
+            # Bulk add (split in chroma's maximum batch size by the vector store)
+            self.rag.vector_store.add(window_nodes)
+        for item, nodes, _ in ready:
+            self.rag.catalog.add_file(self.rag.user_id, item['file_name'], tags=self.tags, content_hash=item['pdf_hash'])
+            self.checkpoint.record(item['file_name'], item['pdf_hash'], pages=item['pages'], chunks=len(nodes))
+            self.stats['files'] += 1
+            self.stats['pages'] += item['pages']
+            self.stats['chunks'] += len(nodes)
+
+    def _to_ingest(self, directory:str, file_name:str):
+        # Content hash of a file to ingest, None for the files to skip (completed, already loaded). Files loaded with a
+        # different content are replaced in place with --replace.
+        from rag import _UploadedPDF
+        with open(os.path.join(directory, file_name), 'rb') as f:
+            data = f.read()
+        pdf_hash = self.rag.ingestion_cache.hash_pdf(data)
+        if self.checkpoint.is_completed(file_name, pdf_hash):
+            self.stats['skipped'] += 1
+            return None
+        if not self.rag.catalog.has_file(self.rag.user_id, file_name):
+            return pdf_hash
+        if self.rag.catalog.get_content_hash(self.rag.user_id, file_name) == pdf_hash:
+            self.stats['skipped'] += 1
+        elif self.replace:
+            self.rag._replace_pdf(_UploadedPDF(file_name, data), pdf_hash)
+            self.stats['replaced'] += 1
+        else:
+            logging.warning(f'BULK INGEST: {file_name} already loaded with a different content, skipped (--replace to update it)')
+            self.stats['skipped'] += 1
+        self.checkpoint.record(file_name, pdf_hash, pages=0, chunks=0)
+        return None
+
+    def run(self, directory:str, file_names:List[str], progress=print):
+        start = time.perf_counter()
+        todo = deque()
+        for file_name in file_names:
+            pdf_hash = self._to_ingest(directory, file_name)
+            if pdf_hash is not None:
+                todo.append((file_name, pdf_hash))
+        progress(f"{len(todo)} files to ingest, {self.stats['skipped']} skipped, {self.stats['replaced']} replaced")
+        in_flight = deque()
+        n_files = len(todo)
+
+        def submit_more():
+            # Parsing runs up to two windows ahead of the embedding
+            while todo and len(in_flight) < 2 * self.window:
+                in_flight.append(self._start(directory, *todo.popleft()))
+        submit_more()
+        while in_flight:
+            window = [in_flight.popleft() for _ in range(min(self.window, len(in_flight)))]
+            submit_more()
+            self._ingest_window(window)
+            elapsed = time.perf_counter() - start
+            progress(f"[{self.stats['files'] + self.stats['failed']}/{n_files}] {self.stats['pages']} pages, {self.stats['chunks']} chunks, {elapsed:.0f}s")
+        self.stats['elapsed_s'] = time.perf_counter() - start
+        if self.stats['files']:
+            # The user's cached indexes, engines and answers in this process (the app's are keyed by the catalog fingerprint)
+            self.rag._invalidate_file_set()
+        return self.stats
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='Ingest every PDF of a directory for a user.')
+    parser.add_argument('directory')
+    parser.add_argument('--user-id', required=True)
+    parser.add_argument('--tags', nargs='*', default=[], help=f"tags of every file, 'name{TAG_NAME_VALUE_SEP}value'")
+    parser.add_argument('--recursive', action='store_true', help='include subdirectories (file names relative to the directory)')
+    parser.add_argument('--parser-backend', default=PARSER_BACKEND, choices=['llamaparse', 'local'])
+    parser.add_argument('--custom-transforms', action='store_true', help='custom transforms (LLM metadata extractors)')
+    parser.add_argument('--replace', action='store_true', help='replace files already loaded with a different content')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='parsing processes')
+    parser.add_argument('--window', type=int, default=32, help='files embedded and written together')
+    parser.add_argument('--embed-batch-size', type=int, default=256)
+    parser.add_argument('--checkpoint', default=None, help='defaults to bulk_<user_id>.jsonl in the extractor checkpoints directory')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    try:
+        tags = parse_tags(args.tags)
+    except ValueError as e:
+        parser.error(str(e))
+    file_names = list_pdfs(args.directory, recursive=args.recursive)
+    # Workers started (forked) before the models and clients are built
+    executor = ProcessPoolExecutor(max_workers=args.workers)
+    executor.submit(_noop).result()
+
+    from rag import RAGalacticPDF
+    rag = RAGalacticPDF()
+    rag.set_user_id(args.user_id)
+    rag.set_parser(args.parser_backend)
+    rag.use_custom_transforms = args.custom_transforms
+    checkpoint = BulkCheckpoint(args.checkpoint or os.path.join(EXTRACTOR_CHECKPOINT_DIR, f'bulk_{args.user_id}.jsonl'))
+    ingestion = BulkIngestion(rag, executor, checkpoint, tags=tags, window=args.window, embed_batch_size=args.embed_batch_size,
+                              replace=args.replace)
+    try:
+        stats = ingestion.run(args.directory, file_names)
+    finally:
+        executor.shutdown(wait=True)
+    elapsed = max(stats['elapsed_s'], 1e-9)
+    print(f"{stats['files']} files ({stats['pages']} pages, {stats['chunks']} chunks) in {elapsed:.1f}s: "
+          f"{stats['files'] / elapsed:.2f} files/s, {stats['pages'] / elapsed:.1f} pages/s, {stats['chunks'] / elapsed:.1f} chunks/s "
+          f"({stats['skipped']} skipped, {stats['replaced']} replaced, {stats['failed']} failed)")
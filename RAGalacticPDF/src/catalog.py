@@ -0,0 +1,240 @@
+# Import modules
+import os
+import json
+import hashlib
+import time
+import sqlite3
+import threading
+from typing import Dict, List
+
+import logging
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    file_name TEXT NOT NULL,
+    content_hash TEXT,
+    added_at REAL NOT NULL,
+    UNIQUE (user_id, file_name)
+);
+CREATE TABLE IF NOT EXISTS tags (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    value TEXT NOT NULL,
+    UNIQUE (name, value)
+);
+CREATE TABLE IF NOT EXISTS file_tags (
+    file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    tag_id INTEGER NOT NULL REFERENCES tags(id) ON DELETE CASCADE,
+    PRIMARY KEY (file_id, tag_id)
+);
+CREATE TABLE IF NOT EXISTS catalog_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_files_file_name ON files (file_name);
+CREATE INDEX IF NOT EXISTS idx_tags_value ON tags (value);
+CREATE INDEX IF NOT EXISTS idx_file_tags_tag ON file_tags (tag_id, file_id);
+'''
+
+
+class PDFCatalog():
+    # SQLite (WAL mode) catalog of the PDFs loaded by each user and of their tags.
+    # files(user_id, file_name) -< file_tags >- tags(name, value). Tag queries are answered in SQL.
+    def __init__(self, db_path:str):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        # One connection per thread (sqlite3 connections must not be shared between threads)
+        self._local = threading.local()
+        self._get_conn().executescript(SCHEMA)
+
+    def _get_conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30.0, isolation_level=None)
+            # WAL: readers never block the writer and vice versa
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA foreign_keys=ON')
+            self._local.conn = conn
+        return conn
+
+    def _connection(self, write:bool=False):
+        return _Transaction(self._get_conn(), immediate=write)
+
+
+
+    ###            ###
+    ###   WRITES   ###
+    ###            ###
+
+    def _insert_file(self, conn, user_id:str, file_name:str, tags:List[Dict]=None, content_hash:str=None):
+        cursor = conn.execute('INSERT OR IGNORE INTO files (user_id, file_name, content_hash, added_at) VALUES (?, ?, ?, ?)',
+                              (user_id, file_name, content_hash, time.time()))
+        # File already in the catalog: keep its tags untouched (same behaviour as the former json catalog)
+        if not cursor.rowcount:
+            return False
+        file_id = cursor.lastrowid
+        for dict_tag in tags or []:
+            # Single entry dict
+            tag_name, tag_value = next(iter(dict_tag.items()))
+            conn.execute('INSERT OR IGNORE INTO tags (name, value) VALUES (?, ?)', (tag_name, str(tag_value)))
+            tag_id = conn.execute('SELECT id FROM tags WHERE name = ? AND value = ?', (tag_name, str(tag_value))).fetchone()[0]
+            conn.execute('INSERT OR IGNORE INTO file_tags (file_id, tag_id) VALUES (?, ?)', (file_id, tag_id))
+        return True
+
+    def add_file(self, user_id:str, file_name:str, tags:List[Dict]=None, content_hash:str=None):
+        with self._connection(write=True) as conn:
+            return self._insert_file(conn, user_id, file_name, tags=tags, content_hash=content_hash)
+
+    def update_file(self, user_id:str, file_name:str, content_hash:str):
+        # New content of a file (tags kept): the fingerprint of every file set including it changes
+        with self._connection(write=True) as conn:
+            return bool(conn.execute('UPDATE files SET content_hash = ?, added_at = ? WHERE user_id = ? AND file_name = ?',
+                                     (content_hash, time.time(), user_id, file_name)).rowcount)
+
+    def remove_file(self, user_id:str, file_name:str):
+        # Its file_tags rows go with it (ON DELETE CASCADE), tags no longer attached to any file are simply never listed
+        with self._connection(write=True) as conn:
+            return bool(conn.execute('DELETE FROM files WHERE user_id = ? AND file_name = ?', (user_id, file_name)).rowcount)
+
+
+
+    ###            ###
+    ###   READS    ###
+    ###            ###
+
+    def has_file(self, user_id:str, file_name:str):
+        with self._connection() as conn:
+            return conn.execute('SELECT 1 FROM files WHERE user_id = ? AND file_name = ?', (user_id, file_name)).fetchone() is not None
+
+    def get_content_hash(self, user_id:str, file_name:str):
+        with self._connection() as conn:
+            row = conn.execute('SELECT content_hash FROM files WHERE user_id = ? AND file_name = ?', (user_id, file_name)).fetchone()
+        return row[0] if row else None
+
+    def get_file_tags(self, user_id:str, file_name:str):
+        with self._connection() as conn:
+            rows = conn.execute('''
+                SELECT t.name, t.value FROM tags t
+                JOIN file_tags ft ON ft.tag_id = t.id
+                JOIN files f ON f.id = ft.file_id
+                WHERE f.user_id = ? AND f.file_name = ?
+                ORDER BY t.name, t.value
+            ''', (user_id, file_name)).fetchall()
+        return [{tag_name: tag_value} for tag_name, tag_value in rows] or None
+
+    def get_files_fingerprint(self, user_id:str, file_names:List[str]=None):
+        # Digest of the content of a file set (every file of the user when file_names is None).
+        # Changes whenever a file of the set is added, re-ingested or removed.
+        with self._connection() as conn:
+            rows = conn.execute('SELECT file_name, content_hash, added_at FROM files WHERE user_id = ? ORDER BY file_name', (user_id,)).fetchall()
+        if file_names is not None:
+            file_names = set(file_names)
+            rows = [row for row in rows if row[0] in file_names]
+        return hashlib.sha256(repr(rows).encode('utf-8')).hexdigest()
+
+    def _tags_condition(self, tags:List[Dict]):
+        conditions, params = [], []
+        for dict_tag in tags:
+            tag_name, tag_value = next(iter(dict_tag.items()))
+            conditions.append('(t.name = ? AND t.value = ?)')
+            params.extend([tag_name, str(tag_value)])
+        return ' OR '.join(conditions), params
+
+    def get_files(self, user_id:str, tagged_with_all:List[Dict]=None, tagged_with_at_least_one:List[Dict]=None):
+        with self._connection() as conn:
+            if not tagged_with_all and not tagged_with_at_least_one:
+                rows = conn.execute('SELECT file_name FROM files WHERE user_id = ? ORDER BY file_name', (user_id,)).fetchall()
+                # None when the user never loaded any pdf
+                return [row[0] for row in rows] or None
+
+            tags = tagged_with_all if tagged_with_all else tagged_with_at_least_one
+            condition, params = self._tags_condition(tags)
+            query = f'''
+                SELECT f.file_name FROM files f
+                JOIN file_tags ft ON ft.file_id = f.id
+                JOIN tags t ON t.id = ft.tag_id
+                WHERE f.user_id = ? AND ({condition})
+                GROUP BY f.id
+            '''
+            if tagged_with_all:
+                # "all of": every requested (distinct) tag is attached to the file
+                n_distinct_tags = len({next(iter(dict_tag.items())) for dict_tag in tagged_with_all})
+                query += ' HAVING COUNT(DISTINCT t.id) = ?'
+                params.append(n_distinct_tags)
+            rows = conn.execute(query + ' ORDER BY f.file_name', [user_id, *params]).fetchall()
+            return [row[0] for row in rows]
+
+    def get_tags(self, user_id:str):
+        with self._connection() as conn:
+            rows = conn.execute('''
+                SELECT DISTINCT t.name, t.value FROM tags t
+                JOIN file_tags ft ON ft.tag_id = t.id
+                JOIN files f ON f.id = ft.file_id
+                WHERE f.user_id = ?
+                ORDER BY t.name, t.value
+            ''', (user_id,)).fetchall()
+        # List of single entry dict (sorted by dict key first and then by dict value) or None
+        return [{tag_name: tag_value} for tag_name, tag_value in rows] or None
+
+    def get_meta(self, key:str):
+        with self._connection() as conn:
+            row = conn.execute('SELECT value FROM catalog_meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key:str, value:str):
+        with self._connection(write=True) as conn:
+            conn.execute('INSERT OR REPLACE INTO catalog_meta (key, value) VALUES (?, ?)', (key, value))
+
+
+
+    ###            ###
+    ###  MIGRATION ###
+    ###            ###
+
+    def migrate_from_json(self, json_path:str):
+        # One-shot import of the former data/json_ids.json catalog ({user_id: {'files': [...], 'tags': [[{name: value}, ...], ...]}})
+        with self._connection(write=True) as conn:
+            if conn.execute("SELECT 1 FROM catalog_meta WHERE key = 'json_migrated'").fetchone():
+                return 0
+            if not os.path.exists(json_path):
+                return 0
+            with open(json_path, 'r') as f:
+                json_data = json.load(f)
+
+            n_files = 0
+            for user_id, user_data in json_data.items():
+                for file_name, tags in zip(user_data.get('files', []), user_data.get('tags', [])):
+                    n_files += self._insert_file(conn, user_id, file_name, tags=tags)
+            conn.execute("INSERT INTO catalog_meta (key, value) VALUES ('json_migrated', ?)", (json_path,))
+        logging.info(f'CATALOG: migrated {n_files} files from {json_path}')
+        return n_files
+
+
+class _Transaction():
+    # Context manager running the statements of the block in a single transaction (connections are in autocommit mode)
+    def __init__(self, conn, immediate:bool=False):
+        self.conn = conn
+        self.immediate = immediate
+
+    def __enter__(self):
+        # IMMEDIATE for writes: take the write lock upfront so that concurrent writers wait (busy timeout) instead of failing on upgrade
+        self.conn.execute('BEGIN IMMEDIATE' if self.immediate else 'BEGIN')
+        return self.conn
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.conn.execute('COMMIT' if exc_type is None else 'ROLLBACK')
+        return False
+
+
+if __name__ == "__main__":
+    import argparse
+    from config import CATALOG_PATH, LEGACY_JSON_CATALOG_PATH
+    parser = argparse.ArgumentParser(description='Migrate the json_ids.json catalog to the SQLite catalog.')
+    parser.add_argument('--json', default=LEGACY_JSON_CATALOG_PATH)
+    parser.add_argument('--db', default=CATALOG_PATH)
+    args = parser.parse_args()
+    print(f'{PDFCatalog(args.db).migrate_from_json(args.json)} files migrated to {args.db}')
@@ -0,0 +1,148 @@
+# Import modules
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, List, Optional
+
+from llama_index.core import PromptTemplate
+from llama_index.core.llms import LLM, ChatMessage, MessageRole
+from llama_index.core.memory import BaseMemory, ChatMemoryBuffer
+from llama_index.core.bridge.pydantic import PrivateAttr
+
+from llm_scheduler import llm_priority, BACKGROUND
+
+import logging
+
+
+SUMMARY_PROMPT = PromptTemplate(
+    "Progressively summarize the conversation between a user and an AI assistant about PDF documents, "
+    "adding the new lines of conversation onto the current summary. Keep the facts, document names and "
+    "open questions the conversation may refer back to. Return only the new summary.\n\n"
+    "Current summary:\n{summary}\n\n"
+    "New lines of conversation:\n{new_lines}\n\n"
+    "New summary:"
+)
+
+
+class RollingSummaryMemory(BaseMemory):
+    # Chat memory keeping the last recent_turns user turns verbatim and older turns folded into a summary.
+    # Folding runs on a background executor once messages leave the verbatim window (i.e. after the answer
+    # was written to the memory, at the end of the stream): until then they are still returned verbatim.
+    recent_turns: int = 4
+
+    _llm: Any = PrivateAttr()
+    _executor: Any = PrivateAttr()
+    _lock: Any = PrivateAttr()
+    _recent: List[ChatMessage] = PrivateAttr()
+    _pending: List[ChatMessage] = PrivateAttr()
+    _summary: str = PrivateAttr()
+    _summarizing: bool = PrivateAttr()
+    _generation: int = PrivateAttr()
+
+    def __init__(self, llm:LLM, executor:Optional[ThreadPoolExecutor]=None, recent_turns:int=4, **kwargs:Any):
+        super().__init__(recent_turns=recent_turns, **kwargs)
+        self._llm = llm
+        self._executor = executor or ThreadPoolExecutor(max_workers=1, thread_name_prefix='memory-summarizer')
+        self._lock = threading.RLock()
+        self._recent, self._pending, self._summary = [], [], ''
+        self._summarizing = False
+        # Incremented on reset / set: a summary computed for a previous conversation is discarded
+        self._generation = 0
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "RollingSummaryMemory"
+
+    @classmethod
+    def from_defaults(cls, llm:LLM=None, chat_history:Optional[List[ChatMessage]]=None, **kwargs:Any) -> "RollingSummaryMemory":
+        memory = cls(llm=llm, **kwargs)
+        memory._recent = list(chat_history or [])
+        memory._evict()
+        return memory
+
+    def _summary_message(self):
+        return [ChatMessage(role=MessageRole.SYSTEM, content=f'Summary of the earlier conversation: {self._summary}')] if self._summary else []
+
+    def get(self, input:Optional[str]=None, **kwargs:Any) -> List[ChatMessage]:
+        with self._lock:
+            return [*self._summary_message(), *self._pending, *self._recent]
+
+    def get_all(self) -> List[ChatMessage]:
+        return self.get()
+
+    def put(self, message:ChatMessage) -> None:
+        with self._lock:
+            self._recent.append(message)
+            self._evict()
+
+    def set(self, messages:List[ChatMessage]) -> None:
+        with self._lock:
+            self._reset()
+            self._recent = list(messages)
+            self._evict()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._reset()
+
+    def _reset(self):
+        self._recent, self._pending, self._summary = [], [], ''
+        self._generation += 1
+
+    def _evict(self):
+        # Move the oldest turns (a user message and the answers that follow it) out of the verbatim window
+        user_positions = [i for i, message in enumerate(self._recent) if message.role == MessageRole.USER]
+        if len(user_positions) <= self.recent_turns:
+            return
+        cut = user_positions[len(user_positions) - self.recent_turns]
+        self._pending.extend(self._recent[:cut])
+        self._recent = self._recent[cut:]
+        if not self._summarizing:
+            self._summarizing = True
+            self._executor.submit(self._summarize)
+
+    def _summarize(self):
+        while True:
+            with self._lock:
+                to_fold, summary, generation = list(self._pending), self._summary, self._generation
+                if not to_fold:
+                    self._summarizing = False
+                    return
+            new_lines = '\n'.join(f'{message.role.value}: {message.content}' for message in to_fold)
+            try:
+                with llm_priority(BACKGROUND):
+                    new_summary = self._llm.predict(SUMMARY_PROMPT, summary=summary or '(empty)', new_lines=new_lines).strip()
+            except Exception:
+                # The messages stay verbatim in the pending list, folding is retried on the next eviction
+                logging.exception('CHAT MEMORY: summarization failed')
+                with self._lock:
+                    self._summarizing = False
+                return
+            with self._lock:
+                if generation != self._generation:
+                    # The conversation was reset meanwhile
+                    continue
+                self._summary = new_summary
+                self._pending = self._pending[len(to_fold):]
+            logging.debug(f'CHAT MEMORY: folded {len(to_fold)} messages into the summary')
+
+    def wait_idle(self, timeout:float=None):
+        # Block until every evicted message is folded in the summary (benchmarks)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                if not self._summarizing:
+                    return True
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+
+
+def new_chat_memory(mode:str, llm:LLM=None, executor:Optional[ThreadPoolExecutor]=None, recent_turns:int=4,
+                    token_limit:int=10000, chat_history:Optional[List[ChatMessage]]=None):
+    # 'buffer': whole history up to token_limit tokens (llama_index default), 'rolling_summary': RollingSummaryMemory
+    if mode == 'buffer':
+        return ChatMemoryBuffer.from_defaults(token_limit=token_limit, chat_history=chat_history)
+    if mode == 'rolling_summary':
+        return RollingSummaryMemory.from_defaults(llm=llm, executor=executor, recent_turns=recent_turns, chat_history=chat_history)
+    raise ValueError(f"Unknown chat memory mode '{mode}'. Available modes: buffer, rolling_summary.")
@@ -0,0 +1,155 @@
+# Chroma layouts of the users' nodes (config.COLLECTION_LAYOUT) and migration between them:
+# - per_user: one collection per user, named after the user_id
+# - shared: a single SHARED_COLLECTION_NAME collection, each node carrying its user_id metadata
+# Nodes are copied with their ids, embeddings, documents and metadata (no re-embedding). Source collections are only deleted
+# once copied, so an interrupted migration can simply be run again. Stop the app (and the API) while migrating, then restart
+# it with RAGALACTIC_COLLECTION_LAYOUT set to the new layout.
+#
+# Usage: python RAGalacticPDF/src/collection_layout.py --to shared [--keep-source] [--batch-size 1000]
+from typing import Callable
+
+import chromadb
+from chromadb.config import Settings as ChromaSettings
+from chromadb.db.base import UniqueConstraintError
+
+from config import (CHROMA_DB_DIR, CHROMA_MEMORY_LIMIT_MB, SHARED_COLLECTION_NAME,
+                    HNSW_SPACE, HNSW_M, HNSW_CONSTRUCTION_EF, HNSW_SEARCH_EF)
+
+import logging
+
+
+LAYOUTS = ('per_user', 'shared')
+
+# Catalog meta entry recording the layout of the data on disk
+LAYOUT_META_KEY = 'collection_layout'
+
+
+def new_chroma_client(path:str=CHROMA_DB_DIR):
+    # Clients of a path share a single chroma system, so every client (app, tools) is built with the same settings
+    settings = ChromaSettings()
+    if CHROMA_MEMORY_LIMIT_MB:
+        # Loaded collection indexes evicted least recently used first beyond the limit
+        settings = ChromaSettings(chroma_segment_cache_policy='LRU', chroma_memory_limit_bytes=CHROMA_MEMORY_LIMIT_MB * 1024 * 1024)
+    return chromadb.PersistentClient(path=path, settings=settings)
+
+
+def hnsw_metadata(space:str=HNSW_SPACE, m:int=HNSW_M, construction_ef:int=HNSW_CONSTRUCTION_EF, search_ef:int=HNSW_SEARCH_EF):
+    return {'hnsw:space': space, 'hnsw:M': m, 'hnsw:construction_ef': construction_ef, 'hnsw:search_ef': search_ef}
+
+
+def get_or_create_collection(client, name:str, metadata:dict=None):
+    # The HNSW parameters of a collection are fixed at creation: existing collections are opened as they are (chroma's
+    # get_or_create_collection would overwrite their recorded metadata without changing their index)
+    try:
+        return client.get_collection(name=name)
+    except ValueError:
+        pass
+    try:
+        return client.create_collection(name=name, metadata=metadata or hnsw_metadata())
+    except UniqueConstraintError:
+        # Created concurrently by another session
+        return client.get_collection(name=name)
+
+
+def check_layout(catalog, layout:str):
+    # The layout is recorded on first start, a later mismatch means the data was not migrated
+    recorded_layout = catalog.get_meta(LAYOUT_META_KEY)
+    if recorded_layout is None:
+        catalog.set_meta(LAYOUT_META_KEY, layout)
+    elif recorded_layout != layout:
+        logging.warning(f'COLLECTION LAYOUT: configured {layout} but the stored nodes use {recorded_layout}, '
+                        f'run collection_layout.py --to {layout} (previously loaded PDFs are not found until then)')
+
+
+def _pages(collection, batch_size:int):
+    offset = 0
+    while True:
+        page = collection.get(limit=batch_size, offset=offset, include=['embeddings', 'documents', 'metadatas'])
+        if not page['ids']:
+            return
+        yield page
+        offset += len(page['ids'])
+
+
+def _copy(page, target, user_id:str=None, indices=None):
+    # Nodes of the page at indices (all of them by default) upserted in target, tagged with user_id when given
+    indices = range(len(page['ids'])) if indices is None else indices
+    metadatas = [page['metadatas'][i] or {} for i in indices]
+    if user_id is not None:
+        metadatas = [{**metadata, 'user_id': user_id} for metadata in metadatas]
+    target.upsert(ids=[page['ids'][i] for i in indices], embeddings=[page['embeddings'][i] for i in indices],
+                  documents=[page['documents'][i] for i in indices], metadatas=metadatas)
+
+
+def migrate_to_shared(client, shared_name:str=SHARED_COLLECTION_NAME, batch_size:int=1000, keep_source:bool=False,
+                      progress:Callable=print):
+    shared = get_or_create_collection(client, shared_name)
+    n_users, n_nodes = 0, 0
+    for collection in client.list_collections():
+        if collection.name == shared_name:
+            continue
+        user_id, n_user_nodes = collection.name, 0
+        for page in _pages(collection, batch_size):
+            _copy(page, shared, user_id=user_id)
+            n_user_nodes += len(page['ids'])
+        # Deleted only once every node is in the shared collection
+        n_copied = len(shared.get(where={'user_id': user_id}, include=[])['ids'])
+        if n_copied < n_user_nodes:
+            raise RuntimeError(f'{user_id}: {n_copied} nodes in {shared_name} out of {n_user_nodes}, source collection kept')
+        if not keep_source:
+            client.delete_collection(name=user_id)
+        n_users, n_nodes = n_users + 1, n_nodes + n_user_nodes
+        progress(f'{user_id}: {n_user_nodes} nodes')
+    return n_users, n_nodes
+
+
+def migrate_to_per_user(client, shared_name:str=SHARED_COLLECTION_NAME, batch_size:int=1000, keep_source:bool=False,
+                        progress:Callable=print):
+    if shared_name not in [collection.name for collection in client.list_collections()]:
+        return 0, 0
+    shared = client.get_collection(name=shared_name)
+    users, n_nodes = {}, 0
+    for page in _pages(shared, batch_size):
+        page_users = {}
+        for i, metadata in enumerate(page['metadatas']):
+            page_users.setdefault((metadata or {}).get('user_id'), []).append(i)
+        for user_id, indices in page_users.items():
+            if user_id is None:
+                logging.warning(f'COLLECTION LAYOUT: {len(indices)} nodes without user_id skipped')
+                continue
+            if user_id not in users:
+                users[user_id] = get_or_create_collection(client, user_id)
+            _copy(page, users[user_id], indices=indices)
+            n_nodes += len(indices)
+        progress(f'{n_nodes} nodes, {len(users)} users')
+    if not keep_source:
+        client.delete_collection(name=shared_name)
+    return len(users), n_nodes
+
+
+def migrate(layout:str, client=None, catalog=None, batch_size:int=1000, keep_source:bool=False, progress:Callable=print):
+    if layout not in LAYOUTS:
+        raise ValueError(f'Unknown collection layout {layout}, expected one of {LAYOUTS}')
+    client = client or new_chroma_client()
+    migrate_fn = migrate_to_shared if layout == 'shared' else migrate_to_per_user
+    n_users, n_nodes = migrate_fn(client, batch_size=batch_size, keep_source=keep_source, progress=progress)
+    if catalog is not None:
+        catalog.set_meta(LAYOUT_META_KEY, layout)
+    logging.info(f'COLLECTION LAYOUT: migrated {n_nodes} nodes of {n_users} users to the {layout} layout')
+    return n_users, n_nodes
+
+
+if __name__ == "__main__":
+    import argparse
+    from catalog import PDFCatalog
+    from config import CATALOG_PATH
+    parser = argparse.ArgumentParser(description='Migrate the stored nodes between the per_user and shared collection layouts.')
+    parser.add_argument('--to', required=True, choices=LAYOUTS)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--keep-source', action='store_true', help='keep the source collections after copying')
+    parser.add_argument('--chroma-dir', default=CHROMA_DB_DIR)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    n_users, n_nodes = migrate(args.to, client=new_chroma_client(args.chroma_dir), catalog=PDFCatalog(CATALOG_PATH),
+                               batch_size=args.batch_size, keep_source=args.keep_source)
+    print(f'Migrated {n_nodes} nodes of {n_users} users, set RAGALACTIC_COLLECTION_LAYOUT={args.to} before restarting the app')
@@ -0,0 +1,169 @@
+# Offline maintenance of the chroma collections (stop the app and the API first, as for collection_layout.py).
+# The HNSW parameters of a collection (hnsw:space, M, construction_ef, search_ef) are fixed when it is created, and deleted
+# or replaced nodes are only marked as such in its index files (data_level0.bin / link_lists.bin never shrink). A rebuild
+# copies the nodes (ids, embeddings, documents, metadata: no re-embedding) into a new collection created with the requested
+# parameters, which then takes the name of the original one: new parameters applied and index compacted.
+# Index size, build time, query latency and recall@k (against an exact search over the stored vectors) are reported
+# before and after.
+#
+# Usage: python RAGalacticPDF/src/collection_maintenance.py --collections alice bob [--m 32 --construction-ef 200 --search-ef 64]
+#        python RAGalacticPDF/src/collection_maintenance.py --all --report-only
+# Collections are named after the users in the per_user layout (config.SHARED_COLLECTION_NAME in the shared layout).
+import os
+import time
+import sqlite3
+from typing import Callable, Dict
+
+import numpy as np
+
+from collection_layout import hnsw_metadata, get_or_create_collection, _pages, _copy
+from config import CHROMA_DB_DIR
+
+import logging
+
+
+# Suffix of the collection being built during a rebuild
+REBUILD_SUFFIX = '_rebuild'
+
+
+def vector_segment(chroma_dir:str, collection):
+    # Id and HNSW parameters of the index actually used by the collection (its recorded metadata may differ)
+    with sqlite3.connect(f"file:{os.path.join(chroma_dir, 'chroma.sqlite3')}?mode=ro", uri=True) as conn:
+        row = conn.execute("SELECT id FROM segments WHERE collection = ? AND scope = 'VECTOR'", (str(collection.id),)).fetchone()
+        if row is None:
+            return None, {}
+        params = conn.execute('SELECT key, str_value, int_value, float_value FROM segment_metadata WHERE segment_id = ?', (row[0],)).fetchall()
+    return row[0], {key: next(value for value in values if value is not None) for key, *values in params}
+
+
+def index_size_mb(chroma_dir:str, segment_id:str):
+    # HNSW files of the collection (only written once chroma flushed its index, hnsw:sync_threshold)
+    segment_dir = os.path.join(chroma_dir, segment_id or '')
+    if not segment_id or not os.path.isdir(segment_dir):
+        return 0.0
+    return sum(os.path.getsize(os.path.join(segment_dir, name)) for name in os.listdir(segment_dir)) / (1024 * 1024)
+
+
+def _distances(vectors, queries, space:str):
+    # Exact distances of every query to every stored vector, as computed by chroma for the space
+    dots = queries @ vectors.T
+    if space == 'cosine':
+        norms = np.linalg.norm(vectors, axis=1)[None, :] * np.linalg.norm(queries, axis=1)[:, None]
+        return 1.0 - dots / np.maximum(norms, 1e-12)
+    if space == 'ip':
+        return 1.0 - dots
+    return (vectors ** 2).sum(1)[None, :] - 2 * dots
+
+
+def _exact_top_k(vectors, queries, space:str, top_k:int, block_rows:int=100000):
+    # Row indices of the top_k nearest stored vectors of each query, merged over blocks of stored vectors
+    best_rows = np.empty((len(queries), 0), dtype=np.int64)
+    best_distances = np.empty((len(queries), 0), dtype=np.float32)
+    for start in range(0, len(vectors), block_rows):
+        block = vectors[start:start + block_rows]
+        distances = np.concatenate([best_distances, _distances(block, queries, space)], axis=1)
+        rows = np.concatenate([best_rows, np.broadcast_to(np.arange(start, start + len(block)), (len(queries), len(block)))], axis=1)
+        top = np.argsort(distances, axis=1)[:, :top_k]
+        best_rows, best_distances = np.take_along_axis(rows, top, axis=1), np.take_along_axis(distances, top, axis=1)
+    return best_rows
+
+
+def evaluate(collection, space:str, n_queries:int=100, top_k:int=5, batch_size:int=1000, seed:int=0):
+    # Queries between two stored vectors (mean of a random pair), answered by the collection and by an exact search
+    ids, vectors = [], []
+    for page in _pages(collection, batch_size):
+        ids.extend(page['ids'])
+        vectors.extend(page['embeddings'])
+    if not ids:
+        return {'nodes': 0}
+    vectors = np.asarray(vectors, dtype=np.float32)
+    rng = np.random.default_rng(seed)
+    pairs = rng.integers(0, len(ids), (n_queries, 2))
+    queries = (vectors[pairs[:, 0]] + vectors[pairs[:, 1]]) / 2
+    top_k = min(top_k, len(ids))
+    exact = _exact_top_k(vectors, queries, space, top_k)
+    samples, hits = [], 0
+    for query, expected in zip(queries, exact):
+        start = time.perf_counter()
+        result = collection.query(query_embeddings=[query.tolist()], n_results=top_k, include=['distances'])
+        samples.append(time.perf_counter() - start)
+        hits += len(set(result['ids'][0]) & {ids[i] for i in expected})
+    samples.sort()
+    return {'nodes': len(ids), 'query_p50_ms': 1000 * samples[len(samples) // 2],
+            'query_p95_ms': 1000 * samples[min(len(samples) - 1, int(0.95 * len(samples)))], f'recall@{top_k}': hits / (top_k * len(queries))}
+
+
+def rebuild(client, name:str, metadata:Dict, batch_size:int=1000):
+    # Returns the rebuilt collection. An interrupted rebuild is resumed (or restarted) by running it again.
+    names = {collection.name for collection in client.list_collections()}
+    rebuild_name = f'{name}{REBUILD_SUFFIX}'
+    if name not in names and rebuild_name in names:
+        # Interrupted after the original was deleted: the copy is complete
+        client.get_collection(name=rebuild_name).modify(name=name)
+        return client.get_collection(name=name)
+    if rebuild_name in names:
+        client.delete_collection(name=rebuild_name)
+    source = client.get_collection(name=name)
+    target = get_or_create_collection(client, rebuild_name, metadata=metadata)
+    for page in _pages(source, batch_size):
+        _copy(page, target)
+    if target.count() != source.count():
+        raise RuntimeError(f'{name}: {target.count()} nodes copied out of {source.count()}, original collection kept')
+    client.delete_collection(name=name)
+    target.modify(name=name)
+    return client.get_collection(name=name)
+
+
+def maintain(client, name:str, metadata:Dict=None, report_only:bool=False, chroma_dir:str=CHROMA_DB_DIR, n_queries:int=100,
+             top_k:int=5, batch_size:int=1000, progress:Callable=print):
+    metadata = metadata or hnsw_metadata()
+
+    def report(collection):
+        segment_id, params = vector_segment(chroma_dir, collection)
+        space = params.get('hnsw:space', 'l2')
+        return {'index_mb': index_size_mb(chroma_dir, segment_id), 'params': params,
+                **evaluate(collection, space, n_queries=n_queries, top_k=top_k, batch_size=batch_size)}
+
+    result = {'collection': name, 'before': report(client.get_collection(name=name))}
+    progress(f"{name} before: {result['before']}")
+    if not report_only:
+        start = time.perf_counter()
+        collection = rebuild(client, name, metadata, batch_size=batch_size)
+        result['build_s'] = time.perf_counter() - start
+        result['after'] = report(collection)
+        progress(f"{name} rebuilt in {result['build_s']:.1f}s, after: {result['after']}")
+    logging.info(f'COLLECTION MAINTENANCE: {result}')
+    return result
+
+
+if __name__ == "__main__":
+    import json
+    import argparse
+    from collection_layout import new_chroma_client
+    parser = argparse.ArgumentParser(description='Rebuild (new HNSW parameters, compaction) and report on chroma collections.')
+    targets = parser.add_mutually_exclusive_group(required=True)
+    targets.add_argument('--collections', nargs='+', help='user ids (per_user layout) or the shared collection name')
+    targets.add_argument('--all', action='store_true')
+    parser.add_argument('--report-only', action='store_true', help='measure without rebuilding')
+    defaults = hnsw_metadata()
+    parser.add_argument('--space', default=defaults['hnsw:space'], choices=['l2', 'cosine', 'ip'])
+    parser.add_argument('--m', type=int, default=defaults['hnsw:M'])
+    parser.add_argument('--construction-ef', type=int, default=defaults['hnsw:construction_ef'])
+    parser.add_argument('--search-ef', type=int, default=defaults['hnsw:search_ef'])
+    parser.add_argument('--queries', type=int, default=100)
+    parser.add_argument('--top-k', type=int, default=5)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--chroma-dir', default=CHROMA_DB_DIR)
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    client = new_chroma_client(args.chroma_dir)
+    names = args.collections or [collection.name for collection in client.list_collections() if not collection.name.endswith(REBUILD_SUFFIX)]
+    metadata = hnsw_metadata(space=args.space, m=args.m, construction_ef=args.construction_ef, search_ef=args.search_ef)
+    results = [maintain(client, name, metadata=metadata, report_only=args.report_only, chroma_dir=args.chroma_dir,
+                        n_queries=args.queries, top_k=args.top_k, batch_size=args.batch_size) for name in names]
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f'Results written to {args.output}')
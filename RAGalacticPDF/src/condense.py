@@ -0,0 +1,138 @@
+# Import modules
+import re
+import time
+import hashlib
+import threading
+from collections import defaultdict
+from typing import List
+
+from llama_index.core.llms import LLM, ChatMessage
+from llama_index.core.base.llms.generic_utils import messages_to_history_str
+
+from engine_cache import TTLLRUCache
+from query_cache import normalize_query
+
+import logging
+
+
+# 'always': llama_index behaviour, an LLM call for every question asked after the first one
+# 'heuristic': no call either when the question reads as self-contained
+# 'cached': heuristic, and questions already condensed against the same last exchange reuse the previous rewrite
+CONDENSE_STRATEGIES = ('always', 'heuristic', 'cached')
+
+# Words pointing back at the conversation: a question containing one of them needs the history to be understood
+_REFERRING_WORDS = frozenset('it its it\'s this that these those they them their theirs he she him his her hers '
+                             'there here above previous previously earlier former latter same also again else '
+                             'more other another further elaborate continue'.split())
+_FOLLOW_UP_STARTS = ('and ', 'but ', 'so ', 'then ', 'what about', 'how about', 'why not', 'why?', 'how so', 'and?')
+# Below this many words, a question is too short to be trusted as self-contained ("why?", "in which year?")
+_MIN_SELF_CONTAINED_WORDS = 5
+
+
+def is_self_contained(question:str):
+    # Conservative: any doubt sends the question to the condense LLM
+    text = question.strip().lower()
+    words = re.findall(r"[\w']+", text)
+    if len(words) < _MIN_SELF_CONTAINED_WORDS:
+        return False
+    if text.startswith(_FOLLOW_UP_STARTS):
+        return False
+    return not any(word in _REFERRING_WORDS for word in words)
+
+
+class QuestionCondenser():
+    # Turns the latest message of a conversation into the standalone question used for retrieval
+    # (condense step of the condense_plus_context chat engine), with one of CONDENSE_STRATEGIES.
+    # The rewrite can use a smaller, faster model than the one answering (llm).
+    # Also keeps, per strategy, the condense calls saved and the time to first token of the answers.
+    def __init__(self, llm:LLM, strategy:str='cached', cache_size:int=1024, cache_ttl_s:float=3600.0):
+        if strategy not in CONDENSE_STRATEGIES:
+            raise ValueError(f"Unknown condense strategy '{strategy}'. Available strategies: {', '.join(CONDENSE_STRATEGIES)}.")
+        self.llm = llm
+        self.strategy = strategy
+        self._cache = TTLLRUCache(max_size=cache_size, ttl_s=cache_ttl_s)
+        self._stats = defaultdict(lambda: {'turns': 0, 'llm_calls': 0, 'skipped': 0, 'cache_hits': 0, 'condense_s': 0.0,
+                                           'answers': 0, 'ttft_s': 0.0, 'max_ttft_s': 0.0})
+        self._lock = threading.Lock()
+
+    def _cache_key(self, chat_history:List[ChatMessage], question:str):
+        # The rewrite resolves references mostly against the last exchange (last question and its answer)
+        last_exchange = messages_to_history_str(chat_history[-2:])
+        return (hashlib.sha256(last_exchange.encode('utf-8')).hexdigest(), normalize_query(question))
+
+    def _count(self, name:str, value=1):
+        with self._lock:
+            self._stats[self.strategy][name] += value
+
+    def _shortcut(self, chat_history:List[ChatMessage], question:str):
+        # (condensed question if no LLM call is needed else None, cache key)
+        self._count('turns')
+        if not chat_history or (self.strategy != 'always' and is_self_contained(question)):
+            self._count('skipped')
+            return question, None
+        key = self._cache_key(chat_history, question) if self.strategy == 'cached' else None
+        if key is not None:
+            condensed = self._cache.get(key)
+            if condensed is not None:
+                self._count('cache_hits')
+                return condensed, key
+        return None, key
+
+    def _record_call(self, key, question:str, condensed:str, started_at:float):
+        elapsed = time.perf_counter() - started_at
+        self._count('llm_calls')
+        self._count('condense_s', elapsed)
+        logging.debug(f'CONDENSE: "{question}" -> "{condensed}" in {elapsed:.2f}s')
+        if key is not None:
+            self._cache.set(key, condensed)
+
+    def condense(self, chat_history:List[ChatMessage], question:str, prompt_template) -> str:
+        condensed, key = self._shortcut(chat_history, question)
+        if condensed is not None:
+            return condensed
+        started_at = time.perf_counter()
+        condensed = self.llm.predict(prompt_template, question=question, chat_history=messages_to_history_str(chat_history))
+        self._record_call(key, question, condensed, started_at)
+        return condensed
+
+    async def acondense(self, chat_history:List[ChatMessage], question:str, prompt_template) -> str:
+        condensed, key = self._shortcut(chat_history, question)
+        if condensed is not None:
+            return condensed
+        started_at = time.perf_counter()
+        condensed = await self.llm.apredict(prompt_template, question=question, chat_history=messages_to_history_str(chat_history))
+        self._record_call(key, question, condensed, started_at)
+        return condensed
+
+    def record_ttft(self, ttft_s:float):
+        with self._lock:
+            stats = self._stats[self.strategy]
+            stats['answers'] += 1
+            stats['ttft_s'] += ttft_s
+            stats['max_ttft_s'] = max(stats['max_ttft_s'], ttft_s)
+
+    def timed_stream(self, chat_stream, started_at:float):
+        # Forwards the answer's token stream, recording the time to its first token (measured from the start of the chat call)
+        first = True
+        for chunk in chat_stream:
+            if first:
+                self.record_ttft(time.perf_counter() - started_at)
+                first = False
+            yield chunk
+
+    def metrics(self):
+        # Per strategy (the strategy of a shared condenser can be switched between measurements)
+        with self._lock:
+            stats = {strategy: dict(values) for strategy, values in self._stats.items()}
+        metrics = {}
+        for strategy, values in stats.items():
+            metrics[strategy] = {
+                'turns': values['turns'],
+                'llm_calls': values['llm_calls'],
+                'skipped': values['skipped'],
+                'cache_hits': values['cache_hits'],
+                'avg_condense_ms': 1000 * values['condense_s'] / values['llm_calls'] if values['llm_calls'] else 0.0,
+                'avg_ttft_ms': 1000 * values['ttft_s'] / values['answers'] if values['answers'] else 0.0,
+                'max_ttft_ms': 1000 * values['max_ttft_s'],
+            }
+        return metrics
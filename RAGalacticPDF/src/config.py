@@ -0,0 +1,137 @@
+# Deployment settings, overridable through environment variables (same mechanism as OLLAMA_BASE_URL / LLAMA_CLOUD_API_KEY)
+import os
+
+
+def _env_int(name:str, default:int):
+    value = os.environ.get(name)
+    return int(value) if value not in (None, '') else default
+
+
+def _env_float(name:str, default:float):
+    value = os.environ.get(name)
+    return float(value) if value not in (None, '') else default
+
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# Chroma persistent storage (users' embedded nodes)
+CHROMA_DB_DIR = os.environ.get('RAGALACTIC_CHROMA_DB_DIR', os.path.join(PROJECT_ROOT, 'chroma_db_data'))
+
+# Layout of the users' nodes in Chroma: 'per_user' (one collection, and one HNSW index, per user) or 'shared' (a single
+# SHARED_COLLECTION_NAME collection, nodes partitioned by their user_id metadata and filtered at query time). An existing
+# deployment is switched with collection_layout.py. CHROMA_MEMORY_LIMIT_MB: when set, loaded collection indexes beyond
+# this size are evicted least recently used first (0: every index touched since startup stays in memory)
+COLLECTION_LAYOUT = os.environ.get('RAGALACTIC_COLLECTION_LAYOUT', 'per_user')
+SHARED_COLLECTION_NAME = os.environ.get('RAGALACTIC_SHARED_COLLECTION_NAME', 'ragalactic_shared')
+CHROMA_MEMORY_LIMIT_MB = _env_int('RAGALACTIC_CHROMA_MEMORY_LIMIT_MB', 0)
+
+# HNSW index of the collections created from now on (chroma defaults): distance ('l2', 'cosine' or 'ip'), graph degree M,
+# candidate list sizes at construction and at search time (higher: better recall, slower). Existing collections keep the
+# parameters they were created with until rebuilt with collection_maintenance.py
+HNSW_SPACE = os.environ.get('RAGALACTIC_HNSW_SPACE', 'l2')
+HNSW_M = _env_int('RAGALACTIC_HNSW_M', 16)
+HNSW_CONSTRUCTION_EF = _env_int('RAGALACTIC_HNSW_CONSTRUCTION_EF', 100)
+HNSW_SEARCH_EF = _env_int('RAGALACTIC_HNSW_SEARCH_EF', 10)
+
+# Exact search tier (exact_search.py): users with at most EXACT_SEARCH_MAX_VECTORS nodes are searched by brute force over a
+# memory-mapped float16 copy of their vectors instead of the chroma HNSW index. Opt-in: 0 (default) disables the tier,
+# e.g. 10000 (see benchmarks/bench_exact_search.py for the latency against chroma). Loaded copies beyond
+# EXACT_SEARCH_MEMORY_MB are evicted least recently used first, and a user's loaded copies (one per collection) never take
+# more than EXACT_SEARCH_USER_MEMORY_MB (a copy alone above it: the user is searched through chroma)
+EXACT_SEARCH_DIR = os.environ.get('RAGALACTIC_EXACT_SEARCH_DIR', os.path.join(PROJECT_ROOT, 'exact_search'))
+EXACT_SEARCH_MAX_VECTORS = _env_int('RAGALACTIC_EXACT_SEARCH_MAX_VECTORS', 0)
+EXACT_SEARCH_MEMORY_MB = _env_int('RAGALACTIC_EXACT_SEARCH_MEMORY_MB', 512)
+EXACT_SEARCH_USER_MEMORY_MB = _env_int('RAGALACTIC_EXACT_SEARCH_USER_MEMORY_MB', 64)
+
+# Content-addressed cache of parsed documents and embedded nodes, shared by every user
+INGESTION_CACHE_DIR = os.environ.get('RAGALACTIC_INGESTION_CACHE_DIR', os.path.join(PROJECT_ROOT, 'ingestion_cache'))
+INGESTION_CACHE_MAX_MB = _env_int('RAGALACTIC_INGESTION_CACHE_MAX_MB', 2048)
+
+# PDF parser backend: 'llamaparse' (cloud API, needs LLAMA_CLOUD_API_KEY) or 'local' (offline pypdf, page-parallel)
+PARSER_BACKEND = os.environ.get('RAGALACTIC_PARSER_BACKEND', 'llamaparse')
+# Local backend: number of worker processes (defaults to the number of cores) and pages extracted per task
+LOCAL_PARSER_WORKERS = _env_int('RAGALACTIC_LOCAL_PARSER_WORKERS', 0) or None
+LOCAL_PARSER_PAGES_PER_TASK = _env_int('RAGALACTIC_LOCAL_PARSER_PAGES_PER_TASK', 16)
+
+# SQLite catalog of users' PDFs and tags (the former json catalog is migrated into it on first start)
+CATALOG_PATH = os.environ.get('RAGALACTIC_CATALOG_PATH', os.path.join(PROJECT_ROOT, 'data', 'catalog.sqlite3'))
+LEGACY_JSON_CATALOG_PATH = os.path.join(PROJECT_ROOT, 'data', 'json_ids.json')
+
+# Cache of collection handles, indexes and chat/query engines reused across Streamlit reruns
+ENGINE_CACHE_MAX_ENTRIES = _env_int('RAGALACTIC_ENGINE_CACHE_MAX_ENTRIES', 256)
+ENGINE_CACHE_TTL_S = _env_int('RAGALACTIC_ENGINE_CACHE_TTL_S', 1800)
+
+# Shared embedding service: requests of every session are grouped in batches of at most EMBED_MAX_BATCH_SIZE texts,
+# a batch waits at most EMBED_MAX_WAIT_MS for other requests before being embedded
+EMBED_MAX_BATCH_SIZE = _env_int('RAGALACTIC_EMBED_MAX_BATCH_SIZE', 64)
+EMBED_MAX_WAIT_MS = _env_int('RAGALACTIC_EMBED_MAX_WAIT_MS', 5)
+
+# Embedding backend: 'torch' (HuggingFace, full precision), 'torch_int8' (dynamic int8 quantization),
+# 'onnx' or 'onnx_int8' (ONNX Runtime, model exported once in EMBED_MODELS_CACHE_DIR)
+EMBED_BACKEND = os.environ.get('RAGALACTIC_EMBED_BACKEND', 'torch')
+EMBED_MODEL_NAME = os.environ.get('RAGALACTIC_EMBED_MODEL_NAME', 'BAAI/bge-small-en-v1.5')
+EMBED_MODELS_CACHE_DIR = os.environ.get('RAGALACTIC_EMBED_MODELS_CACHE_DIR', os.path.join(PROJECT_ROOT, 'models_cache'))
+
+# Query embeddings (LRU, keyed by normalized query) and final answers (keyed by user, file set, mode, knowledge base flag and query)
+QUERY_EMBED_CACHE_MAX_ENTRIES = _env_int('RAGALACTIC_QUERY_EMBED_CACHE_MAX_ENTRIES', 4096)
+ANSWER_CACHE_MAX_ENTRIES = _env_int('RAGALACTIC_ANSWER_CACHE_MAX_ENTRIES', 1024)
+ANSWER_CACHE_TTL_S = _env_int('RAGALACTIC_ANSWER_CACHE_TTL_S', 86400)
+
+# Background ingestion jobs: at most INGESTION_MAX_CONCURRENT_JOBS run at once (others are queued),
+# finished jobs are kept INGESTION_JOB_RETENTION_S for the UI, which polls running jobs every INGESTION_JOB_POLL_INTERVAL_S
+INGESTION_MAX_CONCURRENT_JOBS = _env_int('RAGALACTIC_INGESTION_MAX_CONCURRENT_JOBS', 2)
+INGESTION_JOB_RETENTION_S = _env_int('RAGALACTIC_INGESTION_JOB_RETENTION_S', 3600)
+INGESTION_JOB_POLL_INTERVAL_S = _env_int('RAGALACTIC_INGESTION_JOB_POLL_INTERVAL_S', 1)
+
+# Custom metadata extractors: at most EXTRACTOR_LLM_CONCURRENCY extraction LLM calls in flight (all ingestions together),
+# per-node results checkpointed in EXTRACTOR_CHECKPOINT_DIR until the pdf is fully ingested
+EXTRACTOR_LLM_CONCURRENCY = _env_int('RAGALACTIC_EXTRACTOR_LLM_CONCURRENCY', 4)
+EXTRACTOR_CHECKPOINT_DIR = os.environ.get('RAGALACTIC_EXTRACTOR_CHECKPOINT_DIR', os.path.join(PROJECT_ROOT, 'extractor_checkpoints'))
+
+# Ollama request scheduler: at most LLM_MAX_CONCURRENCY generations in flight (interactive answers first, then condense-question,
+# then background extraction calls), over at most LLM_MAX_CONNECTIONS pooled keep-alive connections
+LLM_MAX_CONCURRENCY = _env_int('RAGALACTIC_LLM_MAX_CONCURRENCY', 2)
+LLM_MAX_CONNECTIONS = _env_int('RAGALACTIC_LLM_MAX_CONNECTIONS', 8)
+
+# Context assembly after retrieval (opt-in): CONTEXT_CANDIDATES_FACTOR x similarity_top_k candidates are reranked (hybrid vector + BM25
+# scorer, or the RERANKER_MODEL cross-encoder when set), near-duplicates (cosine >= CONTEXT_DEDUP_THRESHOLD) dropped,
+# adjacent chunks merged and the result trimmed to the tokens of the similarity_top_k chunks a plain vector search would
+# send, or to CONTEXT_TOKEN_BUDGET tokens if lower (0: no lower budget)
+CONTEXT_ASSEMBLY = bool(_env_int('RAGALACTIC_CONTEXT_ASSEMBLY', 0))
+CONTEXT_TOKEN_BUDGET = _env_int('RAGALACTIC_CONTEXT_TOKEN_BUDGET', 0)
+CONTEXT_CANDIDATES_FACTOR = _env_int('RAGALACTIC_CONTEXT_CANDIDATES_FACTOR', 4)
+CONTEXT_DEDUP_THRESHOLD = _env_float('RAGALACTIC_CONTEXT_DEDUP_THRESHOLD', 0.95)
+RERANKER_MODEL = os.environ.get('RAGALACTIC_RERANKER_MODEL', '')
+
+# Conversation memory: 'buffer' (whole history up to 10k tokens) or 'rolling_summary' (last CHAT_MEMORY_RECENT_TURNS turns verbatim,
+# older turns folded in the background into a summary)
+CHAT_MEMORY_MODE = os.environ.get('RAGALACTIC_CHAT_MEMORY_MODE', 'buffer')
+CHAT_MEMORY_RECENT_TURNS = _env_int('RAGALACTIC_CHAT_MEMORY_RECENT_TURNS', 4)
+
+# Condense step of the condense_plus_context chat mode (rewrite of the question into a standalone one before retrieval):
+# 'always' (an LLM call per follow-up question), 'heuristic' (skipped for self-contained questions) or 'cached' (heuristic,
+# and rewrites reused for the same question after the same exchange). CONDENSE_MODEL: smaller ollama model used for
+# the rewrite (e.g. 'llama3.2:1b', to pull beforehand), the answering model if empty.
+CONDENSE_STRATEGY = os.environ.get('RAGALACTIC_CONDENSE_STRATEGY', 'cached')
+CONDENSE_MODEL = os.environ.get('RAGALACTIC_CONDENSE_MODEL', '')
+CONDENSE_CACHE_MAX_ENTRIES = _env_int('RAGALACTIC_CONDENSE_CACHE_MAX_ENTRIES', 1024)
+
+# Logging level of the app ('DEBUG' for the detailed per-component logs), share of the structured telemetry events
+# logged (one json line each, 1.0 = all) and port serving the Prometheus metrics at /metrics (0: not served)
+LOG_LEVEL = os.environ.get('RAGALACTIC_LOG_LEVEL', 'INFO')
+TELEMETRY_EVENT_SAMPLE_RATE = _env_float('RAGALACTIC_TELEMETRY_EVENT_SAMPLE_RATE', 0.1)
+TELEMETRY_METRICS_PORT = _env_int('RAGALACTIC_TELEMETRY_METRICS_PORT', 0)
+
+# Async HTTP API (api.py, alternative front end to the Streamlit app): address served by `python api.py`, at most
+# API_MAX_CONVERSATIONS conversations kept server-side (least recently used dropped first), each dropped after API_CONVERSATION_TTL_S
+API_HOST = os.environ.get('RAGALACTIC_API_HOST', '0.0.0.0')
+API_PORT = _env_int('RAGALACTIC_API_PORT', 8000)
+API_MAX_CONVERSATIONS = _env_int('RAGALACTIC_API_MAX_CONVERSATIONS', 1024)
+API_CONVERSATION_TTL_S = _env_int('RAGALACTIC_API_CONVERSATION_TTL_S', 3600)
+# Answers streamed at once: each stream holds a worker thread pulling the (blocking) LLM token generator, streams beyond
+# API_MAX_STREAMS wait for a free worker
+API_MAX_STREAMS = _env_int('RAGALACTIC_API_MAX_STREAMS', 64)
+
+# Startup profiling (startup_profile.py): import time of the packages and construction time of the shared components
+# (at startup, or on first use for those built lazily: parser, custom transforms, reranker), logged at INFO level
+STARTUP_PROFILE = bool(_env_int('RAGALACTIC_STARTUP_PROFILE', 0))
@@ -0,0 +1,205 @@
+# Import modules
+import re
+import math
+import threading
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+from llama_index.core.postprocessor.types import BaseNodePostprocessor
+from llama_index.core.schema import NodeWithScore, NodeRelationship, QueryBundle, MetadataMode
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.utils import get_tokenizer
+
+from telemetry import registry, COUNT_BUCKETS
+
+import logging
+
+
+_STOPWORDS = frozenset('the a an and or of to in on for with is are was were be by as at it this that what which who how why when '
+                       'does do did from about can could would should into their there these those its'.split())
+
+
+def _terms(text:str):
+    return [term for term in re.findall(r'\w+', text.lower()) if len(term) > 2 and term not in _STOPWORDS]
+
+
+def _min_max(values:List[float]):
+    low, high = min(values), max(values)
+    return [(value - low) / (high - low) if high > low else 1.0 for value in values]
+
+
+def hybrid_scores(query:str, texts:List[str], vector_scores:List[float], lexical_weight:float=0.3, k1:float=1.2, b:float=0.75):
+    # Lightweight local reranker: vector similarity blended with a BM25 score of the query terms
+    # (idf computed over the candidates themselves), both min-max normalized over the candidates
+    query_terms = set(_terms(query))
+    docs_terms = [Counter(_terms(text)) for text in texts]
+    avg_len = max(1.0, sum(sum(terms.values()) for terms in docs_terms) / max(1, len(docs_terms)))
+    bm25 = []
+    for terms in docs_terms:
+        doc_len = sum(terms.values())
+        score = 0.0
+        for term in query_terms:
+            if terms[term]:
+                n_docs_with_term = sum(1 for other in docs_terms if other[term])
+                idf = math.log(1 + (len(docs_terms) - n_docs_with_term + 0.5) / (n_docs_with_term + 0.5))
+                score += idf * terms[term] * (k1 + 1) / (terms[term] + k1 * (1 - b + b * doc_len / avg_len))
+        bm25.append(score)
+    vector = _min_max([score or 0.0 for score in vector_scores])
+    lexical = _min_max(bm25) if any(bm25) else [0.0] * len(bm25)
+    return [(1 - lexical_weight) * v + lexical_weight * l for v, l in zip(vector, lexical)]
+
+
+class TokenBudgetPostprocessor(BaseNodePostprocessor):
+    # Post-retrieval context assembly. Given over-retrieved candidates (retriever top_k = several times baseline_top_k):
+    # 1. rerank them (hybrid vector + BM25 scorer, or an optional cross-encoder reranker)
+    # 2. drop near-duplicates (cosine similarity of their embeddings >= dedup_threshold)
+    # 3. keep the best ones that fit in the budget (the first one truncated if it alone exceeds it): the tokens of the
+    #    baseline_top_k chunks a plain vector search would send, or token_budget if lower (0: no lower budget)
+    # 4. merge chunks adjacent or overlapping in the same document (the chunk overlap is sent once)
+    # Exports the tokens sent and the tokens the baseline_top_k chunks of the vector search would have sent.
+    token_budget: int = 0
+    baseline_top_k: int = 3
+    dedup_threshold: float = 0.95
+    lexical_weight: float = 0.3
+
+    _embedding_lookup: Any = PrivateAttr()
+    _reranker: Any = PrivateAttr()
+    _tokenizer: Any = PrivateAttr()
+    _stats: Dict = PrivateAttr()
+    _stats_lock: Any = PrivateAttr()
+
+    def __init__(self, embedding_lookup:Optional[Callable[[List[str]], Dict[str, List[float]]]]=None, reranker:Optional[BaseNodePostprocessor]=None, **kwargs:Any):
+        super().__init__(**kwargs)
+        # embedding_lookup(node_ids) -> {node_id: embedding} (retrieved nodes do not carry their embedding)
+        self._embedding_lookup = embedding_lookup
+        self._reranker = reranker
+        self._tokenizer = get_tokenizer()
+        self._stats = {'requests': 0, 'baseline_tokens': 0, 'sent_tokens': 0}
+        self._stats_lock = threading.Lock()
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "TokenBudgetPostprocessor"
+
+    def _count_tokens(self, node_with_score:NodeWithScore):
+        return len(self._tokenizer(node_with_score.node.get_content(metadata_mode=MetadataMode.LLM)))
+
+    def _rerank(self, nodes:List[NodeWithScore], query_bundle:Optional[QueryBundle]):
+        if query_bundle is None:
+            return nodes
+        if self._reranker is not None:
+            return self._reranker.postprocess_nodes(nodes, query_bundle=query_bundle)
+        scores = hybrid_scores(query_bundle.query_str, [node.node.get_content() for node in nodes], [node.score for node in nodes],
+                               lexical_weight=self.lexical_weight)
+        reranked = [NodeWithScore(node=node.node, score=score) for node, score in zip(nodes, scores)]
+        return sorted(reranked, key=lambda node: node.score, reverse=True)
+
+    def _deduplicate(self, nodes:List[NodeWithScore]):
+        if self._embedding_lookup is None or len(nodes) < 2:
+            return nodes
+        embeddings = self._embedding_lookup([node.node.node_id for node in nodes])
+        kept, kept_vectors = [], []
+        for node in nodes:
+            embedding = embeddings.get(node.node.node_id)
+            if embedding is None:
+                kept.append(node)
+                continue
+            vector = np.asarray(embedding, dtype=np.float32)
+            vector = vector / max(np.linalg.norm(vector), 1e-12)
+            # Candidates are in rank order: the best ranked of near-duplicates is kept
+            if any(float(vector @ other) >= self.dedup_threshold for other in kept_vectors):
+                continue
+            kept.append(node)
+            kept_vectors.append(vector)
+        return kept
+
+    def _fit_budget(self, nodes:List[NodeWithScore], budget:int):
+        selected, used = [], 0
+        for node in nodes:
+            n_tokens = self._count_tokens(node)
+            if used + n_tokens <= budget:
+                selected.append(node)
+                used += n_tokens
+            elif not selected:
+                # Best candidate alone exceeds the budget: keep its beginning (metadata sent with the text included in the budget).
+                # The retrieved node is shared with the retriever's caller, a copy is truncated
+                node = NodeWithScore(node=node.node.copy(deep=True), score=node.score)
+                text = node.node.get_content()
+                metadata_tokens = n_tokens - len(self._tokenizer(text))
+                node.node.text = self._truncate(text, budget - metadata_tokens)
+                selected.append(node)
+                used = self._count_tokens(node)
+        return selected
+
+    def _truncate(self, text:str, max_tokens:int):
+        # Cut on a word boundary, shrinking until the text fits
+        words = text.split(' ')
+        while words and len(self._tokenizer(' '.join(words))) > max(0, max_tokens):
+            words = words[:max(0, int(len(words) * 0.9) - 1)]
+        return ' '.join(words)
+
+    def _adjacent(self, first:NodeWithScore, second:NodeWithScore):
+        first_node, second_node = first.node, second.node
+        if first_node.ref_doc_id is None or first_node.ref_doc_id != second_node.ref_doc_id:
+            return False
+        next_node = first_node.relationships.get(NodeRelationship.NEXT)
+        if next_node is not None and next_node.node_id == second_node.node_id:
+            return True
+        # Overlapping character ranges in the same document
+        if None in (first_node.start_char_idx, first_node.end_char_idx, second_node.start_char_idx):
+            return False
+        return first_node.start_char_idx <= second_node.start_char_idx <= first_node.end_char_idx
+
+    def _merge(self, nodes:List[NodeWithScore]):
+        # Chunks of the same document in document order, adjacent / overlapping ones fused into a single chunk
+        def position(node):
+            return (node.node.ref_doc_id or '', node.node.start_char_idx if node.node.start_char_idx is not None else -1)
+        ordered = sorted(nodes, key=position)
+        merged = []
+        for node in ordered:
+            previous = merged[-1] if merged else None
+            if previous is None or not self._adjacent(previous, node):
+                merged.append(NodeWithScore(node=node.node.copy(deep=True), score=node.score))
+                continue
+            previous_node, node_text = previous.node, node.node.get_content()
+            if previous_node.end_char_idx is not None and node.node.start_char_idx is not None:
+                # Skip the part of the chunk already present in the previous one
+                node_text = node_text[max(0, previous_node.end_char_idx - node.node.start_char_idx):]
+                previous_node.end_char_idx = max(previous_node.end_char_idx, node.node.end_char_idx or 0)
+            previous_node.text = previous_node.get_content() + ('' if previous_node.get_content().endswith(' ') else ' ') + node_text.lstrip()
+            previous_node.relationships[NodeRelationship.NEXT] = node.node.relationships.get(NodeRelationship.NEXT) or previous_node.relationships.get(NodeRelationship.NEXT)
+            previous.score = max(previous.score or 0.0, node.score or 0.0)
+        # Best first again
+        return sorted(merged, key=lambda node: node.score or 0.0, reverse=True)
+
+    def _postprocess_nodes(self, nodes:List[NodeWithScore], query_bundle:Optional[QueryBundle]=None) -> List[NodeWithScore]:
+        if not nodes:
+            return nodes
+        # Baseline: the chunks a plain top-k vector search would have sent
+        baseline_tokens = sum(self._count_tokens(node) for node in sorted(nodes, key=lambda node: node.score or 0.0, reverse=True)[:self.baseline_top_k])
+
+        # Never more than the baseline: over-retrieved small chunks could otherwise fill a larger budget
+        budget = min(baseline_tokens, self.token_budget) if self.token_budget else baseline_tokens
+        candidates = self._deduplicate(self._rerank(nodes, query_bundle))
+        assembled = self._merge(self._fit_budget(candidates, budget))
+
+        sent_tokens = sum(self._count_tokens(node) for node in assembled)
+        with self._stats_lock:
+            self._stats['requests'] += 1
+            self._stats['baseline_tokens'] += baseline_tokens
+            self._stats['sent_tokens'] += sent_tokens
+        registry.observe('ragalactic_context_tokens', sent_tokens, buckets=COUNT_BUCKETS)
+        registry.observe('ragalactic_context_chunks', len(assembled), buckets=COUNT_BUCKETS)
+        registry.inc('ragalactic_context_sent_tokens_total', sent_tokens)
+        registry.inc('ragalactic_context_baseline_tokens_total', baseline_tokens)
+        logging.debug(f'CONTEXT ASSEMBLY: {len(nodes)} candidates -> {len(assembled)} chunks, {sent_tokens} tokens '
+                     f'(baseline top {self.baseline_top_k}: {baseline_tokens}, saved {baseline_tokens - sent_tokens})')
+        return assembled
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['tokens_saved'] = stats['baseline_tokens'] - stats['sent_tokens']
+        return stats
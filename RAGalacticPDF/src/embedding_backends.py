@@ -0,0 +1,169 @@
+# Import modules
+import os
+import inspect
+from abc import abstractmethod
+from typing import Any, List, Optional
+
+import numpy as np
+
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+
+import logging
+
+
+EMBEDDING_BACKENDS = ('torch', 'torch_int8', 'onnx', 'onnx_int8')
+
+# Same query instruction as llama_index HuggingFaceEmbedding uses for the english bge models
+BGE_QUERY_INSTRUCTION = "Represent this question for searching relevant passages: "
+
+
+def _query_instruction(model_name:str):
+    return BGE_QUERY_INSTRUCTION if model_name.startswith('BAAI/bge-') and '-zh' not in model_name else ''
+
+
+class _CPUTransformerEmbedding(BaseEmbedding):
+    # Base of the CPU backends: texts are sorted by length and tokenized per batch (padding to the longest text
+    # of the batch only), then CLS pooled and L2 normalized as bge-small-en-v1.5 expects.
+    # Abstract (BaseEmbedding's metaclass is an ABCMeta): the backends implement _forward.
+    max_length: int = 512
+    query_instruction: str = ''
+
+    _tokenizer: Any = PrivateAttr()
+
+    def __init__(self, model_name:str, max_length:int=512, embed_batch_size:int=32, **kwargs):
+        from transformers import AutoTokenizer
+        super().__init__(model_name=model_name, max_length=max_length, embed_batch_size=embed_batch_size,
+                         query_instruction=_query_instruction(model_name), **kwargs)
+        self._tokenizer = AutoTokenizer.from_pretrained(model_name)
+
+    @abstractmethod
+    def _forward(self, encoded) -> np.ndarray:
+        # Return the last hidden state (batch, seq_len, hidden) as a numpy array
+        pass
+
+    def _embed(self, sentences:List[str], prompt_name:Optional[str]=None) -> List[List[float]]:
+        if prompt_name == 'query':
+            sentences = [self.query_instruction + sentence for sentence in sentences]
+        # Sorting by length keeps similar sizes together so that per batch padding stays small
+        order = sorted(range(len(sentences)), key=lambda idx: len(sentences[idx]))
+        embeddings = [None] * len(sentences)
+        for start in range(0, len(order), self.embed_batch_size):
+            batch_idx = order[start:start + self.embed_batch_size]
+            encoded = self._tokenizer([sentences[idx] for idx in batch_idx], padding='longest', truncation=True,
+                                      max_length=self.max_length, return_tensors='np')
+            cls_embeddings = self._forward(encoded)[:, 0]
+            cls_embeddings = cls_embeddings / np.linalg.norm(cls_embeddings, axis=1, keepdims=True).clip(min=1e-12)
+            for idx, embedding in zip(batch_idx, cls_embeddings):
+                embeddings[idx] = embedding.astype(np.float32).tolist()
+        return embeddings
+
+    def _get_query_embedding(self, query:str) -> List[float]:
+        return self._embed([query], prompt_name='query')[0]
+
+    def _get_text_embedding(self, text:str) -> List[float]:
+        return self._embed([text], prompt_name='text')[0]
+
+    def _get_text_embeddings(self, texts:List[str]) -> List[List[float]]:
+        return self._embed(texts, prompt_name='text')
+
+    async def _aget_query_embedding(self, query:str) -> List[float]:
+        return self._get_query_embedding(query)
+
+    async def _aget_text_embedding(self, text:str) -> List[float]:
+        return self._get_text_embedding(text)
+
+
+class TorchInt8Embedding(_CPUTransformerEmbedding):
+    # PyTorch model with int8 dynamic quantization of every Linear layer (weights int8, activations quantized on the fly)
+    _model: Any = PrivateAttr()
+
+    def __init__(self, model_name:str, **kwargs):
+        super().__init__(model_name, **kwargs)
+        import torch
+        from transformers import AutoModel
+        model = AutoModel.from_pretrained(model_name).eval()
+        self._model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "TorchInt8Embedding"
+
+    def _forward(self, encoded) -> np.ndarray:
+        import torch
+        with torch.inference_mode():
+            outputs = self._model(**{name: torch.from_numpy(array) for name, array in encoded.items()})
+        return outputs.last_hidden_state.numpy()
+
+
+class OnnxEmbedding(_CPUTransformerEmbedding):
+    # ONNX Runtime model, exported once from the HuggingFace checkpoint in cache_dir (optionally int8 quantized)
+    quantize: bool = False
+
+    _session: Any = PrivateAttr()
+    _input_names: Any = PrivateAttr()
+
+    def __init__(self, model_name:str, cache_dir:str, quantize:bool=False, **kwargs):
+        super().__init__(model_name, quantize=quantize, **kwargs)
+        import onnxruntime
+        onnx_path = self._get_onnx_model(model_name, cache_dir, quantize)
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self._session = onnxruntime.InferenceSession(onnx_path, sess_options=options, providers=['CPUExecutionProvider'])
+        self._input_names = {model_input.name for model_input in self._session.get_inputs()}
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "OnnxEmbedding"
+
+    def _get_onnx_model(self, model_name:str, cache_dir:str, quantize:bool):
+        model_dir = os.path.join(cache_dir, model_name.replace('/', '__'))
+        onnx_path = os.path.join(model_dir, 'model.onnx')
+        os.makedirs(model_dir, exist_ok=True)
+        if not os.path.exists(onnx_path):
+            self._export(model_name, onnx_path)
+        if not quantize:
+            return onnx_path
+
+        quantized_path = os.path.join(model_dir, 'model_int8.onnx')
+        if not os.path.exists(quantized_path):
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+            logging.info(f'EMBEDDING: quantizing {onnx_path} to int8')
+            quantize_dynamic(onnx_path, quantized_path, weight_type=QuantType.QInt8)
+        return quantized_path
+
+    def _export(self, model_name:str, onnx_path:str):
+        import torch
+        from transformers import AutoModel
+        logging.info(f'EMBEDDING: exporting {model_name} to {onnx_path}')
+        model = AutoModel.from_pretrained(model_name).eval()
+        dummy = self._tokenizer(['export'], return_tensors='pt')
+        # Inputs passed positionally in forward()'s order (the tokenizer output order differs, e.g. token_type_ids before attention_mask)
+        forward_parameters = list(inspect.signature(model.forward).parameters)
+        input_names = sorted(dummy.keys(), key=forward_parameters.index)
+        dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in input_names}
+        dynamic_axes['last_hidden_state'] = {0: 'batch', 1: 'sequence'}
+        tmp_path = f'{onnx_path}.tmp'
+        # Recent torch versions default to the dynamo exporter (extra onnxscript dependency), keep the TorchScript one
+        export_kwargs = {'dynamo': False} if 'dynamo' in inspect.signature(torch.onnx.export).parameters else {}
+        with torch.inference_mode():
+            torch.onnx.export(model, tuple(dummy[name] for name in input_names), tmp_path,
+                              input_names=input_names, output_names=['last_hidden_state'],
+                              dynamic_axes=dynamic_axes, opset_version=14, **export_kwargs)
+        os.replace(tmp_path, onnx_path)
+
+    def _forward(self, encoded) -> np.ndarray:
+        inputs = {name: array.astype(np.int64) for name, array in encoded.items() if name in self._input_names}
+        return self._session.run(['last_hidden_state'], inputs)[0]
+
+
+def get_embedding_model(backend:str, model_name:str, device:str='cpu', cache_dir:str=None):
+    # Embedding backends selectable through config.EMBED_BACKEND
+    if backend == 'torch':
+        from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+        return HuggingFaceEmbedding(model_name=model_name, device=device)
+    if backend == 'torch_int8':
+        return TorchInt8Embedding(model_name)
+    if backend in ('onnx', 'onnx_int8'):
+        return OnnxEmbedding(model_name, cache_dir=cache_dir, quantize=backend == 'onnx_int8')
+    raise ValueError(f"Unknown embedding backend '{backend}'. Available backends: {', '.join(EMBEDDING_BACKENDS)}.")
@@ -0,0 +1,206 @@
+# Import modules
+import time
+import queue
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, List, Union
+
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+
+import logging
+
+
+class _EmbeddingRequest():
+    def __init__(self, texts:List[str], kind:str):
+        self.texts = texts
+        # 'query' or 'text' (the model prepends a different instruction to each)
+        self.kind = kind
+        self.future = Future()
+        self.enqueued_at = time.perf_counter()
+
+
+class BatchingEmbeddingService():
+    # In-process embedding service shared by every session. Requests are queued and a single worker thread
+    # groups them in batches of at most max_batch_size texts, waiting at most max_wait_ms for a batch to fill.
+    # Results are returned through futures.
+    # embed_model: the model, or a function building it. The function is called by the worker thread as it starts: the
+    # model weights load in the background while the app starts serving, and requests submitted meanwhile wait in the queue.
+    def __init__(self, embed_model:Union[BaseEmbedding, Callable[[], BaseEmbedding]], max_batch_size:int=64, max_wait_ms:float=5.0):
+        self._embed_model = embed_model if isinstance(embed_model, BaseEmbedding) else None
+        self._build_embed_model = None if self._embed_model is not None else embed_model
+        self._embed_model_error = None
+        self._embed_model_ready = threading.Event()
+        self.max_batch_size = max_batch_size
+        self.max_wait_s = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        self._metrics_lock = threading.Lock()
+        self._metrics = {'requests': 0, 'texts': 0, 'batches': 0,
+                         'queue_wait_s_sum': 0.0, 'embed_s_sum': 0.0, 'max_queue_depth': 0}
+        self._worker = threading.Thread(target=self._run, name='embedding-service', daemon=True)
+        self._worker.start()
+
+    def submit(self, texts:List[str], kind:str='text') -> Future:
+        request = _EmbeddingRequest(list(texts), kind)
+        self._queue.put(request)
+        with self._metrics_lock:
+            self._metrics['max_queue_depth'] = max(self._metrics['max_queue_depth'], self._queue.qsize())
+        return request.future
+
+    def embed(self, texts:List[str], kind:str='text') -> List[List[float]]:
+        return self.submit(texts, kind=kind).result()
+
+    @property
+    def embed_model(self) -> BaseEmbedding:
+        # Blocks until the model is loaded (raises its loading error if it failed)
+        self._embed_model_ready.wait()
+        if self._embed_model_error is not None:
+            raise self._embed_model_error
+        return self._embed_model
+
+
+
+    ###            ###
+    ###   WORKER   ###
+    ###            ###
+
+    def _collect_batch(self):
+        # Block for the first request, then gather more until the batch is full or max_wait_ms elapsed
+        batch = [self._queue.get()]
+        n_texts = len(batch[0].texts)
+        deadline = time.perf_counter() + self.max_wait_s
+        while n_texts < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(request)
+            n_texts += len(request.texts)
+        return batch
+
+    def _load_embed_model(self):
+        try:
+            if self._embed_model is None:
+                self._embed_model = self._build_embed_model()
+        except Exception as e:
+            # Every request then fails with this error (_embed_batch reads embed_model)
+            logging.exception('EMBEDDING SERVICE: model loading failed')
+            self._embed_model_error = e
+        finally:
+            self._embed_model_ready.set()
+
+    def _run(self):
+        self._load_embed_model()
+        while True:
+            batch = self._collect_batch()
+            for kind in ('query', 'text'):
+                requests = [request for request in batch if request.kind == kind]
+                if requests:
+                    self._process(requests, kind)
+
+    def _embed_batch(self, texts:List[str], kind:str):
+        if kind == 'query':
+            if hasattr(self.embed_model, '_embed'):
+                # HuggingFaceEmbedding (and the backends of embedding_backends.py) embed a list of queries at once
+                return self.embed_model._embed(texts, prompt_name='query')
+            return [self.embed_model._get_query_embedding(text) for text in texts]
+        return self.embed_model._get_text_embeddings(texts)
+
+    def _process(self, requests:List[_EmbeddingRequest], kind:str):
+        started_at = time.perf_counter()
+        texts = [text for request in requests for text in request.texts]
+        try:
+            embeddings = []
+            # A single request larger than max_batch_size is split in several model calls
+            for start in range(0, len(texts), self.max_batch_size):
+                embeddings.extend(self._embed_batch(texts[start:start + self.max_batch_size], kind))
+        except Exception as e:
+            logging.exception('EMBEDDING SERVICE: batch failed')
+            for request in requests:
+                request.future.set_exception(e)
+            return
+
+        embed_s = time.perf_counter() - started_at
+        position = 0
+        for request in requests:
+            request.future.set_result(embeddings[position:position + len(request.texts)])
+            position += len(request.texts)
+
+        n_model_batches = max(1, -(-len(texts) // self.max_batch_size))
+        with self._metrics_lock:
+            self._metrics['requests'] += len(requests)
+            self._metrics['texts'] += len(texts)
+            self._metrics['batches'] += n_model_batches
+            self._metrics['queue_wait_s_sum'] += sum(started_at - request.enqueued_at for request in requests)
+            self._metrics['embed_s_sum'] += embed_s
+
+    def metrics(self):
+        with self._metrics_lock:
+            metrics = dict(self._metrics)
+        n_batches = max(1, metrics['batches'])
+        return {
+            'queue_depth': self._queue.qsize(),
+            'max_queue_depth': metrics['max_queue_depth'],
+            'requests': metrics['requests'],
+            'texts': metrics['texts'],
+            'batches': metrics['batches'],
+            'avg_batch_size': metrics['texts'] / n_batches,
+            # Fraction of max_batch_size actually used by the model calls
+            'avg_batch_fill': metrics['texts'] / (n_batches * self.max_batch_size),
+            'avg_queue_wait_ms': 1000 * metrics['queue_wait_s_sum'] / max(1, metrics['requests']),
+            'avg_embed_ms_per_batch': 1000 * metrics['embed_s_sum'] / n_batches,
+        }
+
+
+class ServiceEmbedding(BaseEmbedding):
+    # llama_index embedding model routing every call to the shared BatchingEmbeddingService,
+    # used as Settings.embed_model so that retrieval and ingestion of all sessions are batched together.
+    # Query embeddings are looked up in query_cache (QueryEmbeddingCache) first when one is given.
+    _service: Any = PrivateAttr()
+    _query_cache: Any = PrivateAttr()
+
+    # model_name: given when the service model is still loading (otherwise read from the model, which waits for it)
+    def __init__(self, service:BatchingEmbeddingService, query_cache=None, embed_batch_size:int=256, model_name:str=None, **kwargs):
+        super().__init__(model_name=model_name or service.embed_model.model_name, embed_batch_size=embed_batch_size, **kwargs)
+        self._service = service
+        self._query_cache = query_cache
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "ServiceEmbedding"
+
+    def _cached_query_embedding(self, query:str):
+        return self._query_cache.get(query) if self._query_cache is not None else None
+
+    def _cache_query_embedding(self, query:str, embedding:List[float]):
+        if self._query_cache is not None:
+            self._query_cache.set(query, embedding)
+        return embedding
+
+    def _get_query_embedding(self, query:str) -> List[float]:
+        embedding = self._cached_query_embedding(query)
+        if embedding is None:
+            embedding = self._cache_query_embedding(query, self._service.embed([query], kind='query')[0])
+        return embedding
+
+    def _get_text_embedding(self, text:str) -> List[float]:
+        return self._service.embed([text], kind='text')[0]
+
+    def _get_text_embeddings(self, texts:List[str]) -> List[List[float]]:
+        return self._service.embed(texts, kind='text')
+
+    async def _aget_query_embedding(self, query:str) -> List[float]:
+        embedding = self._cached_query_embedding(query)
+        if embedding is None:
+            embedding = self._cache_query_embedding(query, (await asyncio.wrap_future(self._service.submit([query], kind='query')))[0])
+        return embedding
+
+    async def _aget_text_embedding(self, text:str) -> List[float]:
+        return (await asyncio.wrap_future(self._service.submit([text], kind='text')))[0]
+
+    async def _aget_text_embeddings(self, texts:List[str]) -> List[List[float]]:
+        return await asyncio.wrap_future(self._service.submit(texts, kind='text'))
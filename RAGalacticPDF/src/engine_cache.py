@@ -0,0 +1,100 @@
+# Import modules
+import time
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable
+
+import logging
+
+
+class TTLLRUCache():
+    # Thread-safe mapping bounded in size (least recently used entries evicted first) and in age (entries expire after ttl_s)
+    def __init__(self, max_size:int=128, ttl_s:float=1800.0):
+        self.max_size = max_size
+        self.ttl_s = ttl_s
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+        self.hits, self.misses = 0, 0
+
+    def _expired(self, created_at:float):
+        return self.ttl_s is not None and time.monotonic() - created_at > self.ttl_s
+
+    def get(self, key:Hashable, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or self._expired(entry[0]):
+                self._entries.pop(key, None)
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key:Hashable, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def setdefault(self, key:Hashable, value):
+        # Value stored for the key if any (not expired), otherwise value is stored: concurrent creators all get the same one
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and not self._expired(entry[0]):
+                self._entries.move_to_end(key)
+                return entry[1]
+            self.set(key, value)
+            return value
+
+    def get_or_create(self, key:Hashable, factory:Callable):
+        value = self.get(key)
+        if value is None:
+            # Built outside of the lock: a slow factory must not block lookups of other keys
+            value = factory()
+            self.set(key, value)
+        return value
+
+    def invalidate(self, predicate:Callable[[Hashable], bool]):
+        with self._lock:
+            stale_keys = [key for key in self._entries if predicate(key)]
+            for key in stale_keys:
+                del self._entries[key]
+        return len(stale_keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'entries': len(self), 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0}
+
+
+class EngineCache():
+    # Process-wide cache of the objects rebuilt on every Streamlit rerun:
+    # - collection setups (chroma collection, vector store, storage context) keyed by collection name (the user_id, or the
+    #   shared collection of the shared layout)
+    # - indexes keyed by user_id
+    # - chat / query engines keyed by (user_id, selected files, llm_mode, knowledge base flag, streaming, top_k)
+    # Index and engine keys start with the user_id so that a user's entries can be dropped when their files change.
+    def __init__(self, max_engines:int=256, ttl_s:float=1800.0):
+        self.collections = TTLLRUCache(max_size=max_engines, ttl_s=None)
+        self.indexes = TTLLRUCache(max_size=max_engines, ttl_s=ttl_s)
+        self.engines = TTLLRUCache(max_size=max_engines, ttl_s=ttl_s)
+
+    @staticmethod
+    def engine_key(user_id:str, pdf_names=None, llm_mode:str=None, llm_knowledge_base:bool=False, streaming:bool=False, top_k:int=None):
+        # pdf_names=None stands for "every file of the user" (engine without metadata filters)
+        files_key = frozenset(pdf_names) if pdf_names is not None else None
+        return (user_id, files_key, llm_mode, bool(llm_knowledge_base), bool(streaming), top_k)
+
+    def invalidate_user(self, user_id:str):
+        # Called when the user ingests or deletes a file: their indexes and engines are rebuilt on next use
+        n_indexes = self.indexes.invalidate(lambda key: key[0] == user_id)
+        n_engines = self.engines.invalidate(lambda key: key[0] == user_id)
+        logging.debug(f'ENGINE CACHE: invalidated {n_indexes} indexes and {n_engines} engines of user {user_id}')
@@ -0,0 +1,308 @@
+# Exact search tier for small users (config.EXACT_SEARCH_MAX_VECTORS).
+# A user's vectors are copied once from chroma into a contiguous float16 matrix on disk (EXACT_SEARCH_DIR), with a
+# precomputed file id column and the vector norms, then memory-mapped: a query is a vectorized scan of the user's rows
+# (file selection applied as a mask over the file id column), exact and without the SQLite metadata filtering of chroma.
+# Copies are tied to the catalog fingerprint of the user's files: any ingestion, replacement or deletion makes them stale
+# and they are rebuilt on next use. Users above the threshold, and queries this tier cannot interpret, go to chroma.
+import os
+import json
+import threading
+from collections import OrderedDict
+from typing import Dict, List
+
+import numpy as np
+
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.vector_stores.types import VectorStoreQuery, VectorStoreQueryResult, FilterCondition, FilterOperator
+from llama_index.core.vector_stores.utils import metadata_dict_to_node
+from llama_index.vector_stores.chroma import ChromaVectorStore
+
+from config import SHARED_COLLECTION_NAME
+
+import logging
+
+
+# Rows converted to float32 per matrix product (bounds the temporary memory of a query)
+SCAN_BLOCK_ROWS = 8192
+
+
+class _Partition():
+    # Memory-mapped copy of the vectors of a user (in a collection)
+    def __init__(self, ids:List[str], file_names:List[str], vectors, file_ids, norms):
+        self.ids = ids
+        self.file_index = {file_name: i for i, file_name in enumerate(file_names)}
+        self.vectors = vectors
+        self.file_ids = file_ids
+        self.norms = norms
+
+    @property
+    def nbytes(self):
+        return self.vectors.nbytes + self.file_ids.nbytes + self.norms.nbytes
+
+    def search(self, query_embedding:List[float], top_k:int, file_names:List[str]=None, space:str='l2'):
+        # Returns [(node id, distance)] of the top_k nearest rows, distances as computed by chroma for the space
+        if file_names is None:
+            rows = None
+        else:
+            file_ids = [self.file_index[name] for name in file_names if name in self.file_index]
+            rows = np.flatnonzero(np.isin(self.file_ids, file_ids))
+            if not len(rows):
+                return []
+        query = np.asarray(query_embedding, dtype=np.float32)
+        n_rows = len(self.ids) if rows is None else len(rows)
+        dots = np.empty(n_rows, dtype=np.float32)
+        for start in range(0, n_rows, SCAN_BLOCK_ROWS):
+            block = self.vectors[start:start + SCAN_BLOCK_ROWS] if rows is None else self.vectors[rows[start:start + SCAN_BLOCK_ROWS]]
+            dots[start:start + len(block)] = block.astype(np.float32) @ query
+        norms = self.norms if rows is None else self.norms[rows]
+        if space == 'cosine':
+            distances = 1.0 - dots / np.maximum(norms * np.linalg.norm(query), 1e-12)
+        elif space == 'ip':
+            distances = 1.0 - dots
+        else:
+            # Squared euclidean distance (hnswlib l2)
+            distances = norms ** 2 - 2 * dots + float(query @ query)
+        top_k = min(top_k, n_rows)
+        if not top_k:
+            return []
+        top = np.argpartition(distances, top_k - 1)[:top_k]
+        top = top[np.argsort(distances[top])]
+        row_ids = top if rows is None else rows[top]
+        return [(self.ids[row], float(distances[i])) for row, i in zip(row_ids, top)]
+
+
+class ExactSearchTier():
+    # Process-wide registry of the loaded partitions, bounded by memory_mb (least recently used evicted first).
+    # The partitions of a user (one per collection) are bounded by user_memory_mb: a large user only evicts its own partitions
+    # (a partition alone above it is not loaded, the user goes to chroma)
+    def __init__(self, dir_path:str, catalog, max_vectors:int=10000, memory_mb:int=512, user_memory_mb:int=64, page_size:int=2000):
+        self.dir_path = dir_path
+        self.catalog = catalog
+        self.max_vectors = max_vectors
+        self.memory_bytes = memory_mb * 1024 * 1024
+        self.user_memory_bytes = user_memory_mb * 1024 * 1024
+        self.page_size = page_size
+        # (collection name, user_id) -> (fingerprint, _Partition or None when the user is above max_vectors)
+        self._partitions = OrderedDict()
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self.searches, self.fallbacks, self.builds, self.evictions, self.oversized = 0, 0, 0, 0, 0
+        os.makedirs(self.dir_path, exist_ok=True)
+
+    def _paths(self, collection_name:str, user_id:str, fingerprint:str):
+        prefix = os.path.join(self.dir_path, collection_name, f'{user_id}.{fingerprint[:16]}')
+        return {'meta': f'{prefix}.json', 'vectors': f'{prefix}.vectors.npy', 'file_ids': f'{prefix}.file_ids.npy', 'norms': f'{prefix}.norms.npy'}
+
+    def _user_where(self, collection, user_id:str):
+        # per_user layout: the collection only holds the user's nodes
+        return None if collection.name == user_id else {'user_id': user_id}
+
+    def _count(self, collection, user_id:str):
+        where = self._user_where(collection, user_id)
+        if where is None:
+            return collection.count()
+        return len(collection.get(where=where, include=[])['ids'])
+
+    def _open(self, paths:Dict):
+        with open(paths['meta'], 'r') as f:
+            meta = json.load(f)
+        return _Partition(meta['ids'], meta['file_names'], np.load(paths['vectors'], mmap_mode='r'),
+                          np.load(paths['file_ids'], mmap_mode='r'), np.load(paths['norms'], mmap_mode='r'))
+
+    def _write(self, collection, user_id:str, paths:Dict):
+        ids, file_names, file_ids, embeddings = [], {}, [], []
+        where, offset = self._user_where(collection, user_id), 0
+        while True:
+            page = collection.get(where=where, limit=self.page_size, offset=offset, include=['embeddings', 'metadatas'])
+            if not page['ids']:
+                break
+            for node_id, embedding, metadata in zip(page['ids'], page['embeddings'], page['metadatas']):
+                file_name = (metadata or {}).get('file_name')
+                ids.append(node_id)
+                file_ids.append(file_names.setdefault(file_name, len(file_names)))
+                embeddings.append(embedding)
+            offset += len(page['ids'])
+        vectors = np.asarray(embeddings, dtype=np.float16) if ids else np.zeros((0, 0), dtype=np.float16)
+        # Norms of the stored (float16) vectors: distances stay consistent with the scanned values
+        norms = np.linalg.norm(vectors.astype(np.float32), axis=1)
+        os.makedirs(os.path.dirname(paths['meta']), exist_ok=True)
+        # Files written under a temporary name then renamed, the metadata last: a present .json means a complete copy
+        # (processes sharing the directory may build the same copy concurrently)
+        suffix = f'.tmp{os.getpid()}_{threading.get_ident()}'
+        for key, array in [('vectors', vectors), ('file_ids', np.asarray(file_ids, dtype=np.int32)), ('norms', norms)]:
+            with open(paths[key] + suffix, 'wb') as f:
+                np.save(f, array)
+            os.replace(paths[key] + suffix, paths[key])
+        with open(paths['meta'] + suffix, 'w') as f:
+            json.dump({'ids': ids, 'file_names': list(file_names)}, f)
+        os.replace(paths['meta'] + suffix, paths['meta'])
+
+    def _remove_stale(self, collection_name:str, user_id:str, fingerprint:str):
+        # Copies of previous versions of the user's files (a reader still mapping them keeps its view until evicted)
+        dir_path = os.path.join(self.dir_path, collection_name)
+        current = f'{user_id}.{fingerprint[:16]}.'
+        for file_name in os.listdir(dir_path):
+            if file_name.startswith(f'{user_id}.') and not file_name.startswith(current) and '.tmp' not in file_name:
+                try:
+                    os.remove(os.path.join(dir_path, file_name))
+                except OSError:
+                    pass
+
+    def _build(self, collection, user_id:str, fingerprint:str):
+        if self._count(collection, user_id) > self.max_vectors:
+            return None
+        paths = self._paths(collection.name, user_id, fingerprint)
+        if not os.path.exists(paths['meta']):
+            self._write(collection, user_id, paths)
+            self._remove_stale(collection.name, user_id, fingerprint)
+            with self._lock:
+                self.builds += 1
+            logging.debug(f'EXACT SEARCH: copied the vectors of {user_id} ({collection.name})')
+        return self._open(paths)
+
+    def _evict_user(self, key):
+        # Called with self._lock held. Least recently used partitions of the user of key (other than key) beyond its budget
+        user_keys = [other for other, (_, partition) in self._partitions.items() if other[1] == key[1] and partition is not None]
+        user_bytes = sum(self._partitions[other][1].nbytes for other in user_keys)
+        for other in user_keys:
+            if user_bytes <= self.user_memory_bytes:
+                break
+            if other != key:
+                user_bytes -= self._partitions.pop(other)[1].nbytes
+                self.evictions += 1
+
+    def _evict(self):
+        # Called with self._lock held
+        loaded_bytes = sum(partition.nbytes for _, partition in self._partitions.values() if partition is not None)
+        while loaded_bytes > self.memory_bytes and len(self._partitions) > 1:
+            _, (_, partition) = self._partitions.popitem(last=False)
+            if partition is not None:
+                loaded_bytes -= partition.nbytes
+                self.evictions += 1
+
+    def get_partition(self, collection, user_id:str):
+        # Loaded (or built) partition of the user, None when the user is above max_vectors
+        key = (collection.name, user_id)
+        fingerprint = self.catalog.get_files_fingerprint(user_id)
+        with self._lock:
+            entry = self._partitions.get(key)
+            if entry is not None and entry[0] == fingerprint:
+                self._partitions.move_to_end(key)
+                return entry[1]
+        with self._build_lock:
+            partition = self._build(collection, user_id, fingerprint)
+        with self._lock:
+            if partition is not None and partition.nbytes > self.user_memory_bytes:
+                # Remembered for this fingerprint (not loaded again on every query)
+                partition = None
+                self.oversized += 1
+            self._partitions[key] = (fingerprint, partition)
+            self._partitions.move_to_end(key)
+            self._evict_user(key)
+            self._evict()
+        return partition
+
+    def stats(self):
+        with self._lock:
+            loaded = [partition for _, partition in self._partitions.values() if partition is not None]
+            return {'searches': self.searches, 'fallbacks': self.fallbacks, 'builds': self.builds, 'evictions': self.evictions, 'oversized': self.oversized,
+                    'loaded_partitions': len(loaded), 'loaded_mb': sum(partition.nbytes for partition in loaded) / (1024 * 1024)}
+
+
+def _condition_values(condition):
+    # Equality or $in condition of a chroma where clause -> list of values (None for any other operator)
+    if isinstance(condition, str):
+        return [condition]
+    if isinstance(condition, dict) and len(condition) == 1:
+        operator, value = next(iter(condition.items()))
+        if operator == '$eq' and isinstance(value, str):
+            return [value]
+        if operator == '$in' and isinstance(value, list):
+            return value
+    return None
+
+
+def parse_where(where:Dict):
+    # Chroma where clauses written by rag.py -> (user_id, file names), each None when not restricted.
+    # Raises ValueError for any other clause.
+    user_id, file_names = None, None
+    conditions = where['$and'] if list(where) == ['$and'] else [{key: value} for key, value in where.items()]
+    for condition in conditions:
+        if not isinstance(condition, dict) or len(condition) != 1:
+            raise ValueError(f'Unsupported where clause {where}')
+        key, value = next(iter(condition.items()))
+        values = _condition_values(value)
+        if key == 'user_id' and user_id is None and values is not None and len(values) == 1:
+            user_id = values[0]
+        elif key == 'file_name' and file_names is None and values is not None:
+            file_names = values
+        else:
+            raise ValueError(f'Unsupported where clause {where}')
+    return user_id, file_names
+
+
+def parse_filters(filters):
+    # llama_index MetadataFilters of rag._get_filters (file_name equalities combined with OR) -> file names
+    if any(not hasattr(metadata_filter, 'key') for metadata_filter in filters.filters):
+        raise ValueError('Nested metadata filters are not supported')
+    if len(filters.filters) > 1 and filters.condition != FilterCondition.OR:
+        raise ValueError(f'Unsupported filter condition {filters.condition}')
+    if any(metadata_filter.key != 'file_name' or metadata_filter.operator != FilterOperator.EQ for metadata_filter in filters.filters):
+        raise ValueError('Only file_name equality filters are supported')
+    return [metadata_filter.value for metadata_filter in filters.filters]
+
+
+class ExactSearchVectorStore(ChromaVectorStore):
+    # Chroma vector store (writes and deletes unchanged) whose queries are served by the ExactSearchTier when possible
+    _tier: ExactSearchTier = PrivateAttr()
+
+    def __init__(self, chroma_collection, tier:ExactSearchTier, **kwargs):
+        super().__init__(chroma_collection=chroma_collection, **kwargs)
+        self._tier = tier
+
+    def _exact_query(self, query:VectorStoreQuery, where:Dict):
+        # Returns None when the query has to go through chroma
+        try:
+            user_id, file_names = parse_where(where) if where else (None, None)
+            if query.filters is not None:
+                file_names = parse_filters(query.filters)
+        except ValueError as e:
+            logging.debug(f'EXACT SEARCH: {e}, chroma query')
+            return None
+        collection = self._collection
+        # Shared layout: the user is given by the where clause, per_user layout: the collection is the user's
+        if user_id is None:
+            if collection.name == SHARED_COLLECTION_NAME:
+                return None
+            user_id = collection.name
+        partition = self._tier.get_partition(collection, user_id)
+        if partition is None:
+            return None
+        space = (collection.metadata or {}).get('hnsw:space', 'l2')
+        results = partition.search(query.query_embedding, query.similarity_top_k, file_names=file_names, space=space)
+        stored = collection.get(ids=[node_id for node_id, _ in results], include=['documents', 'metadatas']) if results else {'ids': []}
+        stored = {node_id: (text, metadata) for node_id, text, metadata in zip(stored['ids'], stored.get('documents') or [], stored.get('metadatas') or [])}
+        nodes, similarities, ids = [], [], []
+        for node_id, distance in results:
+            # Removed since the copy was made (replacement in progress)
+            if node_id not in stored:
+                continue
+            text, metadata = stored[node_id]
+            node = metadata_dict_to_node(metadata)
+            node.set_content(text)
+            nodes.append(node)
+            # Same score as ChromaVectorStore
+            similarities.append(float(np.exp(-distance)))
+            ids.append(node_id)
+        return VectorStoreQueryResult(nodes=nodes, similarities=similarities, ids=ids)
+
+    def query(self, query:VectorStoreQuery, **kwargs):
+        if query.query_embedding and set(kwargs) <= {'where'}:
+            result = self._exact_query(query, kwargs.get('where'))
+            if result is not None:
+                with self._tier._lock:
+                    self._tier.searches += 1
+                return result
+        with self._tier._lock:
+            self._tier.fallbacks += 1
+        return super().query(query, **kwargs)
@@ -0,0 +1,181 @@
+# Import modules
+import os
+import json
+import time
+import shutil
+import asyncio
+import hashlib
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List
+
+from llama_index.core.extractors import BaseExtractor, SummaryExtractor, TitleExtractor
+from llama_index.core.schema import BaseNode, TextNode, MetadataMode
+
+from llm_scheduler import llm_priority, BACKGROUND
+
+import logging
+
+
+def _no_progress(stage:str, done:int=0, total:int=0):
+    pass
+
+
+def _run_coroutine(coroutine):
+    # Each unit runs in a worker thread: use a private event loop (nest_asyncio's patched asyncio.run expects the main thread's loop)
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def _node_key(position:int, node:BaseNode):
+    # Stable across runs (node ids are random uuids but chunking is deterministic): position and content digest
+    digest = hashlib.sha256(node.get_content(metadata_mode=MetadataMode.NONE).encode('utf-8')).hexdigest()[:16]
+    return f'{position}_{digest}'
+
+
+class _Checkpoint():
+    # Append-only jsonl file of {"key": node key, "metadata": {...}} lines, one file per extractor
+    def __init__(self, path:str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def load(self):
+        results = {}
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Last line truncated by a crash
+                        continue
+                    results[entry['key']] = entry['metadata']
+        return results
+
+    def append(self, entries:Dict[str, Dict]):
+        with self._lock, open(self.path, 'a') as f:
+            for key, metadata in entries.items():
+                f.write(json.dumps({'key': key, 'metadata': metadata}) + '\n')
+            f.flush()
+
+
+class ExtractorExecutor():
+    # Runs a group of llama_index metadata extractors over nodes as many small independent units of work:
+    # - one unit per node (per document for TitleExtractor), units of every extractor run concurrently
+    # - LLM units run on a pool of llm_concurrency threads shared by every ingestion, other extractors
+    #   (EntityExtractor, local model) on a pool of local_concurrency threads
+    # - each finished unit is checkpointed on disk, an interrupted ingestion only runs the missing units on restart
+    # Each extractor sees the nodes as output by the chunking step (not the metadata added by the other extractors of the group).
+    def __init__(self, checkpoint_dir:str, llm_concurrency:int=4, local_concurrency:int=1):
+        self.checkpoint_dir = checkpoint_dir
+        self._llm_pool = ThreadPoolExecutor(max_workers=llm_concurrency, thread_name_prefix='extractor-llm')
+        self._local_pool = ThreadPoolExecutor(max_workers=local_concurrency, thread_name_prefix='extractor-local')
+        # Per-extractor timing of the last run
+        self.last_report = {}
+
+    def _units(self, extractor:BaseExtractor, nodes:List[BaseNode]):
+        # Lists of node positions processed together
+        if isinstance(extractor, TitleExtractor):
+            # Title is extracted from the first nodes of each document
+            positions_by_doc = defaultdict(list)
+            for position, node in enumerate(nodes):
+                positions_by_doc[node.ref_doc_id].append(position)
+            return list(positions_by_doc.values())
+        return [[position] for position in range(len(nodes))]
+
+    def _run_unit(self, extractor:BaseExtractor, unit_nodes:List[BaseNode]):
+        start = time.perf_counter()
+        # Extraction calls yield to interactive answers in the LLM scheduler
+        with llm_priority(BACKGROUND):
+            if isinstance(extractor, SummaryExtractor):
+                # Only the node's own summary, prev/next summaries are linked once every node is summarized
+                summary = _run_coroutine(extractor._agenerate_node_summary(unit_nodes[0]))
+                metadata_list = [{'section_summary': summary}]
+            else:
+                metadata_list = _run_coroutine(extractor.aextract(unit_nodes))
+        return metadata_list, time.perf_counter() - start
+
+    def _link_summaries(self, extractor:SummaryExtractor, summaries:List[str]):
+        # Same output as SummaryExtractor.aextract
+        metadata_list = [{} for _ in summaries]
+        for i, metadata in enumerate(metadata_list):
+            if i > 0 and 'prev' in extractor.summaries and summaries[i - 1]:
+                metadata['prev_section_summary'] = summaries[i - 1]
+            if i < len(summaries) - 1 and 'next' in extractor.summaries and summaries[i + 1]:
+                metadata['next_section_summary'] = summaries[i + 1]
+            if 'self' in extractor.summaries and summaries[i]:
+                metadata['section_summary'] = summaries[i]
+        return metadata_list
+
+    def run(self, nodes:List[BaseNode], extractors:List[BaseExtractor], checkpoint_key:str=None, progress=_no_progress):
+        keys = [_node_key(position, node) for position, node in enumerate(nodes)]
+        run_dir = os.path.join(self.checkpoint_dir, checkpoint_key) if checkpoint_key else None
+        if run_dir:
+            os.makedirs(run_dir, exist_ok=True)
+
+        results, checkpoints, futures = [], [], {}
+        report = {}
+        for extractor_idx, extractor in enumerate(extractors):
+            name = f'{extractor_idx}_{extractor.class_name()}'
+            checkpoint = _Checkpoint(os.path.join(run_dir, f'{name}.jsonl')) if run_dir else None
+            done = checkpoint.load() if checkpoint else {}
+            results.append(done)
+            checkpoints.append(checkpoint)
+            report[name] = {'units': 0, 'resumed_units': 0, 'busy_s': 0.0, 'wall_s': 0.0}
+            pool = self._llm_pool if hasattr(extractor, 'llm') else self._local_pool
+            for positions in self._units(extractor, nodes):
+                if all(keys[position] in done for position in positions):
+                    report[name]['resumed_units'] += 1
+                    continue
+                future = pool.submit(self._run_unit, extractor, [nodes[position] for position in positions])
+                futures[future] = (extractor_idx, name, positions)
+
+        started_at = time.perf_counter()
+        n_units, n_done, error = len(futures), 0, None
+        progress('extract', 0, n_units)
+        for future in as_completed(futures):
+            extractor_idx, name, positions = futures[future]
+            try:
+                metadata_list, busy_s = future.result()
+            except Exception as e:
+                # Stop scheduling this run's units, the finished ones stay checkpointed for the next attempt
+                if error is None:
+                    error = e
+                    for pending_future in futures:
+                        pending_future.cancel()
+                continue
+            entries = {keys[position]: metadata for position, metadata in zip(positions, metadata_list)}
+            results[extractor_idx].update(entries)
+            if checkpoints[extractor_idx]:
+                checkpoints[extractor_idx].append(entries)
+            report[name]['units'] += 1
+            report[name]['busy_s'] += busy_s
+            report[name]['wall_s'] = time.perf_counter() - started_at
+            n_done += 1
+            progress('extract', n_done, n_units)
+        if error is not None:
+            raise error
+
+        for extractor_idx, extractor in enumerate(extractors):
+            metadata_list = [results[extractor_idx][key] for key in keys]
+            if isinstance(extractor, SummaryExtractor):
+                metadata_list = self._link_summaries(extractor, [metadata.get('section_summary', '') for metadata in metadata_list])
+            # Same update as BaseExtractor.process_nodes
+            for node, metadata in zip(nodes, metadata_list):
+                node.metadata.update(metadata)
+                if not extractor.disable_template_rewrite and isinstance(node, TextNode):
+                    node.text_template = extractor.node_text_template
+
+        self.last_report = report
+        for name, stats in report.items():
+            avg_unit_s = stats['busy_s'] / stats['units'] if stats['units'] else 0.0
+            logging.info(f"EXTRACTORS: {name} {stats['units']} units ({stats['resumed_units']} resumed) "
+                         f"in {stats['wall_s']:.1f}s wall, {stats['busy_s']:.1f}s busy, {avg_unit_s:.2f}s/unit")
+        if run_dir:
+            # Results are now part of the nodes (cached by the ingestion cache)
+            shutil.rmtree(run_dir, ignore_errors=True)
+        return nodes
@@ -0,0 +1,159 @@
+# Import modules
+import os
+import json
+import shutil
+import hashlib
+import threading
+import uuid
+from typing import List
+
+import numpy as np
+
+from llama_index.core import Document
+from llama_index.core.schema import TextNode, RelatedNodeInfo
+
+import logging
+
+
+class IngestionCache():
+    # Content-addressed cache of parsing and embedding results, keyed by the sha256 of the PDF bytes.
+    # Layout: <cache_dir>/<pdf_hash>/documents_<parser_backend>.json, nodes_<flavour>.json, embeddings_<flavour>.npy
+    # The directory mtime tracks the last access and drives the LRU eviction once max_mb is exceeded.
+    def __init__(self, cache_dir:str, max_mb:int=2048):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_mb * 1024 * 1024
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def hash_pdf(pdf_bytes:bytes):
+        return hashlib.sha256(pdf_bytes).hexdigest()
+
+    def _entry_path(self, pdf_hash:str):
+        return os.path.join(self.cache_dir, pdf_hash)
+
+    def _touch(self, entry_path:str):
+        # Mark the entry as recently used
+        os.utime(entry_path, None)
+
+
+
+    ###            ###
+    ###    READ    ###
+    ###            ###
+
+    def get_documents(self, pdf_hash:str, parser_backend:str='llamaparse'):
+        entry_path = self._entry_path(pdf_hash)
+        docs_path = os.path.join(entry_path, f'documents_{parser_backend}.json')
+        with self._lock:
+            if not os.path.exists(docs_path):
+                return None
+            with open(docs_path, 'r') as f:
+                docs = [Document.from_dict(doc_dict) for doc_dict in json.load(f)]
+            if not docs:
+                # Failed parse cached by a former version: parsed again
+                return None
+            self._touch(entry_path)
+        logging.debug(f'INGESTION CACHE HIT (documents {parser_backend}) {pdf_hash}')
+        return docs
+
+    def get_nodes(self, pdf_hash:str, flavour:str='default'):
+        entry_path = self._entry_path(pdf_hash)
+        nodes_path = os.path.join(entry_path, f'nodes_{flavour}.json')
+        embeddings_path = os.path.join(entry_path, f'embeddings_{flavour}.npy')
+        with self._lock:
+            if not (os.path.exists(nodes_path) and os.path.exists(embeddings_path)):
+                return None
+            with open(nodes_path, 'r') as f:
+                node_dicts = json.load(f)
+            if not node_dicts:
+                return None
+            embeddings = np.load(embeddings_path)
+            self._touch(entry_path)
+
+        nodes = []
+        for node_dict, embedding in zip(node_dicts, embeddings):
+            node = TextNode.from_dict(node_dict)
+            node.embedding = embedding.tolist()
+            nodes.append(node)
+        logging.debug(f'INGESTION CACHE HIT (nodes {flavour}) {pdf_hash}')
+        # Fresh ids so that the same content can be stored twice in a collection (e.g. renamed copy)
+        return self._renew_node_ids(nodes)
+
+    def _renew_node_ids(self, nodes:List[TextNode]):
+        id_map = {node.node_id: str(uuid.uuid4()) for node in nodes}
+        for node in nodes:
+            node.id_ = id_map[node.node_id]
+            # Keep prev/next links pointing to the renamed nodes
+            for relation in node.relationships.values():
+                if isinstance(relation, RelatedNodeInfo) and relation.node_id in id_map:
+                    relation.node_id = id_map[relation.node_id]
+        return nodes
+
+
+
+    ###            ###
+    ###   WRITE    ###
+    ###            ###
+
+    def put_documents(self, pdf_hash:str, docs:List[Document], parser_backend:str='llamaparse'):
+        # Empty results (failed or empty parse) are refused: they would be served for this content to every later upload
+        if not docs:
+            raise ValueError(f'No documents to cache for {pdf_hash}')
+        entry_path = self._entry_path(pdf_hash)
+        with self._lock:
+            os.makedirs(entry_path, exist_ok=True)
+            self._atomic_json_dump([doc.to_dict() for doc in docs], os.path.join(entry_path, f'documents_{parser_backend}.json'))
+            self._evict()
+
+    def put_nodes(self, pdf_hash:str, nodes:List[TextNode], flavour:str='default'):
+        if not nodes:
+            raise ValueError(f'No nodes to cache for {pdf_hash}')
+        node_dicts, embeddings = [], []
+        for node in nodes:
+            node_dict = node.to_dict()
+            node_dict.pop('embedding', None)
+            node_dicts.append(node_dict)
+            embeddings.append(node.embedding)
+
+        entry_path = self._entry_path(pdf_hash)
+        with self._lock:
+            os.makedirs(entry_path, exist_ok=True)
+            embeddings_path = os.path.join(entry_path, f'embeddings_{flavour}.npy')
+            tmp_embeddings_path = f'{embeddings_path}.{uuid.uuid4().hex}.tmp.npy'
+            np.save(tmp_embeddings_path, np.asarray(embeddings, dtype=np.float32))
+            os.replace(tmp_embeddings_path, embeddings_path)
+            self._atomic_json_dump(node_dicts, os.path.join(entry_path, f'nodes_{flavour}.json'))
+            self._evict()
+
+    def _atomic_json_dump(self, data, path:str):
+        # Write to a temp file first so that readers never see a partially written entry
+        tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+
+
+    ###            ###
+    ###  EVICTION  ###
+    ###            ###
+
+    def _entry_size(self, entry_path:str):
+        return sum(os.path.getsize(os.path.join(entry_path, file_name)) for file_name in os.listdir(entry_path))
+
+    def _evict(self):
+        # Must be called with self._lock held. Remove least recently used entries until under budget.
+        entries = []
+        for pdf_hash in os.listdir(self.cache_dir):
+            entry_path = self._entry_path(pdf_hash)
+            if os.path.isdir(entry_path):
+                entries.append((os.path.getmtime(entry_path), self._entry_size(entry_path), entry_path))
+
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, entry_path in sorted(entries):
+            if total_size <= self.max_bytes:
+                break
+            logging.debug(f'INGESTION CACHE EVICT {os.path.basename(entry_path)}')
+            shutil.rmtree(entry_path, ignore_errors=True)
+            total_size -= size
@@ -0,0 +1,166 @@
+# Import modules
+import time
+import uuid
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+
+import logging
+
+
+# Ingestion stages, in order
+STAGES = ('parse', 'chunk', 'extract', 'embed', 'store')
+
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+
+
+class IngestionJob():
+    def __init__(self, user_id:str, file_name:str, content_hash:str):
+        self.job_id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.file_name = file_name
+        self.content_hash = content_hash
+        self.status = QUEUED
+        self.stage = None
+        # Progress within the current stage (e.g. embedded nodes / total nodes)
+        self.stage_done, self.stage_total = 0, 0
+        self.error = None
+        self.created_at = time.time()
+        self.started_at, self.finished_at = None, None
+        self._lock = threading.Lock()
+
+    def progress(self, stage:str, done:int=0, total:int=0):
+        # Progress callback handed to the ingestion code
+        with self._lock:
+            self.stage, self.stage_done, self.stage_total = stage, done, total
+
+    def _fraction(self):
+        if self.status == DONE:
+            return 1.0
+        if self.stage is None:
+            return 0.0
+        stage_fraction = self.stage_done / self.stage_total if self.stage_total else 0.0
+        return (STAGES.index(self.stage) + stage_fraction) / len(STAGES)
+
+    def snapshot(self):
+        # Plain dict, safe to hand to the UI while the job keeps running
+        with self._lock:
+            return {
+                'job_id': self.job_id,
+                'user_id': self.user_id,
+                'file_name': self.file_name,
+                'status': self.status,
+                'stage': self.stage,
+                'stage_done': self.stage_done,
+                'stage_total': self.stage_total,
+                'fraction': self._fraction(),
+                'error': self.error,
+                'created_at': self.created_at,
+                'started_at': self.started_at,
+                'finished_at': self.finished_at,
+            }
+
+
+class IngestionJobManager():
+    # Process-wide queue of ingestion jobs run by a bounded pool of worker threads (at most max_concurrent_jobs at once).
+    # Jobs outlive the Streamlit script run that submitted them: the UI polls their status by job id or by user.
+    def __init__(self, max_concurrent_jobs:int=2, retention_s:float=3600.0):
+        self.max_concurrent_jobs = max_concurrent_jobs
+        self.retention_s = retention_s
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrent_jobs, thread_name_prefix='ingestion')
+        self._jobs: Dict[str, IngestionJob] = {}
+        # Latest job of each (user_id, file_name, content_hash), used to deduplicate submissions of reruns
+        self._latest = {}
+        # Jobs of a (user_id, file_name) run one after the other (two versions of a file never write chunks concurrently):
+        # (user_id, file_name) of a queued or running job -> jobs waiting for it, (job, work) in submission order
+        self._file_queues = {}
+        self._lock = threading.Lock()
+
+    def submit(self, user_id:str, file_name:str, content_hash:str, work:Callable[[Callable], None], retry:bool=False):
+        # work(progress) runs the ingestion, progress(stage, done, total) reports its advancement.
+        # The same upload submitted again (every rerun does) returns the existing job, failed ones are only re-run on retry.
+        key = (user_id, file_name, content_hash)
+        with self._lock:
+            self._purge()
+            job = self._jobs.get(self._latest.get(key))
+            if job is not None and not (retry and job.status == FAILED):
+                return job.snapshot()
+            job = IngestionJob(user_id, file_name, content_hash)
+            self._jobs[job.job_id] = job
+            self._latest[key] = job.job_id
+            waiting = self._file_queues.get((user_id, file_name))
+            if waiting is not None:
+                waiting.append((job, work))
+            else:
+                self._file_queues[(user_id, file_name)] = deque()
+        if waiting is None:
+            self._executor.submit(self._run, job, work)
+        logging.debug(f'INGESTION JOBS: queued {file_name} for user {user_id} ({job.job_id})')
+        return job.snapshot()
+
+    def _run(self, job:IngestionJob, work:Callable[[Callable], None]):
+        with job._lock:
+            job.status, job.started_at = RUNNING, time.time()
+        try:
+            work(job.progress)
+        except Exception as e:
+            logging.exception(f'INGESTION JOBS: {job.file_name} failed')
+            with job._lock:
+                job.status, job.error, job.finished_at = FAILED, str(e), time.time()
+        else:
+            with job._lock:
+                job.status, job.finished_at = DONE, time.time()
+            logging.debug(f'INGESTION JOBS: {job.file_name} ingested in {job.finished_at - job.started_at:.1f}s')
+        self._start_next(job.user_id, job.file_name)
+
+    def _start_next(self, user_id:str, file_name:str):
+        # Next job waiting for the same file, if any
+        with self._lock:
+            waiting = self._file_queues[(user_id, file_name)]
+            if not waiting:
+                del self._file_queues[(user_id, file_name)]
+                return
+            job, work = waiting.popleft()
+        self._executor.submit(self._run, job, work)
+
+    def forget_file(self, user_id:str, file_name:str, keep_hash:str=None):
+        # The file was deleted (or replaced by the version keep_hash): its finished jobs no longer stand for the content
+        # loaded, uploading one of these versions again must ingest it instead of returning the finished job
+        with self._lock:
+            for key in [key for key in self._latest if key[:2] == (user_id, file_name) and key[2] != keep_hash]:
+                if self._jobs[self._latest[key]].finished_at is not None:
+                    del self._latest[key]
+
+    def _purge(self):
+        # Finished jobs are kept retention_s seconds for the UI to display their outcome
+        now = time.time()
+        expired = [job_id for job_id, job in self._jobs.items() if job.finished_at is not None and now - job.finished_at > self.retention_s]
+        for job_id in expired:
+            job = self._jobs.pop(job_id)
+            key = (job.user_id, job.file_name, job.content_hash)
+            if self._latest.get(key) == job_id:
+                del self._latest[key]
+
+
+
+    ###             ###
+    ###   POLLING   ###
+    ###             ###
+
+    def get_job(self, job_id:str):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        return job.snapshot() if job is not None else None
+
+    def get_user_jobs(self, user_id:str, active_only:bool=False) -> List[Dict]:
+        with self._lock:
+            jobs = [job for job in self._jobs.values() if job.user_id == user_id]
+        snapshots = sorted((job.snapshot() for job in jobs), key=lambda snapshot: snapshot['created_at'])
+        if active_only:
+            snapshots = [snapshot for snapshot in snapshots if snapshot['status'] in (QUEUED, RUNNING)]
+        return snapshots
+
+    def queue_depth(self):
+        with self._lock:
+            return sum(job.status == QUEUED for job in self._jobs.values())
@@ -0,0 +1,394 @@
+# Import modules
+import json
+import time
+import heapq
+import asyncio
+import itertools
+import threading
+import contextvars
+from contextlib import contextmanager
+from concurrent.futures import Future
+from typing import Any, Callable, Sequence
+
+import httpx
+
+from llama_index.core.llms import LLM
+from llama_index.core.base.llms.types import (ChatMessage, ChatResponse, CompletionResponse, MessageRole, LLMMetadata)
+from llama_index.core.llms.callbacks import llm_chat_callback, llm_completion_callback
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.chat_engine import CondensePlusContextChatEngine
+from llama_index.core.chat_engine.types import StreamingAgentChatResponse
+from llama_index.core.types import Thread
+from llama_index.llms.ollama import Ollama
+from llama_index.llms.ollama.base import get_additional_kwargs
+
+
+# Priority classes, lower value served first
+INTERACTIVE, CONDENSE, BACKGROUND = 0, 1, 2
+PRIORITY_NAMES = {INTERACTIVE: 'interactive', CONDENSE: 'condense', BACKGROUND: 'background'}
+
+# Priority of the LLM calls made by the current thread / task (interactive unless stated otherwise)
+_current_priority = contextvars.ContextVar('llm_priority', default=INTERACTIVE)
+
+
+@contextmanager
+def llm_priority(priority:int):
+    token = _current_priority.set(priority)
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+
+def current_priority():
+    return _current_priority.get()
+
+
+# Cancellation of the LLM streams started by the current thread / task (e.g. an API request whose client may disconnect).
+# Chat engines consume the LLM stream on their own history writer thread: closing the answer generator does not stop it.
+_current_stream_cancel = contextvars.ContextVar('llm_stream_cancel', default=None)
+
+
+@contextmanager
+def llm_stream_cancel(cancel:threading.Event):
+    token = _current_stream_cancel.set(cancel)
+    try:
+        yield
+    finally:
+        _current_stream_cancel.reset(token)
+
+
+def current_stream_cancel():
+    return _current_stream_cancel.get()
+
+
+class LLMScheduler():
+    # Process-wide gate in front of the LLM server:
+    # - at most max_concurrency calls in flight, waiting calls served by priority class then in arrival order
+    # - identical non streaming calls of the same priority class in flight at the same time share a single call
+    # - queue wait and generation time recorded per priority class
+    def __init__(self, max_concurrency:int=2):
+        self.max_concurrency = max_concurrency
+        self._cond = threading.Condition()
+        self._waiting = []
+        self._arrival = itertools.count()
+        self._running = 0
+        self._inflight = {}
+        self._metrics = {priority: {'requests': 0, 'coalesced': 0, 'failed': 0, 'queue_wait_s_sum': 0.0, 'max_queue_wait_s': 0.0,
+                                    'generation_s_sum': 0.0}
+                         for priority in PRIORITY_NAMES}
+
+    def _acquire(self, priority:int):
+        ticket = (priority, next(self._arrival))
+        enqueued_at = time.perf_counter()
+        with self._cond:
+            heapq.heappush(self._waiting, ticket)
+            while self._running >= self.max_concurrency or self._waiting[0] != ticket:
+                self._cond.wait()
+            heapq.heappop(self._waiting)
+            self._running += 1
+            # The next waiter may also fit in a free slot
+            self._cond.notify_all()
+        return time.perf_counter() - enqueued_at
+
+    def _release(self):
+        with self._cond:
+            self._running -= 1
+            self._cond.notify_all()
+
+    def _record(self, priority:int, queue_wait_s:float, generation_s:float, failed:bool=False):
+        with self._cond:
+            metrics = self._metrics[priority]
+            metrics['requests'] += 1
+            metrics['failed'] += failed
+            metrics['queue_wait_s_sum'] += queue_wait_s
+            metrics['max_queue_wait_s'] = max(metrics['max_queue_wait_s'], queue_wait_s)
+            metrics['generation_s_sum'] += generation_s
+
+    def _run_scheduled(self, fn:Callable, priority:int):
+        queue_wait_s = self._acquire(priority)
+        started_at, failed = time.perf_counter(), True
+        try:
+            result = fn()
+            failed = False
+            return result
+        finally:
+            self._release()
+            self._record(priority, queue_wait_s, time.perf_counter() - started_at, failed=failed)
+
+    def run(self, fn:Callable, key:str=None, priority:int=None):
+        priority = current_priority() if priority is None else priority
+        if key is None:
+            return self._run_scheduled(fn, priority)
+
+        # Coalescing: the first caller runs the request, identical concurrent ones wait for its result
+        key = (priority, key)
+        with self._cond:
+            leader_future = self._inflight.get(key)
+            if leader_future is None:
+                future = self._inflight[key] = Future()
+            else:
+                self._metrics[priority]['coalesced'] += 1
+        if leader_future is not None:
+            return leader_future.result()
+        try:
+            result = self._run_scheduled(fn, priority)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._cond:
+                self._inflight.pop(key, None)
+
+    def stream(self, gen_factory:Callable, priority:int=None, cancel:threading.Event=None):
+        # The slot is held until the stream is exhausted (or closed), or cancel is set: the LLM stream is then closed at its
+        # next chunk, whichever thread consumes it (a stream cancelled while waiting for its slot never starts)
+        priority = current_priority() if priority is None else priority
+        queue_wait_s = self._acquire(priority)
+        started_at, failed = time.perf_counter(), True
+        try:
+            if cancel is None or not cancel.is_set():
+                gen = gen_factory()
+                try:
+                    for chunk in gen:
+                        if cancel is not None and cancel.is_set():
+                            break
+                        yield chunk
+                finally:
+                    if hasattr(gen, 'close'):
+                        gen.close()
+            failed = False
+        finally:
+            self._release()
+            self._record(priority, queue_wait_s, time.perf_counter() - started_at, failed=failed)
+
+    def metrics(self):
+        with self._cond:
+            snapshot = {'running': self._running, 'waiting': len(self._waiting), 'max_concurrency': self.max_concurrency}
+            for priority, name in PRIORITY_NAMES.items():
+                metrics = self._metrics[priority]
+                n_requests = max(1, metrics['requests'])
+                busy_s = metrics['queue_wait_s_sum'] + metrics['generation_s_sum']
+                snapshot[name] = {
+                    'requests': metrics['requests'],
+                    'coalesced': metrics['coalesced'],
+                    'failed': metrics['failed'],
+                    'avg_queue_wait_ms': 1000 * metrics['queue_wait_s_sum'] / n_requests,
+                    'max_queue_wait_ms': 1000 * metrics['max_queue_wait_s'],
+                    'avg_generation_ms': 1000 * metrics['generation_s_sum'] / n_requests,
+                    # Share of the calls' latency spent waiting for a slot
+                    'queue_wait_share': metrics['queue_wait_s_sum'] / busy_s if busy_s else 0.0,
+                }
+        return snapshot
+
+
+def _request_key(kind:str, payload, kwargs):
+    return json.dumps([kind, payload, kwargs], sort_keys=True, default=str)
+
+
+def _messages_key(messages:Sequence[ChatMessage]):
+    return [(message.role.value, message.content, message.additional_kwargs) for message in messages]
+
+
+async def _aiterate_in_thread(gen):
+    # Async view of a blocking generator, each step runs in a worker thread
+    sentinel = object()
+    while True:
+        chunk = await asyncio.to_thread(next, gen, sentinel)
+        if chunk is sentinel:
+            return
+        yield chunk
+
+
+class ScheduledLLM(LLM):
+    # Routes every call of the wrapped LLM through the LLMScheduler. Priority is read from llm_priority() at call time.
+    # Async calls run the sync ones in worker threads so that all calls share the same scheduler slots.
+    _llm: Any = PrivateAttr()
+    _scheduler: Any = PrivateAttr()
+
+    def __init__(self, llm:LLM, scheduler:LLMScheduler, **kwargs):
+        super().__init__(callback_manager=llm.callback_manager, **kwargs)
+        self._llm = llm
+        self._scheduler = scheduler
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "ScheduledLLM"
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return self._llm.metadata
+
+    @property
+    def scheduler(self):
+        return self._scheduler
+
+    def chat(self, messages:Sequence[ChatMessage], **kwargs:Any) -> ChatResponse:
+        return self._scheduler.run(lambda: self._llm.chat(messages, **kwargs), key=_request_key('chat', _messages_key(messages), kwargs))
+
+    def complete(self, prompt:str, formatted:bool=False, **kwargs:Any) -> CompletionResponse:
+        return self._scheduler.run(lambda: self._llm.complete(prompt, formatted=formatted, **kwargs),
+                                   key=_request_key('complete', [prompt, formatted], kwargs))
+
+    def stream_chat(self, messages:Sequence[ChatMessage], **kwargs:Any):
+        return self._scheduler.stream(lambda: self._llm.stream_chat(messages, **kwargs), priority=current_priority(),
+                                      cancel=current_stream_cancel())
+
+    def stream_complete(self, prompt:str, formatted:bool=False, **kwargs:Any):
+        return self._scheduler.stream(lambda: self._llm.stream_complete(prompt, formatted=formatted, **kwargs), priority=current_priority(),
+                                      cancel=current_stream_cancel())
+
+    async def achat(self, messages:Sequence[ChatMessage], **kwargs:Any) -> ChatResponse:
+        return await asyncio.to_thread(self.chat, messages, **kwargs)
+
+    async def acomplete(self, prompt:str, formatted:bool=False, **kwargs:Any) -> CompletionResponse:
+        return await asyncio.to_thread(self.complete, prompt, formatted, **kwargs)
+
+    async def astream_chat(self, messages:Sequence[ChatMessage], **kwargs:Any):
+        return _aiterate_in_thread(self.stream_chat(messages, **kwargs))
+
+    async def astream_complete(self, prompt:str, formatted:bool=False, **kwargs:Any):
+        return _aiterate_in_thread(self.stream_complete(prompt, formatted, **kwargs))
+
+
+class PooledOllama(Ollama):
+    # Ollama client reusing keep-alive connections of a single httpx.Client (the base class opens a new client per call).
+    # Same requests and responses as llama_index.llms.ollama.Ollama.
+    _client: Any = PrivateAttr()
+
+    def __init__(self, max_connections:int=8, **kwargs:Any):
+        super().__init__(**kwargs)
+        self._client = httpx.Client(timeout=httpx.Timeout(self.request_timeout),
+                                    limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections))
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "PooledOllama"
+
+    def _payload(self, stream:bool, **kwargs:Any):
+        payload = {"model": self.model, "options": self._model_kwargs, "stream": stream, **kwargs}
+        if self.json_mode:
+            payload["format"] = "json"
+        return payload
+
+    def _chat_payload(self, messages:Sequence[ChatMessage], stream:bool, **kwargs:Any):
+        messages = [{"role": message.role.value, "content": message.content, **message.additional_kwargs} for message in messages]
+        return self._payload(stream, messages=messages, **kwargs)
+
+    def _chat_response(self, raw, text:str=None, delta:str=None):
+        message = raw["message"]
+        return ChatResponse(
+            message=ChatMessage(content=text if text is not None else message.get("content"),
+                                role=MessageRole(message.get("role")),
+                                additional_kwargs=get_additional_kwargs(message, ("content", "role"))),
+            delta=delta,
+            raw=raw,
+            additional_kwargs=get_additional_kwargs(raw, ("message",)),
+        )
+
+    @llm_chat_callback()
+    def chat(self, messages:Sequence[ChatMessage], **kwargs:Any) -> ChatResponse:
+        response = self._client.post(url=f"{self.base_url}/api/chat", json=self._chat_payload(messages, stream=False, **kwargs))
+        response.raise_for_status()
+        return self._chat_response(response.json())
+
+    @llm_chat_callback()
+    def stream_chat(self, messages:Sequence[ChatMessage], **kwargs:Any):
+        def gen():
+            with self._client.stream(method="POST", url=f"{self.base_url}/api/chat", json=self._chat_payload(messages, stream=True, **kwargs)) as response:
+                response.raise_for_status()
+                text = ""
+                for line in response.iter_lines():
+                    if line:
+                        chunk = json.loads(line)
+                        if chunk.get("done"):
+                            break
+                        delta = chunk["message"].get("content")
+                        text += delta
+                        yield self._chat_response(chunk, text=text, delta=delta)
+        return gen()
+
+    @llm_completion_callback()
+    def complete(self, prompt:str, formatted:bool=False, **kwargs:Any) -> CompletionResponse:
+        response = self._client.post(url=f"{self.base_url}/api/generate", json=self._payload(False, **{self.prompt_key: prompt}, **kwargs))
+        response.raise_for_status()
+        raw = response.json()
+        return CompletionResponse(text=raw.get("response"), raw=raw, additional_kwargs=get_additional_kwargs(raw, ("response",)))
+
+    @llm_completion_callback()
+    def stream_complete(self, prompt:str, formatted:bool=False, **kwargs:Any):
+        def gen():
+            with self._client.stream(method="POST", url=f"{self.base_url}/api/generate", json=self._payload(True, **{self.prompt_key: prompt}, **kwargs)) as response:
+                response.raise_for_status()
+                text = ""
+                for line in response.iter_lines():
+                    if line:
+                        chunk = json.loads(line)
+                        delta = chunk.get("response")
+                        text += delta
+                        yield CompletionResponse(delta=delta, text=text, raw=chunk, additional_kwargs=get_additional_kwargs(chunk, ("response",)))
+        return gen()
+
+    # Async calls use the pooled sync client from a worker thread (an httpx.AsyncClient is bound to a single event loop)
+    @llm_chat_callback()
+    async def achat(self, messages:Sequence[ChatMessage], **kwargs:Any) -> ChatResponse:
+        return await asyncio.to_thread(self.chat, messages, **kwargs)
+
+    @llm_completion_callback()
+    async def acomplete(self, prompt:str, formatted:bool=False, **kwargs:Any) -> CompletionResponse:
+        return await asyncio.to_thread(self.complete, prompt, formatted, **kwargs)
+
+    @llm_completion_callback()
+    async def astream_complete(self, prompt:str, formatted:bool=False, **kwargs:Any):
+        return _aiterate_in_thread(self.stream_complete(prompt, formatted, **kwargs))
+
+
+class PrioritizedCondensePlusContextChatEngine(CondensePlusContextChatEngine):
+    # Condense-question calls are scheduled in the CONDENSE class (behind interactive answers, ahead of background extraction).
+    # Given a condenser (condense.QuestionCondenser), the condense step follows its strategy / model and the time to first
+    # token of the answers is recorded per strategy.
+    _condenser = None
+
+    @classmethod
+    def from_defaults(cls, *args, condenser=None, **kwargs):
+        engine = super().from_defaults(*args, **kwargs)
+        engine._condenser = condenser
+        return engine
+
+    def _condense_question(self, chat_history, latest_message:str) -> str:
+        with llm_priority(CONDENSE):
+            if self._condenser is None:
+                return super()._condense_question(chat_history, latest_message)
+            return self._condenser.condense(chat_history, latest_message, self._condense_prompt_template)
+
+    async def _acondense_question(self, chat_history, latest_message:str) -> str:
+        with llm_priority(CONDENSE):
+            if self._condenser is None:
+                return await super()._acondense_question(chat_history, latest_message)
+            return await self._condenser.acondense(chat_history, latest_message, self._condense_prompt_template)
+
+    def chat(self, message:str, chat_history=None):
+        started_at = time.perf_counter()
+        response = super().chat(message, chat_history)
+        if self._condenser is not None:
+            # Not streamed: the first token comes with the whole answer
+            self._condenser.record_ttft(time.perf_counter() - started_at)
+        return response
+
+    def stream_chat(self, message:str, chat_history=None):
+        if self._condenser is None:
+            return super().stream_chat(message, chat_history)
+        # Same as CondensePlusContextChatEngine.stream_chat, with the LLM stream timed
+        started_at = time.perf_counter()
+        chat_messages, context_source, context_nodes = self._run_c3(message, chat_history)
+        chat_response = StreamingAgentChatResponse(
+            chat_stream=self._condenser.timed_stream(self._llm.stream_chat(chat_messages), started_at),
+            sources=[context_source],
+            source_nodes=context_nodes,
+        )
+        thread = Thread(target=chat_response.write_response_to_history, args=(self._memory,))
+        thread.start()
+        return chat_response
@@ -0,0 +1,111 @@
+# Import modules
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple
+
+from llama_index.core import Document
+from llama_index.core.readers.base import BaseReader
+
+import logging
+
+
+PARSER_BACKENDS = ('llamaparse', 'local')
+
+# Lines considered as headings when converting raw page text to markdown
+_NUMBERED_HEADING = re.compile(r'^(\d+(\.\d+)*\.?|[IVX]+\.)\s+[A-Z][^.!?]{0,80}$')
+_HYPHENATED_LINE_END = re.compile(r'(\w)-\n(\w)')
+
+
+def _extract_page_range(file_path:str, start:int, end:int) -> List[Tuple[int, str]]:
+    # Module level function so that it can be sent to the process pool workers.
+    # Each worker opens the PDF itself, only the (small) page range is pickled.
+    from pypdf import PdfReader
+    reader = PdfReader(file_path)
+    return [(page_idx, reader.pages[page_idx].extract_text() or '') for page_idx in range(start, end)]
+
+
+def _page_text_to_markdown(text:str) -> str:
+    # Light markdown-ish formatting close to LlamaParse output: merge hyphenated words, mark headings
+    text = _HYPHENATED_LINE_END.sub(r'\1\2', text)
+    lines = []
+    for line in text.splitlines():
+        stripped = line.strip()
+        if not stripped:
+            continue
+        if _NUMBERED_HEADING.match(stripped) or (stripped.isupper() and 3 < len(stripped) < 80):
+            lines.append(f'\n## {stripped}\n')
+        else:
+            lines.append(stripped)
+    return '\n'.join(lines).strip()
+
+
+class LocalPDFParser(BaseReader):
+    # Offline PDF parser (pypdf). The PDF is split in page ranges extracted in parallel by a process pool,
+    # and one markdown-ish Document is produced per page with its page number in the metadata.
+    def __init__(self, max_workers:int=None, pages_per_task:int=16):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.pages_per_task = max(1, pages_per_task)
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    def _get_executor(self):
+        # Pool created on first use and reused by every parse (process startup is not paid per PDF)
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            return self._executor
+
+    def _page_ranges(self, n_pages:int):
+        return [(start, min(start + self.pages_per_task, n_pages)) for start in range(0, n_pages, self.pages_per_task)]
+
+    def _extract_pages(self, file_path:str) -> List[Tuple[int, str]]:
+        from pypdf import PdfReader
+        n_pages = len(PdfReader(file_path).pages)
+        page_ranges = self._page_ranges(n_pages)
+        # Small PDFs are not worth the inter-process round trip
+        if self.max_workers == 1 or len(page_ranges) == 1:
+            return [page for start, end in page_ranges for page in _extract_page_range(file_path, start, end)]
+
+        executor = self._get_executor()
+        futures = [executor.submit(_extract_page_range, file_path, start, end) for start, end in page_ranges]
+        return [page for future in futures for page in future.result()]
+
+    def load_data(self, file, extra_info:Dict=None) -> List[Document]:
+        file_path = str(file)
+        pages = self._extract_pages(file_path)
+        logging.debug(f'LOCAL PARSER: {len(pages)} pages extracted from {os.path.basename(file_path)}')
+
+        docs = []
+        for page_idx, page_text in pages:
+            text = _page_text_to_markdown(page_text)
+            if not text:
+                continue
+            metadata = dict(extra_info or {})
+            # Same key as llama_index PDFReader
+            metadata['page_label'] = str(page_idx + 1)
+            docs.append(Document(text=text, metadata=metadata))
+        return docs
+
+    def shutdown(self):
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+
+def get_parser(backend:str, local_max_workers:int=None, local_pages_per_task:int=16):
+    # Parser backends selectable through config.PARSER_BACKEND
+    if backend == 'local':
+        return LocalPDFParser(max_workers=local_max_workers, pages_per_task=local_pages_per_task)
+    if backend == 'llamaparse':
+        from llama_parse import LlamaParse
+        return LlamaParse(
+            api_key=os.environ.get('LLAMA_CLOUD_API_KEY'),
+            result_type="markdown",  # "markdown" and "text" are available
+            num_workers=4,  # if multiple files passed, split in `num_workers` API calls
+            verbose=True,
+            language="en",  # Optionally you can define a language, default=en
+            )
+    raise ValueError(f"Unknown parser backend '{backend}'. Available backends: {', '.join(PARSER_BACKENDS)}.")
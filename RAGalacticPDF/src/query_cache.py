@@ -0,0 +1,119 @@
+# Import modules
+import re
+from typing import List
+
+from llama_index.core.base.response.schema import StreamingResponse
+from llama_index.core.chat_engine.types import StreamingAgentChatResponse
+
+from engine_cache import TTLLRUCache
+
+import logging
+
+
+# Answer of the llama_index query engines when no node was retrieved
+EMPTY_RESPONSE = 'Empty Response'
+
+
+def normalize_query(text:str):
+    # Case, whitespace and trailing punctuation do not change the question ("Summarize this paper ?" == "summarize this paper")
+    return ' '.join(text.lower().split()).rstrip(' ?!.')
+
+
+class QueryEmbeddingCache():
+    # LRU mapping normalized query text -> query embedding (skips the embedding model for repeated questions)
+    def __init__(self, max_size:int=4096):
+        self._cache = TTLLRUCache(max_size=max_size, ttl_s=None)
+
+    def get(self, query:str):
+        return self._cache.get(normalize_query(query))
+
+    def set(self, query:str, embedding:List[float]):
+        self._cache.set(normalize_query(query), embedding)
+
+    def stats(self):
+        return self._cache.stats()
+
+
+class CachedResponse():
+    # Answer served from the AnswerCache. Exposes the attributes used by the app for both streaming
+    # (response_gen, replaying the stored answer chunk by chunk) and non streaming (response) engines.
+    def __init__(self, response:str, node_ids:List[str]):
+        self.response = response
+        self.node_ids = node_ids
+        # Retrieval is skipped on a hit, only the ids of the nodes used for the original answer are kept
+        self.source_nodes = []
+        self.metadata = {'cache_hit': True}
+
+    @property
+    def response_gen(self):
+        # Words with their trailing whitespace, so that the joined chunks give back the exact answer
+        for chunk in re.findall(r'\S+\s*|\s+', self.response):
+            yield chunk
+
+    def __str__(self):
+        return self.response
+
+
+class _RecordingStreamingResponse():
+    # Wraps a streaming response: chunks are forwarded to the caller and the full answer is stored once the stream is exhausted
+    def __init__(self, response, on_complete):
+        self._response = response
+        self._on_complete = on_complete
+        self._text = None
+
+    @property
+    def response_gen(self):
+        chunks = []
+        for chunk in self._response.response_gen:
+            chunks.append(chunk)
+            yield chunk
+        self._text = ''.join(chunks)
+        self._on_complete(self._text)
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+    def __str__(self):
+        # The wrapped response_gen is already consumed, str() of the wrapped response would be empty
+        return self._text if self._text is not None else str(self._response)
+
+
+class AnswerCache():
+    # Final answers keyed by (user_id, file set, llm_mode, knowledge base flag, normalized query, file set fingerprint).
+    # The fingerprint is derived from the content hashes of the files in the catalog: adding, replacing or removing
+    # a file of the set changes it, so stale answers are never served. Entries of a user are also dropped on ingestion.
+    def __init__(self, max_size:int=1024, ttl_s:float=86400.0):
+        self._cache = TTLLRUCache(max_size=max_size, ttl_s=ttl_s)
+
+    @staticmethod
+    def key(user_id:str, pdf_names, llm_mode:str, llm_knowledge_base:bool, query:str, fingerprint:str):
+        files_key = frozenset(pdf_names) if pdf_names is not None else None
+        return (user_id, files_key, llm_mode, bool(llm_knowledge_base), normalize_query(query), fingerprint)
+
+    def get(self, key):
+        cached = self._cache.get(key)
+        logging.debug(f"ANSWER CACHE: {'hit' if cached is not None else 'miss'} {self._cache.stats()}")
+        if cached is None:
+            return None
+        response, node_ids = cached
+        return CachedResponse(response, node_ids)
+
+    def _store(self, key, response:str, source_nodes):
+        # Failed or empty generations are never cached, nor answers given without retrieved context (llama_index answers
+        # "Empty Response" when retrieval returns nothing, e.g. while the user's files are being written)
+        if not source_nodes or not response or not response.strip() or response.strip() == EMPTY_RESPONSE:
+            return
+        self._cache.set(key, (response, [source_node.node.node_id for source_node in source_nodes]))
+
+    def record(self, key, response):
+        # Streaming answers are stored after the caller consumed the stream, the others immediately
+        if isinstance(response, (StreamingResponse, StreamingAgentChatResponse)):
+            return _RecordingStreamingResponse(response, lambda text: self._store(key, text, response.source_nodes))
+        self._store(key, response.response, response.source_nodes)
+        return response
+
+    def invalidate_user(self, user_id:str):
+        return self._cache.invalidate(lambda key: key[0] == user_id)
+
+    def stats(self):
+        return self._cache.stats()
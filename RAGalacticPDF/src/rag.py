@@ -1,23 +1,19 @@
 # Import modules
 import os
-import json
+import time
+import copy
+import hashlib
+import tempfile
+from collections import defaultdict
 from typing import Dict, Tuple, List
-import torch
 
-from llama_index.llms.ollama import Ollama
-from llama_index.embeddings.huggingface import HuggingFaceEmbedding
 from llama_index.core import SimpleDirectoryReader, VectorStoreIndex, Settings
-from llama_parse import LlamaParse
-from llama_index.core.extractors import (TitleExtractor, QuestionsAnsweredExtractor, SummaryExtractor, 
-                                         QuestionsAnsweredExtractor, TitleExtractor, KeywordExtractor)
-from llama_index.extractors.entity import EntityExtractor
-from llama_index.core.node_parser import SentenceSplitter
-from llama_index.core.ingestion import IngestionPipeline
-from llama_index.core.memory import ChatMemoryBuffer
+from llama_index.core.ingestion import run_transformations
+from llama_index.core.extractors import BaseExtractor
+from llama_index.core.base.embeddings.base import BaseEmbedding
 from llama_index.core.llms import ChatMessage
 from llama_index.core import PromptTemplate
 
-import chromadb
 from llama_index.core.storage.storage_context import StorageContext
 from llama_index.vector_stores.chroma import ChromaVectorStore
 from llama_index.core.vector_stores.types import MetadataFilter, MetadataFilters, FilterCondition
@@ -28,12 +24,48 @@ nest_asyncio.apply()
 from prompt import (PROMPT_NO_KNOWLEDGE_BASE, PROMPT_WITH_KNOWLEDGE_BASE,
                     text_qa_template_str, refine_template_str,
                     text_qa_template_str_no_knowledge_base, refine_template_str_no_knowledge_base)
+from resources import get_shared_resources
+from exact_search import ExactSearchVectorStore
+from parsers import PARSER_BACKENDS
+from collection_layout import get_or_create_collection
+from llm_scheduler import PrioritizedCondensePlusContextChatEngine
+from context_assembly import TokenBudgetPostprocessor
+from chat_memory import new_chat_memory
+from query_cache import CachedResponse
+from telemetry import registry, COUNT_BUCKETS
+from config import (CHROMA_DB_DIR, COLLECTION_LAYOUT, SHARED_COLLECTION_NAME, CONTEXT_ASSEMBLY, CONTEXT_TOKEN_BUDGET, CONTEXT_CANDIDATES_FACTOR, CONTEXT_DEDUP_THRESHOLD,
+                    CHAT_MEMORY_MODE, CHAT_MEMORY_RECENT_TURNS)
 
 
-import logging
-logging.basicConfig(level=logging.DEBUG)
-    
-logging.debug(f'CHECK RAGGGG')
+# Nodes embedded / written to the vector store per step (ingestion progress is reported between steps)
+INGESTION_PROGRESS_BATCH_SIZE = 256
+
+
+def _no_progress(stage:str, done:int=0, total:int=0):
+    pass
+
+
+def _chroma_embedding_lookup(chroma_collection):
+    # Stored embeddings of retrieved nodes (chroma queries do not return them)
+    def lookup(node_ids:List[str]):
+        result = chroma_collection.get(ids=node_ids, include=['embeddings'])
+        return dict(zip(result['ids'], result['embeddings']))
+    return lookup
+
+
+def _chunk_hash(text:str):
+    # Change detection of replace_pdf: chunks are compared on their text (the document stored in chroma for each node)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class _UploadedPDF():
+    # Name and bytes of an uploaded PDF, detached from the Streamlit UploadedFile (which does not outlive the script run)
+    def __init__(self, name:str, data:bytes):
+        self.name = name
+        self.data = data
+
+    def getvalue(self):
+        return self.data
 
 
 class RAGalacticPDF():
@@ -41,46 +73,38 @@ class RAGalacticPDF():
         
         self.project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
         self.data_folder_path = os.path.join(self.project_root, 'data')
-        self.db_folder_path = os.path.join(self.project_root, 'chroma_db_data')
+        self.db_folder_path = CHROMA_DB_DIR
         # Ensure the destination directory exists
         for path in [self.data_folder_path, self.db_folder_path]:
             os.makedirs(path, exist_ok=True)
-            
-        self.json_ids_path = os.path.join(self.data_folder_path, 'json_ids.json')
+
         self.app_credentials_path = os.path.join(self.project_root, 'app_credentials', 'app_credentials.yaml')
 
-        self.device = 'cuda' if torch.cuda.is_available() else 'cpu'
-        
-        logging.debug(f'CHECK OLLAMA')
-        if "OLLAMA_BASE_URL" in os.environ:
-            # Currently running in Docker so need to provide the URL to access to ollama (also running in a container)
-            logging.debug(f"RUNNING IN DOCKER {os.environ.get('OLLAMA_BASE_URL')}")
-            self.llm = Ollama(model="llama3", request_timeout=300.0, base_url=os.environ.get('OLLAMA_BASE_URL'))
-        else:
-            logging.debug(f'NOT RUNNING IN DOCKER')
-            self.llm = Ollama(model="llama3", request_timeout=300.0)
+        # Heavy models and clients are shared process-wide, the instance only keeps references to them
+        self.resources = get_shared_resources()
+        self.llm = self.resources.llm
+        self.embed_model = self.resources.embed_model
+        self.parser_backend = self.resources.parser_backend
+        self.chroma_client = self.resources.chroma_client
+        self.ingestion_cache = self.resources.ingestion_cache
+        self.catalog = self.resources.catalog
+        self.engine_cache = self.resources.engine_cache
+        self.answer_cache = self.resources.answer_cache
+        self.job_manager = self.resources.job_manager
+        self.extractor_executor = self.resources.extractor_executor
 
-        self.embed_model = HuggingFaceEmbedding(model_name="BAAI/bge-small-en-v1.5", device=self.device)
-        self._init_llm_and_embedd_models()
-        
-        self.parser = self._get_parser()
-        self.llm_mode, self.streaming = None, None
+        # Per-session state
+        self.llm_mode, self.streaming, self.llm_knowledge_base = None, None, False
         self.chat_history = []
+        # Chat memory plugged in the (shared, cached) chat engine for this session's turns
+        self.chat_memory = None
         
         self.user_id = None
-        self.chroma_client = self._get_chromadb_client()
         self.chroma_collection, self.vector_store, self.storage_context = None, None, None
+        # Files the current engine is restricted to (None: every file of the user), part of the answer cache key
+        self.active_pdf_names = None
 
         self.use_custom_transforms = False
-        self.custom_transforms = [
-                SentenceSplitter(separator=" ", chunk_size=1024, chunk_overlap=128),
-                SummaryExtractor(summaries=["prev", "self", "next"]), # automatically extracts a summary over a set of Nodes
-                QuestionsAnsweredExtractor(questions=3), # extracts a set of questions that each Node can answer
-                TitleExtractor(nodes=5), # extracts a title over the context of each Node
-                EntityExtractor(device=self.device), # - extracts entities (i.e. names of places, people, things) mentioned in the content of each Node
-                KeywordExtractor(),
-                self.embed_model,
-            ]
         
         # Context prompt for chat engine
         self.context_prompt = None
@@ -91,10 +115,25 @@ class RAGalacticPDF():
         self.similarity_top_k=3 
         self.chat_mode='condense_plus_context'
 
-    def _init_llm_and_embedd_models(self):
-        # Initialize llm and ServiceContext
-        Settings.llm = self.llm
-        Settings.embed_model = self.embed_model
+    # Shared components built on first use (see SharedResources)
+    @property
+    def device(self):
+        return self.resources.device
+
+    @property
+    def parser(self):
+        return self.resources.get_parser(self.parser_backend)
+
+    @property
+    def custom_transforms(self):
+        return self.resources.custom_transforms
+
+    def set_parser(self, backend:str):
+        # Pluggable parser: any llama_index BaseReader backend registered in parsers.get_parser ('llamaparse', 'local'),
+        # built when the first PDF is parsed
+        if backend not in PARSER_BACKENDS:
+            raise ValueError(f"Unknown parser backend '{backend}'. Available backends: {', '.join(PARSER_BACKENDS)}.")
+        self.parser_backend = backend
 
     def set_user_id(self, user_id):
         self.user_id = user_id 
@@ -102,13 +141,21 @@ class RAGalacticPDF():
         self.chroma_collection, self.vector_store, self.storage_context = self._get_chromadb_setup()
         
     def _set_engine_feature(self, engine_mode=None, llm_knowledge_base=None, streaming=None):
+        # The app calls this on every rerun: the conversation (history, rolling summary) only restarts when the mode or the
+        # knowledge base flag actually changes
+        restart_conversation = bool(engine_mode and engine_mode != self.llm_mode) or \
+                               (llm_knowledge_base is not None and llm_knowledge_base != self.llm_knowledge_base)
         if engine_mode:
             self.llm_mode = engine_mode
         
-        if streaming:
+        # Booleans compared to None so that False is also recorded (both are part of the engine cache key)
+        if streaming is not None:
             self.streaming = streaming
+
+        if llm_knowledge_base is not None:
+            self.llm_knowledge_base = llm_knowledge_base
             
-        if llm_knowledge_base:
+        if self.llm_knowledge_base:
             self.context_prompt = PROMPT_WITH_KNOWLEDGE_BASE
             self.text_qa_template = PromptTemplate(text_qa_template_str)
             self.refine_template = PromptTemplate(refine_template_str)
@@ -117,30 +164,26 @@ class RAGalacticPDF():
             self.text_qa_template = PromptTemplate(text_qa_template_str_no_knowledge_base)
             self.refine_template = PromptTemplate(refine_template_str_no_knowledge_base)
         
-        if self.llm_mode == 'Conversation':
+        if self.llm_mode == 'Conversation' and restart_conversation:
             self.manage_chat_history(create_or_reset=True)
         
-    def _get_parser(self):
-        return LlamaParse(
-            api_key=os.environ.get('LLAMA_CLOUD_API_KEY'),
-            result_type="markdown",  # "markdown" and "text" are available
-            num_workers=4,  # if multiple files passed, split in `num_workers` API calls
-            verbose=True,
-            language="en",  # Optionally you can define a language, default=en
-            )
-        
-    def _get_chromadb_client(self):
-        # Create Chroma DB client and store
-        return chromadb.PersistentClient(path=self.db_folder_path)
-        
+    def _collection_name(self):
+        # per_user layout: the user's own collection, shared layout: every user's nodes in one collection (see collection_layout.py)
+        return SHARED_COLLECTION_NAME if COLLECTION_LAYOUT == 'shared' else self.user_id
+
     def _get_chromadb_setup(self):
         if not self.user_id:
             raise ValueError('User need to set self.user_id first (set_user_id(user_id) method) before to access/create the corresponding database setup.')
-        # Check if the collection already exists
-        collection_names = [getattr(collection_obj, 'name') for collection_obj in self.chroma_client.list_collections()]
+        # Collection handle cached per collection: reruns do not list every collection nor rebuild the vector store
+        return self.engine_cache.collections.get_or_create(self._collection_name(), self._build_chromadb_setup)
+
+    def _build_chromadb_setup(self):
         # Get preexisting collection or create one if does not exist yet
-        chroma_collection = self.chroma_client.get_collection(name=self.user_id) if self.user_id in collection_names else self.chroma_client.create_collection(name=self.user_id)
-        vector_store = ChromaVectorStore(chroma_collection=chroma_collection)
+        chroma_collection = get_or_create_collection(self.chroma_client, self._collection_name())
+        if self.resources.exact_search is not None:
+            vector_store = ExactSearchVectorStore(chroma_collection=chroma_collection, tier=self.resources.exact_search)
+        else:
+            vector_store = ChromaVectorStore(chroma_collection=chroma_collection)
         storage_context = StorageContext.from_defaults(vector_store=vector_store)
         return chroma_collection, vector_store, storage_context 
 
@@ -152,94 +195,283 @@ class RAGalacticPDF():
 
     def _temp_save_pdf(self, pdf_input, dir_path:str):
         # Save the uploaded PDF file temporarily
-        temp_pdf_path = os.path.join(dir_path, pdf_input.name)
+        temp_pdf_path = os.path.join(dir_path, os.path.basename(pdf_input.name))
         with open(temp_pdf_path, 'wb') as temp_pdf:
             temp_pdf.write(pdf_input.getvalue())
         return temp_pdf_path
 
-    def _delete_temp_pdf(self, temp_pdf_path:str):
-        # Delete the file after performing the action
-        if os.path.exists(temp_pdf_path):
-            os.remove(temp_pdf_path)
-
-    def _parse_pdf(self, dir_path:str):
-        return SimpleDirectoryReader(
-            dir_path,
-            required_exts=[".pdf"],
-            filename_as_id=True,
-            #file_metadata= lambda filepath: {'file_name': os.path.basename(filepath), 'tags': tags}, 
-            file_extractor={".pdf": self.parser}
-        ).load_data()
+    def _parse_pdf(self, file_path:str):
+        # Only the given file is read, never other PDFs (concurrent uploads, crash leftovers) 
+        with registry.span('parse_pdf', backend=self.parser_backend):
+            return SimpleDirectoryReader(
+                input_files=[file_path],
+                filename_as_id=True,
+                #file_metadata= lambda filepath: {'file_name': os.path.basename(filepath), 'tags': tags}, 
+                file_extractor={".pdf": self.parser}
+            ).load_data()
         
-    def _add_metadata_tags(self, docs, file_name:str, tags:List[Dict]=None):
-        if tags:
-            for document in docs:
-                document.metadata["file_name"] = file_name
-                for dict_tag in tags:
-                    # Single entry dict
-                    tag_name = next(iter(dict_tag.keys()))
-                    document.metadata[tag_name] = dict_tag[tag_name]
-        return docs
+    def _add_metadata_tags(self, nodes, file_name:str, tags:List[Dict]=None):
+        for node in nodes:
+            # Cached nodes may come from another user's upload (or another file name) so the file identity is always reset
+            node.metadata["file_name"] = file_name
+            node.metadata["file_path"] = os.path.join(self.data_folder_path, file_name)
+            # Partition key of the shared collection layout (also written in the per_user layout so that both can be migrated)
+            node.metadata["user_id"] = self.user_id
+            for excluded_keys in [node.excluded_embed_metadata_keys, node.excluded_llm_metadata_keys]:
+                if "user_id" not in excluded_keys:
+                    excluded_keys.append("user_id")
+            for dict_tag in tags or []:
+                # Single entry dict
+                tag_name = next(iter(dict_tag.keys()))
+                node.metadata[tag_name] = dict_tag[tag_name]
+                # Embeddings are computed before tagging (and shared through the ingestion cache), keep it consistent on re-embedding
+                if tag_name not in node.excluded_embed_metadata_keys:
+                    node.excluded_embed_metadata_keys.append(tag_name)
+        return nodes
 
-    def _create_nodes(self, docs):
-        pipeline = IngestionPipeline(
-            transformations=self.custom_transforms,
-        )
-        return pipeline.run(documents=docs)  
+    def _transforms_flavour(self):
+        # Nodes produced by each parser backend, embedding backend and by the default/custom transformations are cached separately
+        return f"{self.parser_backend}_{self.resources.embed_backend}_{'custom' if self.use_custom_transforms else 'default'}"
+
+    def _checkpoint_key(self, file_name:str, pdf_hash:str, flavour:str):
+        # Extractor checkpoints of an ingestion, per content and per user and file (whose jobs run one at a time):
+        # concurrent ingestions of the same PDF (e.g. by two users) never share, nor remove, each other's checkpoints
+        owner = hashlib.sha256(f'{self.user_id}/{file_name}'.encode('utf-8')).hexdigest()[:16]
+        return f'{pdf_hash}_{flavour}_{owner}'
+
+    def _transformation_stage(self, transformation):
+        if isinstance(transformation, BaseEmbedding):
+            return 'embed'
+        if isinstance(transformation, BaseExtractor):
+            return 'extract'
+        return 'chunk'
+
+    def _create_nodes(self, docs, progress=_no_progress, checkpoint_key:str=None, chunk_filter=None, embed:bool=True):
+        # chunk_filter(chunks) -> chunks: applied once the documents are chunked, before extraction and embedding.
+        # embed=False: nodes returned before the embedding stage (embedded by the caller, e.g. over several files in bulk_ingest.py)
+        for document in docs:
+            # Per-upload file identity is kept out of the embedded text so that cached embeddings are reusable across users
+            for key in ['file_name', 'file_path']:
+                if key not in document.excluded_embed_metadata_keys:
+                    document.excluded_embed_metadata_keys.append(key)
+        transformations = self.custom_transforms if self.use_custom_transforms else [*Settings.transformations, self.embed_model]
+        if not embed:
+            transformations = [transformation for transformation in transformations if self._transformation_stage(transformation) != 'embed']
+        # Transformations are run one at a time (same result as an IngestionPipeline without cache) to report each stage
+        nodes = docs
+        extractors = []
+        for transformation in transformations:
+            stage = self._transformation_stage(transformation)
+            if stage != 'chunk' and chunk_filter is not None:
+                nodes, chunk_filter = chunk_filter(nodes), None
+            if stage == 'extract':
+                # Consecutive extractors are run together, concurrently and with checkpoints, by the extractor executor
+                extractors.append(transformation)
+                continue
+            if extractors:
+                nodes = self.extractor_executor.run(nodes, extractors, checkpoint_key=checkpoint_key, progress=progress)
+                extractors = []
+            if stage == 'embed':
+                for start in range(0, len(nodes), INGESTION_PROGRESS_BATCH_SIZE):
+                    progress(stage, start, len(nodes))
+                    transformation(nodes[start:start + INGESTION_PROGRESS_BATCH_SIZE])
+                progress(stage, len(nodes), len(nodes))
+            else:
+                progress(stage, 0, 1)
+                nodes = run_transformations(nodes, [transformation])
+        if chunk_filter is not None:
+            nodes = chunk_filter(nodes)
+        if extractors:
+            nodes = self.extractor_executor.run(nodes, extractors, checkpoint_key=checkpoint_key, progress=progress)
+        return nodes
         
-    def _create_index(self, docs):
-        if not self.use_custom_transforms:
-            return VectorStoreIndex.from_documents(docs, storage_context=self.storage_context)
-        else:
-            return VectorStoreIndex(nodes=self._create_nodes(docs), storage_context=self.storage_context)
+    def _create_index(self, nodes, progress=_no_progress):
+        # Nodes already carry their embeddings so they are directly written in the vector store
+        with registry.span('create_index'):
+            index = VectorStoreIndex(nodes=[], storage_context=self.storage_context)
+            for start in range(0, len(nodes), INGESTION_PROGRESS_BATCH_SIZE):
+                progress('store', start, len(nodes))
+                index.insert_nodes(nodes[start:start + INGESTION_PROGRESS_BATCH_SIZE])
+            progress('store', len(nodes), len(nodes))
+        return index
         
-    def _add_new_json_data(self, file_name:str, tags:List[Dict]=None):
-        # Load existing user ids from json file, or create a new dictionary if the file does not exist
-        if os.path.exists(self.json_ids_path):
-            with open(self.json_ids_path, 'r') as f:
-                json_data = json.load(f)
-        else:
-            json_data = {}
-
-        # Create ID entry if doesnt exists
-        if not json_data.get(self.user_id):
-            json_data[self.user_id] = {'files': [file_name], 'tags': [tags]}
-        # Add file to ID's files if file not in ID's files already
-        elif file_name not in json_data[self.user_id]['files']:
-            json_data[self.user_id]['files'].append(file_name)
-            json_data[self.user_id]['tags'].append(tags)
-        # Write the updated data back to the JSON file
-        with open(self.json_ids_path, 'w') as f:
-            json.dump(json_data, f, indent=4)
+    def _add_to_catalog(self, file_name:str, tags:List[Dict]=None, content_hash:str=None):
+        # Add input pdf name (and its tags) to corresponding user ID
+        self.catalog.add_file(self.user_id, file_name, tags=tags, content_hash=content_hash)
              
-    def _check_already_loaded(self, pdf_input:str):
-        if os.path.exists(self.json_ids_path):
-            with open(self.json_ids_path, 'r') as f:
-                json_data = json.load(f)
-            
-            if json_data.get(self.user_id, None):
-                return True if pdf_input.name in json_data[self.user_id]['files'] else False
-            else:
-                return False
+    def _check_already_loaded(self, pdf_input):
+        return self.catalog.has_file(self.user_id, pdf_input.name)
+        
+    def _get_documents(self, pdf_input, pdf_hash:str, progress=_no_progress):
+        # Reuse parsed documents of identical PDF bytes (skip the parser API call)
+        docs = self.ingestion_cache.get_documents(pdf_hash, parser_backend=self.parser_backend)
+        if docs is None:
+            progress('parse', 0, 1)
+            # Per-job scratch directory: concurrent uploads never share files and it is always removed (even on error)
+            with tempfile.TemporaryDirectory(prefix='ragalactic_') as scratch_dir:
+                # Temp save the pdf
+                temp_path = self._temp_save_pdf(pdf_input, dir_path=scratch_dir)
+                # Parse the single temp saved pdf
+                docs = self._parse_pdf(file_path=temp_path)
+            # Parser errors are swallowed (SimpleDirectoryReader, LlamaParse ignore_errors): the ingestion fails instead of
+            # caching and cataloguing an empty file
+            if not any((doc.text or '').strip() for doc in docs):
+                raise ValueError(f'No text could be extracted from {pdf_input.name} (unreadable or empty PDF)')
+            self.ingestion_cache.put_documents(pdf_hash, docs, parser_backend=self.parser_backend)
+        return docs
+
+    def _get_nodes(self, pdf_input, pdf_hash:str, progress=_no_progress):
+        flavour = self._transforms_flavour()
+        # Cache hit: no parsing nor embedding, only the vector store write remains
+        nodes = self.ingestion_cache.get_nodes(pdf_hash, flavour=flavour)
+        if nodes is None:
+            # Extractor results are checkpointed per pdf, flavour and file: an interrupted ingestion resumes where it stopped
+            docs = self._get_documents(pdf_input, pdf_hash, progress)
+            with registry.span('create_nodes', flavour=flavour):
+                nodes = self._create_nodes(docs, progress, checkpoint_key=self._checkpoint_key(pdf_input.name, pdf_hash, flavour))
+            if not nodes:
+                raise ValueError(f'No chunks were produced from {pdf_input.name}')
+            self.ingestion_cache.put_nodes(pdf_hash, nodes, flavour=flavour)
+        return nodes
+
+    def _ingest_pdf(self, pdf_input, pdf_hash:str, tags:List[Dict]=None, progress=_no_progress):
+        # Whole ingestion of load_new_pdf / submit_new_pdf (parsing, chunking, embedding, storage)
+        started_at = time.perf_counter()
+        with registry.span('load_new_pdf'):
+            # Parse and embed pdf (or get them from the ingestion cache)
+            nodes = self._get_nodes(pdf_input, pdf_hash, progress)
+            # Add metadata
+            nodes = self._add_metadata_tags(nodes, file_name=pdf_input.name, tags=tags)
+            # Create vector indexing and save it in database
+            index = self._create_index(nodes, progress)
+        registry.observe('ragalactic_ingested_chunks', len(nodes), buckets=COUNT_BUCKETS)
+        registry.event('ingestion', sample_rate=1.0, user_id=self.user_id, file_name=pdf_input.name, chunks=len(nodes),
+                       duration_s=round(time.perf_counter() - started_at, 3))
+        # Add input pdf name to corresponding user ID in the catalog
+        self._add_to_catalog(file_name=pdf_input.name, tags=tags, content_hash=pdf_hash)
+        self._invalidate_file_set()
+        self.engine_cache.indexes.set((self.user_id,), index)
+
+    def _invalidate_file_set(self):
+        # The user's file set changed: cached indexes, engines and answers are stale
+        self.engine_cache.invalidate_user(self.user_id)
+        self.answer_cache.invalidate_user(self.user_id)
         
     def load_new_pdf(self, pdf_input, tags:List[Dict]=None):
+        # Synchronous ingestion (the app goes through submit_new_pdf)
         # If already loaded previously, then use pre-loaded
         if self._check_already_loaded(pdf_input):
             return self.load_existing_pdf([pdf_input.name])
-        # Temp save the pdf
-        temp_path = self._temp_save_pdf(pdf_input, dir_path=self.data_folder_path)
-        # Parse pdf (temp saved in dir self.data_folder_path)
-        docs = self._parse_pdf(dir_path=self.data_folder_path)
-        # Add metadata
-        docs = self._add_metadata_tags(docs, file_name=pdf_input.name, tags=tags)
-        # Create vector indexing and save it in database
-        index = self._create_index(docs)
-        # Delete temp pdf
-        self._delete_temp_pdf(temp_path)
-        # Add input pdf name to corresponding user ID in 
-        self._add_new_json_data(file_name=pdf_input.name, tags=tags)
+        self._ingest_pdf(pdf_input, self.ingestion_cache.hash_pdf(pdf_input.getvalue()), tags=tags)
         # Create engine
-        return self._create_corresponding_engine(index)
+        return self._get_engine()
+
+    def submit_new_pdf(self, pdf_input, tags:List[Dict]=None, retry:bool=False, replace:bool=False):
+        # Queue the ingestion of the pdf in the background job manager and return immediately.
+        # Returns None if the pdf is already loaded (unless replace: new version of the file, see replace_pdf),
+        # otherwise the job status (see jobs.IngestionJob.snapshot).
+        already_loaded = self._check_already_loaded(pdf_input)
+        if already_loaded and not replace:
+            return None
+        uploaded_pdf = _UploadedPDF(pdf_input.name, pdf_input.getvalue())
+        pdf_hash = self.ingestion_cache.hash_pdf(uploaded_pdf.getvalue())
+        # The job works on a copy of the handle: settings changed by later reruns of the session do not affect it
+        handle = copy.copy(self)
+
+        def work(progress):
+            # Checked when the job runs: jobs of a file run one after the other, an earlier one may have loaded it meanwhile
+            if not handle._check_already_loaded(uploaded_pdf):
+                handle._ingest_pdf(uploaded_pdf, pdf_hash, tags=tags, progress=progress)
+            elif replace:
+                handle._replace_pdf(uploaded_pdf, pdf_hash, progress=progress)
+        return self.job_manager.submit(self.user_id, uploaded_pdf.name, pdf_hash, work, retry=retry)
+
+    def get_ingestion_job(self, job_id:str):
+        return self.job_manager.get_job(job_id)
+
+    def get_ingestion_jobs(self, active_only:bool=False):
+        return self.job_manager.get_user_jobs(self.user_id, active_only=active_only)
+
+        
+        
+    ###                        ###
+    ### DELETE / REPLACE PDFS  ###
+    ###                        ###
+
+    def _file_where(self, file_name:str):
+        # Chroma where clause selecting the nodes of one of the user's files
+        if COLLECTION_LAYOUT == 'shared':
+            return {'$and': [{'user_id': self.user_id}, {'file_name': file_name}]}
+        return {'file_name': file_name}
+
+    def delete_pdf(self, file_name:str):
+        # Remove the file's nodes from the vector store and the file (and its tags) from the catalog.
+        # Returns False if the user has no such file.
+        if not self.catalog.has_file(self.user_id, file_name):
+            return False
+        with registry.span('delete_pdf'):
+            self.chroma_collection.delete(where=self._file_where(file_name))
+            self.catalog.remove_file(self.user_id, file_name)
+        self.job_manager.forget_file(self.user_id, file_name)
+        registry.event('deletion', sample_rate=1.0, user_id=self.user_id, file_name=file_name)
+        self._invalidate_file_set()
+        return True
+
+    def replace_pdf(self, pdf_input):
+        # Synchronous replacement of a loaded file by a new version with the same name (tags kept), see _replace_pdf.
+        # The app and the API go through submit_new_pdf(replace=True).
+        if not self._check_already_loaded(pdf_input):
+            return self.load_new_pdf(pdf_input)
+        self._replace_pdf(pdf_input, self.ingestion_cache.hash_pdf(pdf_input.getvalue()))
+        return self.load_existing_pdf([pdf_input.name])
+
+    def _replace_pdf(self, pdf_input, pdf_hash:str, progress=_no_progress):
+        # Chunk-level diff against the stored version: chunks whose text did not change keep their stored node (no extraction,
+        # embedding nor write), chunks gone from the new version are deleted, only new or modified chunks are extracted and embedded.
+        # The new version itself is parsed (or read from the ingestion cache) as a whole.
+        file_name = pdf_input.name
+        if self.catalog.get_content_hash(self.user_id, file_name) == pdf_hash:
+            return
+        started_at = time.perf_counter()
+        with registry.span('replace_pdf'):
+            stored = self.chroma_collection.get(where=self._file_where(file_name), include=['documents'])
+            # Stored node ids per chunk hash (a text may appear several times in a file)
+            stored_ids = defaultdict(list)
+            for node_id, text in zip(stored['ids'], stored['documents']):
+                stored_ids[_chunk_hash(text or '')].append(node_id)
+            kept_ids = []
+
+            def changed_chunks(chunks):
+                changed = []
+                for chunk in chunks:
+                    matching_ids = stored_ids.get(_chunk_hash(chunk.get_content()))
+                    if matching_ids:
+                        kept_ids.append(matching_ids.pop())
+                    else:
+                        changed.append(chunk)
+                return changed
+
+            flavour = self._transforms_flavour()
+            cached_nodes = self.ingestion_cache.get_nodes(pdf_hash, flavour=flavour)
+            if cached_nodes is not None:
+                # Identical bytes already ingested (embedded nodes cached): only the vector store writes are saved
+                nodes = changed_chunks(cached_nodes)
+            else:
+                docs = self._get_documents(pdf_input, pdf_hash, progress)
+                with registry.span('create_nodes', flavour=flavour):
+                    nodes = self._create_nodes(docs, progress, checkpoint_key=self._checkpoint_key(file_name, pdf_hash, f'{flavour}_changed'),
+                                               chunk_filter=changed_chunks)
+            nodes = self._add_metadata_tags(nodes, file_name=file_name, tags=self.catalog.get_file_tags(self.user_id, file_name))
+            # New chunks are written before the stale ones are removed: the file never disappears from retrieval
+            self._create_index(nodes, progress)
+            stale_ids = [node_id for matching_ids in stored_ids.values() for node_id in matching_ids]
+            if stale_ids:
+                self.chroma_collection.delete(ids=stale_ids)
+        registry.event('replacement', sample_rate=1.0, user_id=self.user_id, file_name=file_name, kept_chunks=len(kept_ids),
+                       new_chunks=len(nodes), removed_chunks=len(stale_ids), duration_s=round(time.perf_counter() - started_at, 3))
+        self.catalog.update_file(self.user_id, file_name, content_hash=pdf_hash)
+        self.job_manager.forget_file(self.user_id, file_name, keep_hash=pdf_hash)
+        self._invalidate_file_set()
 
         
         
@@ -247,61 +479,39 @@ class RAGalacticPDF():
     ### PREVIOUSLY LOADED PDFS ###
     ###                        ###
     
-    def get_user_pdfs(self, tagged_with_all:List[str]=None, tagged_with_at_least_one:List[str]=None):
-        if os.path.exists(self.json_ids_path):
-            with open(self.json_ids_path, 'r') as f:
-                json_data = json.load(f)
-                
-                if not json_data.get(self.user_id):
-                    return None
-                
-                # If there is no tag passed to the method, return all file names
-                if not tagged_with_all and not tagged_with_at_least_one:
-                    return sorted(json_data[self.user_id]['files'])
-                
-                if json_data.get(self.user_id):
-                    files = json_data[self.user_id]['files']
-                    tags = json_data[self.user_id]['tags']
-                    # if tagged_with_all: Get all file names where every tag {tag_name:tag} in 'tagged_with_all' is present in the corresponding 'file_tags'.
-                    # if tagged_with_at_least_one: Get all file names where at least one tag {tag_name:tag} in 'tagged_with_at_least_one' is present in the corresponding 'file_tags'
-                    # - The 'zip(files, tags)' pairs each file with its associated tags.
-                    # - The 'all(tag_dict in file_tags for tag_dict in tagged_with_all)' checks if all tag dicts in 'tagged_with_all' are in the current 'file_tags' tag dict list.
-                    # - The 'any(tag_dict in file_tags for tag_dict in tagged_with_all)' checks if at least tag dict in 'tagged_with_at_least_one' are in the current 'file_tags' tag dict list.
-                    return sorted([
-                        file for file, file_tags in zip(files, tags) if all(tag_dict in file_tags for tag_dict in tagged_with_all)
-                        ]) if tagged_with_all else sorted([
-                            file for file, file_tags in zip(files, tags) if any(tag_dict in file_tags for tag_dict in tagged_with_at_least_one)
-                            ]) if tagged_with_at_least_one else None
-                         
-    # Method to extract sorting metrics (key, value) from each single entry dictionary. 
-    # To be used for sorting according to key first and then value
-    def _sort_key(self, dictionnary):
-        key, value = next(iter(dictionnary.items()))
-        return (key, value)
+    def get_user_pdfs(self, tagged_with_all:List[Dict]=None, tagged_with_at_least_one:List[Dict]=None):
+        # if tagged_with_all: Get all file names where every tag {tag_name:tag} in 'tagged_with_all' is attached to the file.
+        # if tagged_with_at_least_one: Get all file names where at least one tag {tag_name:tag} in 'tagged_with_at_least_one' is attached to the file.
+        # Otherwise return all file names (None if the user did not load any pdf yet)
+        return self.catalog.get_files(self.user_id, tagged_with_all=tagged_with_all, tagged_with_at_least_one=tagged_with_at_least_one)
 
     def get_users_tags(self):
-        if os.path.exists(self.json_ids_path):
-            with open(self.json_ids_path, 'r') as f:
-                json_data = json.load(f)
-                # Extract and flatten single-entry dictionaries from the nested lists in json_data[self.user_id]['tags'] list,
-                # convert each dictionary to a tuple to ensure uniqueness with a set,
-                # and then convert the unique tuples back to single-entry dictionaries.
-                all_unique_tags = [
-                    {tag_name: tag} for tag_name, tag in set(tuple(single_entry_dict.items())[0] for tag_dict_list in json_data[self.user_id]['tags'] for single_entry_dict in tag_dict_list)
-                    ] if (json_data[self.user_id].get('tags') and json_data[self.user_id]['tags']) else None
-                # Return list of single entry dict (list sorted by dict key first and then by dict value) or None
-                return sorted(all_unique_tags, key=self._sort_key) if all_unique_tags else None
+        # Return list of single entry dict (list sorted by dict key first and then by dict value) or None
+        return self.catalog.get_tags(self.user_id)
         
     def _get_index(self, vector_store):
         return VectorStoreIndex.from_vector_store(vector_store)
 
-    def load_existing_pdf(self, pdf_names):
-        ## Load existing index from database
-        index = self._get_index(self.vector_store)
+    def _get_filters(self, pdf_names=None):
+        if pdf_names is None:
+            return None
         filter_list = [MetadataFilter(key="file_name", value=pdf_name) for pdf_name in pdf_names]
-        filters = MetadataFilters(filters=filter_list, condition=FilterCondition.OR)
-        # Create query engine
-        return self._create_corresponding_engine(index, filters=filters)
+        return MetadataFilters(filters=filter_list, condition=FilterCondition.OR)
+
+    def _get_retriever_filters(self, pdf_names=None):
+        # Retriever arguments restricting the search to the selected files of the user
+        if COLLECTION_LAYOUT != 'shared':
+            return {'filters': self._get_filters(pdf_names)}
+        # Shared collection: always restricted to the user's nodes. Given as a chroma where clause since the llama_index
+        # chroma filters support neither nested conditions nor $in
+        where = {'user_id': self.user_id}
+        if pdf_names is not None:
+            where = {'$and': [where, {'file_name': {'$in': list(pdf_names)}}]}
+        return {'vector_store_kwargs': {'where': where}}
+
+    def load_existing_pdf(self, pdf_names):
+        # Load existing index from database and create query engine (both cached across reruns)
+        return self._get_engine(pdf_names)
 
 
 
@@ -309,41 +519,134 @@ class RAGalacticPDF():
     ### GET CHATBOT ENGINE ###
     ###                    ###
     
-    def _create_corresponding_engine(self, index, filters=None):
+    def _get_engine(self, pdf_names=None):
+        self.active_pdf_names = pdf_names
+        key = self.engine_cache.engine_key(self.user_id, pdf_names, llm_mode=self.llm_mode, llm_knowledge_base=self.llm_knowledge_base,
+                                           streaming=self.streaming, top_k=self.similarity_top_k)
+        engine = self.engine_cache.engines.get(key)
+        if engine is None:
+            index = self.engine_cache.indexes.get_or_create((self.user_id,), lambda: self._get_index(self.vector_store))
+            engine = self._create_corresponding_engine(index, self._get_retriever_filters(pdf_names))
+            self.engine_cache.engines.set(key, engine)
         if self.llm_mode == 'Conversation':
-            return self._create_chat_engine(index, filters)
+            # Per-session view of the cached engine: concurrent sessions of a user share its retriever and LLM, never its memory
+            engine = copy.copy(engine)
+            self._sync_chat_memory(engine)
+        return engine
+
+    def _get_chat_memory(self):
+        # Owned by the session so that the rolling summary survives reruns and engine cache hits
+        if self.chat_memory is None:
+            self.chat_memory = new_chat_memory(CHAT_MEMORY_MODE, llm=self.llm, executor=self.resources.memory_executor,
+                                               recent_turns=CHAT_MEMORY_RECENT_TURNS, token_limit=10000, chat_history=self.chat_history)
+        return self.chat_memory
+
+    def _sync_chat_memory(self, chat_engine):
+        memory = self._get_chat_memory()
+        if CHAT_MEMORY_MODE == 'buffer':
+            # A cached chat engine may have been used by another rerun: its memory is reset to this session's history
+            memory.set(list(self.chat_history))
+        chat_engine._memory = memory
+
+    def _create_corresponding_engine(self, index, retriever_filters:Dict):
+        if self.llm_mode == 'Conversation':
+            return self._create_chat_engine(index, retriever_filters)
         else:
-            return self._create_query_engine(index, filters)
+            return self._create_query_engine(index, retriever_filters)
+
+    def _retrieval_top_k(self):
+        # Over-retrieve when the context assembly picks the chunks actually sent
+        return self.similarity_top_k * CONTEXT_CANDIDATES_FACTOR if CONTEXT_ASSEMBLY else self.similarity_top_k
 
-    def _create_chat_engine(self, index, filters):    
+    def _get_node_postprocessors(self):
+        if not CONTEXT_ASSEMBLY:
+            return []
+        return [TokenBudgetPostprocessor(embedding_lookup=_chroma_embedding_lookup(self.chroma_collection),
+                                         reranker=self.resources.reranker,
+                                         token_budget=CONTEXT_TOKEN_BUDGET,
+                                         baseline_top_k=self.similarity_top_k,
+                                         dedup_threshold=CONTEXT_DEDUP_THRESHOLD)]
+
+    def _create_chat_engine(self, index, retriever_filters:Dict):    
+        if self.chat_mode == 'condense_plus_context':
+            # Same engine as index.as_chat_engine(chat_mode='condense_plus_context'), with condense calls in their own scheduler priority class
+            # and the condense strategy / model of the shared condenser
+            return PrioritizedCondensePlusContextChatEngine.from_defaults(
+                retriever=index.as_retriever(similarity_top_k=self._retrieval_top_k(), **retriever_filters),
+                llm=self.llm,
+                memory=self._get_chat_memory(),
+                context_prompt=self.context_prompt,
+                node_postprocessors=self._get_node_postprocessors(),
+                condenser=self.resources.condenser,
+                verbose=False,
+            )
         return index.as_chat_engine(chat_mode=self.chat_mode, 
                                     streaming=self.streaming,
-                                    memory= ChatMemoryBuffer.from_defaults(
-                                                 token_limit=10000,
-                                                 chat_history=self.chat_history,
-                                             ),
+                                    memory=self._get_chat_memory(),
                                     context_prompt=self.context_prompt,
+                                    node_postprocessors=self._get_node_postprocessors(),
                                     # Retriever params
-                                    similarity_top_k=self.similarity_top_k,
-                                    filters=filters,
+                                    similarity_top_k=self._retrieval_top_k(),
+                                    **retriever_filters,
                                     verbose=False,                            
                                     )
 
-    def _create_query_engine(self, index, filters):
-        return index.as_query_engine(similarity_top_k=self.similarity_top_k, 
+    def _create_query_engine(self, index, retriever_filters:Dict):
+        return index.as_query_engine(similarity_top_k=self._retrieval_top_k(), 
+                                     node_postprocessors=self._get_node_postprocessors(),
                                      text_qa_template=self.text_qa_template, refine_template=self.refine_template,
                                      streaming=self.streaming, 
-                                     filters=filters
+                                     **retriever_filters
                                      )
     
+    def _run_cached(self, run, query_text:str):
+        # Repeated questions over unchanged files are answered from the answer cache (no retrieval nor generation),
+        # replayed as a stream when streaming is on
+        fingerprint = self.catalog.get_files_fingerprint(self.user_id, self.active_pdf_names)
+        key = self.answer_cache.key(self.user_id, self.active_pdf_names, self.llm_mode, self.llm_knowledge_base, query_text, fingerprint)
+        cached_response = self.answer_cache.get(key)
+        if cached_response is not None:
+            return cached_response
+        return self.answer_cache.record(key, run(query_text))
+
+    def _instrument(self, response, started_at:float, mode:str):
+        # Time to first token, tokens/s and streamed chunks, measured from the start of run_query / run_chat
+        return registry.instrument_response(response, started_at, streamed=self.streaming, mode=mode,
+                                            cached=isinstance(response, CachedResponse))
+
     def run_query(self, query_engine, query_text:str):
-        return query_engine.query(query_text)
+        started_at = time.perf_counter()
+        with registry.span('run_query'):
+            response = self._run_cached(query_engine.query, query_text)
+        return self._instrument(response, started_at, 'query')
  
     def run_chat(self, chat_engine, prompt:str):
-        return chat_engine.stream_chat(prompt) if self.streaming else chat_engine.chat(prompt)
+        started_at = time.perf_counter()
+        with registry.span('run_chat', chat_mode=self.chat_mode):
+            response = self._run_chat(chat_engine, prompt)
+        return self._instrument(response, started_at, 'chat')
+
+    def _run_chat(self, chat_engine, prompt:str):
+        run = chat_engine.stream_chat if self.streaming else chat_engine.chat
+        # Chat answers depend on the conversation: only the first question (no previous history) is cached
+        previous_history = self.chat_history[:-1] if self.chat_history and self.chat_history[-1].content == prompt else self.chat_history
+        if previous_history:
+            return run(prompt)
+        response = self._run_cached(run, prompt)
+        if isinstance(response, CachedResponse) and CHAT_MEMORY_MODE != 'buffer':
+            # The engine was bypassed: record the turn in the session memory ourselves
+            self._get_chat_memory().put(ChatMessage(role='user', content=prompt))
+            self._get_chat_memory().put(ChatMessage(role='assistant', content=response.response))
+        return response
+
+    def export_metrics(self):
+        # Process-wide metrics (every session) in the Prometheus text format
+        return registry.export_prometheus()
 
     def manage_chat_history(self, create_or_reset:bool=False, to_append:Tuple=()):
         if create_or_reset:
             self.chat_history = []
+            if self.chat_memory is not None:
+                self.chat_memory.reset()
         if to_append and isinstance(to_append, Tuple):
             self.chat_history.append(ChatMessage(role=to_append[0], content=to_append[1])) 
\ No newline at end of file
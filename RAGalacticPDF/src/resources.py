@@ -0,0 +1,212 @@
+# Import modules
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+from llama_index.core import Settings
+from llama_index.core.callbacks import CallbackManager
+
+from config import (CHROMA_DB_DIR, COLLECTION_LAYOUT, EXACT_SEARCH_DIR, EXACT_SEARCH_MAX_VECTORS, EXACT_SEARCH_MEMORY_MB, EXACT_SEARCH_USER_MEMORY_MB,
+                    INGESTION_CACHE_DIR, INGESTION_CACHE_MAX_MB,
+                    PARSER_BACKEND, LOCAL_PARSER_WORKERS, LOCAL_PARSER_PAGES_PER_TASK,
+                    CATALOG_PATH, LEGACY_JSON_CATALOG_PATH,
+                    ENGINE_CACHE_MAX_ENTRIES, ENGINE_CACHE_TTL_S,
+                    EMBED_MAX_BATCH_SIZE, EMBED_MAX_WAIT_MS,
+                    EMBED_BACKEND, EMBED_MODEL_NAME, EMBED_MODELS_CACHE_DIR,
+                    QUERY_EMBED_CACHE_MAX_ENTRIES, ANSWER_CACHE_MAX_ENTRIES, ANSWER_CACHE_TTL_S,
+                    INGESTION_MAX_CONCURRENT_JOBS, INGESTION_JOB_RETENTION_S,
+                    EXTRACTOR_LLM_CONCURRENCY, EXTRACTOR_CHECKPOINT_DIR,
+                    LLM_MAX_CONCURRENCY, LLM_MAX_CONNECTIONS,
+                    RERANKER_MODEL,
+                    CONDENSE_STRATEGY, CONDENSE_MODEL, CONDENSE_CACHE_MAX_ENTRIES,
+                    TELEMETRY_METRICS_PORT)
+from catalog import PDFCatalog
+from collection_layout import new_chroma_client, check_layout
+from engine_cache import EngineCache
+from exact_search import ExactSearchTier
+from embedding_service import BatchingEmbeddingService, ServiceEmbedding
+from embedding_backends import get_embedding_model
+from ingestion_cache import IngestionCache
+from query_cache import QueryEmbeddingCache, AnswerCache
+from jobs import IngestionJobManager
+from extractor_executor import ExtractorExecutor
+from llm_scheduler import LLMScheduler, ScheduledLLM, PooledOllama
+from condense import QuestionCondenser
+from parsers import get_parser
+from telemetry import registry, TelemetryCallbackHandler, start_metrics_server
+from startup_profile import profiler
+
+import logging
+
+
+class SharedResources():
+    # Heavy resources (models weights, clients, parser) built once per process and shared by every session.
+    # Sessions only hold a lightweight RAGalacticPDF handle referencing these objects.
+    # Components needing heavy imports or model weights (device, parser, custom transforms, reranker) are built on first use,
+    # and the embedding model is loaded in the background by the embedding service, so that the app is ready without them.
+    def __init__(self):
+        self.project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+        self.db_folder_path = CHROMA_DB_DIR
+        os.makedirs(self.db_folder_path, exist_ok=True)
+
+        # Lazily built components (reentrant lock: building one may need another, e.g. the device)
+        self._lazy_components = {}
+        self._lazy_lock = threading.RLock()
+
+        # Every LLM call (all sessions, ingestion extractors) goes through the scheduler
+        self.llm_scheduler = LLMScheduler(max_concurrency=LLM_MAX_CONCURRENCY)
+        self.llm = ScheduledLLM(self._get_llm(), self.llm_scheduler)
+        # Condense step of the condense_plus_context chat engines, optionally on a smaller model
+        condense_llm = ScheduledLLM(self._get_llm(CONDENSE_MODEL), self.llm_scheduler) if CONDENSE_MODEL else self.llm
+        self.condenser = QuestionCondenser(condense_llm, strategy=CONDENSE_STRATEGY, cache_size=CONDENSE_CACHE_MAX_ENTRIES)
+        self.embed_backend = EMBED_BACKEND
+        # Every embedding call (queries and documents, all sessions) goes through the micro-batching service
+        self.embedding_service = BatchingEmbeddingService(lambda: profiler.timed('embedding model', self._get_embed_model),
+                                                          max_batch_size=EMBED_MAX_BATCH_SIZE, max_wait_ms=EMBED_MAX_WAIT_MS)
+        self.query_embedding_cache = QueryEmbeddingCache(max_size=QUERY_EMBED_CACHE_MAX_ENTRIES)
+        self.embed_model = ServiceEmbedding(self.embedding_service, query_cache=self.query_embedding_cache, model_name=EMBED_MODEL_NAME)
+        self._init_llm_and_embedd_models()
+
+        # Parsers built on demand, one per backend
+        self._parsers = {}
+        self._parsers_lock = threading.Lock()
+        self.parser_backend = PARSER_BACKEND
+        # chromadb.PersistentClient is thread-safe and caches its system per path
+        self.chroma_client = new_chroma_client(self.db_folder_path)
+        # Parsed documents and embedded nodes keyed by PDF content hash, reused across users and file names
+        self.ingestion_cache = IngestionCache(INGESTION_CACHE_DIR, max_mb=INGESTION_CACHE_MAX_MB)
+        # Users' files and tags catalog (one-shot import of the former json_ids.json)
+        self.catalog = PDFCatalog(CATALOG_PATH)
+        self.catalog.migrate_from_json(LEGACY_JSON_CATALOG_PATH)
+        check_layout(self.catalog, COLLECTION_LAYOUT)
+        # Brute force search of small users over memory-mapped copies of their vectors (chroma HNSW index for the others)
+        self.exact_search = None
+        if EXACT_SEARCH_MAX_VECTORS:
+            self.exact_search = ExactSearchTier(EXACT_SEARCH_DIR, self.catalog, max_vectors=EXACT_SEARCH_MAX_VECTORS, memory_mb=EXACT_SEARCH_MEMORY_MB,
+                                                user_memory_mb=EXACT_SEARCH_USER_MEMORY_MB)
+        # Collection handles, indexes and engines shared across reruns and sessions
+        self.engine_cache = EngineCache(max_engines=ENGINE_CACHE_MAX_ENTRIES, ttl_s=ENGINE_CACHE_TTL_S)
+        # Answers of repeated questions over the same files
+        self.answer_cache = AnswerCache(max_size=ANSWER_CACHE_MAX_ENTRIES, ttl_s=ANSWER_CACHE_TTL_S)
+        # Bounded pool running the uploads' ingestion in the background
+        self.job_manager = IngestionJobManager(max_concurrent_jobs=INGESTION_MAX_CONCURRENT_JOBS, retention_s=INGESTION_JOB_RETENTION_S)
+        # Custom transforms' extractors, concurrent under a global LLM concurrency limit and resumable
+        self.extractor_executor = ExtractorExecutor(EXTRACTOR_CHECKPOINT_DIR, llm_concurrency=EXTRACTOR_LLM_CONCURRENCY)
+        # Background folding of old conversation turns (rolling summary chat memory)
+        self.memory_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='memory-summarizer')
+
+        self._register_metrics_collectors()
+
+    def _lazy(self, name:str, build:Callable):
+        with self._lazy_lock:
+            if name not in self._lazy_components:
+                self._lazy_components[name] = profiler.timed(name, build)
+            return self._lazy_components[name]
+
+    @property
+    def device(self):
+        return self._lazy('device', self._get_device)
+
+    @property
+    def base_embed_model(self):
+        # Model behind the embedding service (waits for it to be loaded)
+        return self.embedding_service.embed_model
+
+    @property
+    def parser(self):
+        return self.get_parser(self.parser_backend)
+
+    @property
+    def custom_transforms(self):
+        # Only needed by the ingestions run with use_custom_transforms (loads the entity extraction model)
+        return self._lazy('custom transforms', self._get_custom_transforms)
+
+    @property
+    def reranker(self):
+        # Optional cross-encoder used by the context assembly (hybrid vector + BM25 scorer otherwise)
+        return self._lazy('reranker', self._get_reranker)
+
+    def _get_device(self):
+        import torch
+        return 'cuda' if torch.cuda.is_available() else 'cpu'
+
+    def _get_llm(self, model:str="llama3"):
+        logging.debug(f'CHECK OLLAMA')
+        if "OLLAMA_BASE_URL" in os.environ:
+            # Currently running in Docker so need to provide the URL to access to ollama (also running in a container)
+            logging.debug(f"RUNNING IN DOCKER {os.environ.get('OLLAMA_BASE_URL')}")
+            return PooledOllama(model=model, request_timeout=300.0, base_url=os.environ.get('OLLAMA_BASE_URL'), max_connections=LLM_MAX_CONNECTIONS)
+        logging.debug(f'NOT RUNNING IN DOCKER')
+        return PooledOllama(model=model, request_timeout=300.0, max_connections=LLM_MAX_CONNECTIONS)
+
+    def _get_custom_transforms(self):
+        from llama_index.core.extractors import TitleExtractor, QuestionsAnsweredExtractor, SummaryExtractor, KeywordExtractor
+        from llama_index.extractors.entity import EntityExtractor
+        from llama_index.core.node_parser import SentenceSplitter
+        return [
+                SentenceSplitter(separator=" ", chunk_size=1024, chunk_overlap=128),
+                SummaryExtractor(summaries=["prev", "self", "next"]), # automatically extracts a summary over a set of Nodes
+                QuestionsAnsweredExtractor(questions=3), # extracts a set of questions that each Node can answer
+                TitleExtractor(nodes=5), # extracts a title over the context of each Node
+                EntityExtractor(device=self.device), # - extracts entities (i.e. names of places, people, things) mentioned in the content of each Node
+                KeywordExtractor(),
+                self.embed_model,
+            ]
+
+    def _get_embed_model(self):
+        return get_embedding_model(self.embed_backend, EMBED_MODEL_NAME, device=self.device, cache_dir=EMBED_MODELS_CACHE_DIR)
+
+    def _get_reranker(self):
+        if not RERANKER_MODEL:
+            return None
+        from llama_index.core.postprocessor import SentenceTransformerRerank
+        # Only reorders the candidates, the token budget decides how many are kept
+        return SentenceTransformerRerank(model=RERANKER_MODEL, top_n=1000, device=self.device)
+
+    def _init_llm_and_embedd_models(self):
+        # Settings are process-wide in llama_index, so they are set once alongside the shared models
+        Settings.llm = self.llm
+        Settings.embed_model = self.embed_model
+        # Retrieval timing of every engine (indexes and retrievers pick the callback manager up from the Settings)
+        Settings.callback_manager = CallbackManager([TelemetryCallbackHandler(registry)])
+
+    def _register_metrics_collectors(self):
+        # Stats kept by the shared components, read when the metrics are exported
+        registry.register_collector('llm_scheduler', self.llm_scheduler.metrics)
+        registry.register_collector('condense', self.condenser.metrics)
+        registry.register_collector('embedding_service', self.embedding_service.metrics)
+        registry.register_collector('query_embedding_cache', self.query_embedding_cache.stats)
+        registry.register_collector('answer_cache', self.answer_cache.stats)
+        if self.exact_search is not None:
+            registry.register_collector('exact_search', self.exact_search.stats)
+        registry.register_collector('ingestion_jobs', lambda: {'queue_depth': self.job_manager.queue_depth()})
+
+    def get_parser(self, backend:str):
+        with self._parsers_lock:
+            if backend not in self._parsers:
+                self._parsers[backend] = profiler.timed(f'{backend} parser', lambda: get_parser(backend, local_max_workers=LOCAL_PARSER_WORKERS, local_pages_per_task=LOCAL_PARSER_PAGES_PER_TASK))
+            return self._parsers[backend]
+
+
+_shared_resources = None
+_shared_resources_lock = threading.Lock()
+
+def get_shared_resources():
+    # Double-checked locking so that concurrent sessions starting together only build the resources once
+    global _shared_resources
+    if _shared_resources is None:
+        with _shared_resources_lock:
+            if _shared_resources is None:
+                _shared_resources = profiler.timed('shared resources', SharedResources)
+                if TELEMETRY_METRICS_PORT:
+                    start_metrics_server(registry, TELEMETRY_METRICS_PORT)
+                if profiler.enabled:
+                    logging.info(profiler.report())
+    return _shared_resources
+
+def set_shared_resources(resources:SharedResources):
+    # Install a prebuilt registry (e.g. benchmarks running with local stand-ins for the LLM and the embedding model)
+    global _shared_resources
+    with _shared_resources_lock:
+        _shared_resources = resources
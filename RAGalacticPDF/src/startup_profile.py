@@ -0,0 +1,118 @@
+# Startup profiling: time spent importing packages and building each shared component, to find what delays a container
+# restart or a new session. Enabled by config.STARTUP_PROFILE (components are logged as they are built, the report once
+# the shared resources are ready), or run as a script to profile a cold start and the first use of the lazy components.
+# The entry points (app.py, api.py) import this module first so that their own imports are timed too.
+#
+# Usage: python RAGalacticPDF/src/startup_profile.py [--user-id alice] [--first-use all]
+import sys
+import time
+import builtins
+import threading
+from contextlib import contextmanager
+from typing import Callable
+
+from config import STARTUP_PROFILE
+
+import logging
+
+
+class StartupProfiler():
+    # Imports: first import of each top-level package, timed through builtins.__import__. The time of the packages it
+    # imports itself is attributed to them (self time), so that the import times add up.
+    # Components: construction time of the shared components, at startup or on first use for the lazy ones.
+    def __init__(self):
+        self.enabled = False
+        self.started_at = None
+        self._import_s = {}
+        # (component, started after s, built in s)
+        self._components = []
+        self._lock = threading.Lock()
+        # Per thread stack of the time spent in nested first imports
+        self._local = threading.local()
+        self._original_import = None
+
+    def enable(self):
+        if self.enabled:
+            return
+        self.enabled = True
+        self.started_at = time.perf_counter()
+        self._original_import = builtins.__import__
+        builtins.__import__ = self._timed_import
+
+    def _timed_import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        package = name.partition('.')[0]
+        if level or package in sys.modules:
+            return self._original_import(name, globals, locals, fromlist, level)
+        stack = self._local.__dict__.setdefault('stack', [])
+        stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            return self._original_import(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = time.perf_counter() - start
+            nested = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            with self._lock:
+                self._import_s[package] = self._import_s.get(package, 0.0) + elapsed - nested
+
+    @contextmanager
+    def span(self, component:str):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self._components.append((component, start - self.started_at, elapsed))
+            logging.info(f'STARTUP PROFILE: {component} built in {elapsed:.3f}s')
+
+    def timed(self, component:str, build:Callable):
+        with self.span(component):
+            return build()
+
+    def report(self, min_import_ms:float=10.0):
+        with self._lock:
+            import_s, components = dict(self._import_s), list(self._components)
+        lines = [f'STARTUP PROFILE: {time.perf_counter() - self.started_at:.3f}s since the profiler was enabled',
+                 f'imports ({sum(import_s.values()):.3f}s, packages above {min_import_ms:.0f}ms):']
+        for package, seconds in sorted(import_s.items(), key=lambda item: -item[1]):
+            if 1000 * seconds >= min_import_ms:
+                lines.append(f'  {package:<40} {seconds:8.3f}s')
+        lines.append('components (started at +s):')
+        for component, started_s, seconds in sorted(components, key=lambda item: item[1]):
+            lines.append(f'  {component:<40} {seconds:8.3f}s  (+{started_s:.3f}s)')
+        return '\n'.join(lines)
+
+
+profiler = StartupProfiler()
+if STARTUP_PROFILE:
+    profiler.enable()
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='Import and construction time of the app components (cold start).')
+    parser.add_argument('--user-id', default=None, help='also open the collection of this user (new session)')
+    parser.add_argument('--first-use', nargs='*', default=[], choices=['embed_model', 'parser', 'custom_transforms', 'reranker', 'all'],
+                        help='lazy components to build after startup (first upload, custom transforms ingestion, reranking)')
+    parser.add_argument('--min-import-ms', type=float, default=10.0)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    # The app modules use the profiler of the startup_profile module (this script runs as __main__)
+    from startup_profile import profiler
+    profiler.enable()
+    with profiler.span('import rag'):
+        from rag import RAGalacticPDF
+    with profiler.span('session'):
+        rag = RAGalacticPDF()
+        if args.user_id:
+            rag.set_user_id(args.user_id)
+    first_use = ['embed_model', 'parser', 'custom_transforms', 'reranker'] if 'all' in args.first_use else args.first_use
+    for component in first_use:
+        getattr(rag.resources, 'base_embed_model' if component == 'embed_model' else component)
+    print(profiler.report(min_import_ms=args.min_import_ms))
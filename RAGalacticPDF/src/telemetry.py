@@ -0,0 +1,307 @@
+# Import modules
+import re
+import json
+import time
+import random
+import bisect
+import threading
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Optional
+
+from llama_index.core.callbacks import CBEventType, EventPayload
+from llama_index.core.callbacks.base_handler import BaseCallbackHandler
+from llama_index.core.utils import get_tokenizer
+
+from config import TELEMETRY_EVENT_SAMPLE_RATE
+
+import logging
+
+
+# Histogram buckets: durations (seconds), throughputs (tokens/s) and sizes (chunks, tokens)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 900.0)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000, 20000)
+
+_INVALID_NAME_CHARS = re.compile(r'[^a-zA-Z0-9_:]')
+
+
+def _metric_name(name:str):
+    return _INVALID_NAME_CHARS.sub('_', name)
+
+
+def _labels_key(labels:Dict[str, Any]):
+    return tuple(sorted((key, str(value).lower() if isinstance(value, bool) else str(value)) for key, value in labels.items()))
+
+
+def _escape(value:str):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels_key, extra=()):
+    pairs = [*labels_key, *extra]
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in pairs) + '}'
+
+
+class Histogram():
+    # Cumulative bucket counts (exported as a Prometheus histogram) and a bounded reservoir of the latest
+    # observations for the percentiles of the in-process summaries
+    def __init__(self, buckets=LATENCY_BUCKETS, reservoir_size:int=1024):
+        self.buckets = tuple(buckets)
+        self.bucket_counts = [0] * len(self.buckets)
+        self.count, self.sum, self.max = 0, 0.0, 0.0
+        self._reservoir = deque(maxlen=reservoir_size)
+
+    def observe(self, value:float):
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            self.bucket_counts[index] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+        self._reservoir.append(value)
+
+    def _percentile(self, ordered, fraction:float):
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else 0.0
+
+    def summary(self):
+        ordered = sorted(self._reservoir)
+        return {'count': self.count, 'sum': self.sum, 'avg': self.sum / self.count if self.count else 0.0,
+                'p50': self._percentile(ordered, 0.50), 'p95': self._percentile(ordered, 0.95),
+                'p99': self._percentile(ordered, 0.99), 'max': self.max}
+
+
+class _InstrumentedStream():
+    # Wraps a streaming response: time to first token, tokens per second and number of streamed chunks are
+    # recorded once the caller consumed the stream
+    def __init__(self, registry, response, started_at:float, labels:Dict[str, Any]):
+        self._registry = registry
+        self._response = response
+        self._started_at = started_at
+        self._labels = labels
+
+    @property
+    def response_gen(self):
+        first_token_at, chunks = None, []
+        for chunk in self._response.response_gen:
+            if first_token_at is None:
+                first_token_at = time.perf_counter()
+                self._registry.observe('ragalactic_time_to_first_token_seconds', first_token_at - self._started_at, **self._labels)
+            chunks.append(chunk)
+            yield chunk
+        self._registry.record_generation(''.join(chunks), len(chunks), self._started_at, first_token_at, **self._labels)
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+    def __str__(self):
+        return str(self._response)
+
+
+class MetricsRegistry():
+    # In-process metrics: counters, histograms and collectors (callables returning the stats dicts already kept by
+    # the shared components, read at export time). Exported in the Prometheus text format or as a plain dict.
+    # Also emits sampled structured events (one json log line) in place of verbose debug dumps.
+    def __init__(self, event_sample_rate:float=0.1):
+        self.event_sample_rate = event_sample_rate
+        self._counters = {}
+        self._histograms = {}
+        self._collectors: Dict[str, Callable[[], Dict]] = {}
+        self._lock = threading.Lock()
+        self._tokenizer = None
+
+    def inc(self, name:str, value:float=1, **labels):
+        key = (_metric_name(name), _labels_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name:str, value:float, buckets=LATENCY_BUCKETS, **labels):
+        key = (_metric_name(name), _labels_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def register_collector(self, name:str, collector:Callable[[], Dict]):
+        # collector() -> {stat: number} or {group: {stat: number}}, exported as ragalactic_<name>_<stat>{group="..."} gauges
+        with self._lock:
+            self._collectors[_metric_name(name)] = collector
+
+    @contextmanager
+    def span(self, name:str, **labels):
+        # Duration of the block in ragalactic_span_duration_seconds{span=name}, failures counted separately
+        started_at = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.inc('ragalactic_span_errors_total', span=name, **labels)
+            raise
+        finally:
+            self.observe('ragalactic_span_duration_seconds', time.perf_counter() - started_at, span=name, **labels)
+
+    def event(self, name:str, sample_rate:Optional[float]=None, **fields):
+        # Structured event logged for a sample of the occurrences (sample_rate=1.0 to always log)
+        rate = self.event_sample_rate if sample_rate is None else sample_rate
+        if rate <= 0 or (rate < 1 and random.random() >= rate):
+            return
+        logging.info(f'EVENT {json.dumps({"event": name, "ts": round(time.time(), 3), **fields}, default=str)}')
+
+    def count_tokens(self, text:str):
+        if self._tokenizer is None:
+            self._tokenizer = get_tokenizer()
+        return len(self._tokenizer(text))
+
+    def record_generation(self, text:str, n_chunks:int, started_at:float, first_token_at:Optional[float], **labels):
+        finished_at = time.perf_counter()
+        n_tokens = self.count_tokens(text)
+        self.observe('ragalactic_stream_chunks', n_chunks, buckets=COUNT_BUCKETS, **labels)
+        self.observe('ragalactic_span_duration_seconds', finished_at - started_at, span='response_gen', **labels)
+        generation_s = finished_at - (first_token_at or started_at)
+        if n_tokens and generation_s > 0:
+            self.observe('ragalactic_generation_tokens_per_second', n_tokens / generation_s, buckets=RATE_BUCKETS, **labels)
+        self.inc('ragalactic_generated_tokens_total', n_tokens, **labels)
+        self.event('generation', tokens=n_tokens, chunks=n_chunks, total_s=round(finished_at - started_at, 3),
+                   ttft_s=round(first_token_at - started_at, 3) if first_token_at else None, **labels)
+
+    def instrument_response(self, response, started_at:float, streamed:bool, **labels):
+        # Streamed responses are wrapped (measured while the caller consumes them), the others are measured right away
+        if streamed:
+            return _InstrumentedStream(self, response, started_at, labels)
+        self.observe('ragalactic_time_to_first_token_seconds', time.perf_counter() - started_at, **labels)
+        self.record_generation(str(response), 1, started_at, None, **labels)
+        return response
+
+    def _collect(self):
+        with self._lock:
+            collectors = dict(self._collectors)
+        collected = {}
+        for name, collector in collectors.items():
+            try:
+                collected[name] = collector()
+            except Exception:
+                logging.exception(f'TELEMETRY: collector {name} failed')
+        return collected
+
+    def snapshot(self):
+        # Plain dict: counters, histogram summaries (with percentiles) and collectors
+        with self._lock:
+            counters = {f'{name}{_format_labels(labels)}': value for (name, labels), value in self._counters.items()}
+            histograms = {f'{name}{_format_labels(labels)}': histogram.summary() for (name, labels), histogram in self._histograms.items()}
+        return {'counters': counters, 'histograms': histograms, 'collectors': self._collect()}
+
+    def _collector_lines(self, name:str, stats:Dict, labels=()):
+        lines = []
+        for stat, value in stats.items():
+            if isinstance(value, dict):
+                lines.extend(self._collector_lines(name, value, (*labels, ('group', stat))))
+            elif isinstance(value, (int, float)):
+                metric = f'ragalactic_{name}_{_metric_name(stat)}'
+                lines.append((metric, f'{metric}{_format_labels(labels)} {float(value)}'))
+        return lines
+
+    def export_prometheus(self):
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items(), key=lambda item: item[0])
+            histograms = [(key, histogram.buckets, list(histogram.bucket_counts), histogram.count, histogram.sum) for key, histogram in histograms]
+        typed = set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                lines.append(f'# TYPE {name} counter')
+                typed.add(name)
+            lines.append(f'{name}{_format_labels(labels)} {float(value)}')
+        for (name, labels), buckets, bucket_counts, count, total in histograms:
+            if name not in typed:
+                lines.append(f'# TYPE {name} histogram')
+                typed.add(name)
+            cumulative = 0
+            for bound, bucket_count in zip(buckets, bucket_counts):
+                cumulative += bucket_count
+                lines.append(f'{name}_bucket{_format_labels(labels, [("le", repr(float(bound)))])} {cumulative}')
+            lines.append(f'{name}_bucket{_format_labels(labels, [("le", "+Inf")])} {count}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {total}')
+            lines.append(f'{name}_count{_format_labels(labels)} {count}')
+        # Samples of a metric family must be contiguous: group the collectors' lines by metric
+        gauges = {}
+        for name, stats in sorted(self._collect().items()):
+            for metric, line in self._collector_lines(name, stats if isinstance(stats, dict) else {'value': stats}):
+                gauges.setdefault(metric, []).append(line)
+        for metric, metric_lines in gauges.items():
+            if metric not in typed:
+                lines.append(f'# TYPE {metric} gauge')
+            lines.extend(metric_lines)
+        return '\n'.join(lines) + '\n'
+
+
+
+###                   ###
+###   LLAMA_INDEX     ###
+###                   ###
+
+class TelemetryCallbackHandler(BaseCallbackHandler):
+    # llama_index callback handler timing retrieval (any engine / retriever) and counting the retrieved chunks
+    def __init__(self, registry:MetricsRegistry):
+        super().__init__(event_starts_to_ignore=[], event_ends_to_ignore=[])
+        self._registry = registry
+        self._started = {}
+        self._lock = threading.Lock()
+
+    def on_event_start(self, event_type:CBEventType, payload:Optional[Dict[str, Any]]=None, event_id:str='', parent_id:str='', **kwargs:Any) -> str:
+        if event_type == CBEventType.RETRIEVE:
+            with self._lock:
+                self._started[event_id] = time.perf_counter()
+        return event_id
+
+    def on_event_end(self, event_type:CBEventType, payload:Optional[Dict[str, Any]]=None, event_id:str='', **kwargs:Any) -> None:
+        if event_type != CBEventType.RETRIEVE:
+            return
+        with self._lock:
+            started_at = self._started.pop(event_id, None)
+        if started_at is not None:
+            self._registry.observe('ragalactic_span_duration_seconds', time.perf_counter() - started_at, span='retrieve')
+        nodes = (payload or {}).get(EventPayload.NODES)
+        if nodes is not None:
+            self._registry.observe('ragalactic_retrieved_chunks', len(nodes), buckets=COUNT_BUCKETS)
+
+    def start_trace(self, trace_id:Optional[str]=None) -> None:
+        pass
+
+    def end_trace(self, trace_id:Optional[str]=None, trace_map:Optional[Dict[str, Any]]=None) -> None:
+        pass
+
+
+
+###                    ###
+###   EXPORT SERVER    ###
+###                    ###
+
+def start_metrics_server(registry:MetricsRegistry, port:int, host:str='0.0.0.0'):
+    # Serves GET /metrics (Prometheus text format) from a daemon thread
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = registry.export_prometheus().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    logging.info(f'TELEMETRY: metrics served on http://{host}:{port}/metrics')
+    return server
+
+
+# Process-wide registry (shared by every session, like the SharedResources)
+registry = MetricsRegistry(event_sample_rate=TELEMETRY_EVENT_SAMPLE_RATE)
@@ -0,0 +1,62 @@
+# Behaviour tests of the app modules, run offline: python -m pytest -q RAGalacticPDF/tests
+import os
+import sys
+import shutil
+import tempfile
+
+import pytest
+
+# Make the app modules (flat imports such as `from catalog import PDFCatalog`) and the benchmark helpers importable from the tests
+SRC_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src'))
+BENCHMARKS_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'benchmarks'))
+for path in [SRC_PATH, BENCHMARKS_PATH]:
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from synthetic_pdf import make_pdf, make_pdf_bytes  # noqa: E402
+from offline import FakeOllamaServer, UploadedPDF, offline_environment, install_offline_resources  # noqa: E402
+
+# config reads the environment once: the offline settings (fake Ollama server, local parser, every persistent path in
+# a temporary directory) are set before any test module imports the app modules
+OLLAMA_SERVER = FakeOllamaServer(ttft_ms=0, ms_per_token=0, answer_tokens=8).start()
+WORKDIR = tempfile.mkdtemp(prefix='ragalactic_tests_')
+offline_environment(WORKDIR, OLLAMA_SERVER.base_url)
+
+
+def pytest_unconfigure(config):
+    OLLAMA_SERVER.stop()
+    shutil.rmtree(WORKDIR, ignore_errors=True)
+
+
+@pytest.fixture
+def sample_pdf(tmp_path):
+    # sample_pdf(n_pages, seed=0) -> path of a generated text PDF
+    def make(n_pages:int, seed:int=0, name:str='sample.pdf'):
+        return make_pdf(str(tmp_path / name), n_pages, lines_per_page=10, seed=seed)
+    return make
+
+
+@pytest.fixture
+def uploaded_pdf():
+    # uploaded_pdf(name, n_pages, seed=0) -> generated PDF with the interface of a Streamlit upload
+    def make(name:str, n_pages:int, seed:int=0):
+        return UploadedPDF(name, make_pdf_bytes(n_pages, lines_per_page=10, seed=seed))
+    return make
+
+
+@pytest.fixture(scope='session')
+def resources():
+    # Shared resources with the hashed embedding model, built once for every session of the tests
+    return install_offline_resources()
+
+
+@pytest.fixture
+def new_session(resources):
+    # new_session(user_id) -> RAGalacticPDF handle of the user (the tests use distinct user ids, the storage is shared)
+    from rag import RAGalacticPDF
+
+    def make(user_id:str):
+        session = RAGalacticPDF()
+        session.set_user_id(user_id)
+        return session
+    return make
@@ -0,0 +1,87 @@
+import json
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from synthetic_pdf import make_pdf_bytes
+
+
+PDF_HEADERS = {'Content-Type': 'application/pdf'}
+
+
+@pytest.fixture
+def client(resources):
+    from api import app
+    with TestClient(app) as client:
+        yield client
+
+
+def _events(response):
+    # (event, data) of a server-sent events body
+    events = []
+    for block in response.text.strip().split('\n\n'):
+        lines = dict(line.split(': ', 1) for line in block.splitlines())
+        events.append((lines['event'], json.loads(lines['data'])))
+    return events
+
+
+def _upload(client, user_id:str, file_name:str, data:bytes, **params):
+    response = client.put(f'/users/{user_id}/pdfs/{file_name}', content=data, headers=PDF_HEADERS, params=params)
+    if response.status_code != 202:
+        return response
+    job = response.json()
+    deadline = time.monotonic() + 60
+    while job['status'] in ('queued', 'running'):
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+        job = client.get(f"/users/{user_id}/jobs/{job['job_id']}").json()
+    assert job['status'] == 'done', job
+    return response
+
+
+def test_health_and_metrics(client):
+    assert client.get('/health').json() == {'status': 'ok'}
+    assert client.get('/metrics').headers['content-type'].startswith('text/plain')
+
+
+def test_uploaded_pdf_listed_and_queried(client):
+    assert _upload(client, 'api_user', 'paper.pdf', make_pdf_bytes(1, lines_per_page=10), tags=['topic::physics']).status_code == 202
+    assert client.put('/users/api_user/pdfs/paper.pdf', content=make_pdf_bytes(1, lines_per_page=10), headers=PDF_HEADERS).json()['status'] == 'already_loaded'
+    assert client.get('/users/api_user/pdfs', params={'tagged_with_all': ['topic::physics']}).json() == {'pdfs': ['paper.pdf']}
+    assert client.get('/users/api_user/tags').json() == {'tags': ['topic::physics']}
+
+    events = _events(client.post('/users/api_user/query', json={'question': 'What does section 1 say?'}))
+    assert {event for event, _ in events[:-1]} == {'token'}
+    event, data = events[-1]
+    assert event == 'done'
+    assert data['response'] == ''.join(token['delta'] for _, token in events[:-1])
+    assert data['sources'] == ['paper.pdf']
+
+
+def test_conversation_messages(client):
+    _upload(client, 'api_chat_user', 'paper.pdf', make_pdf_bytes(1, lines_per_page=10))
+    answer = client.post('/users/api_chat_user/conversations/c1/messages', json={'message': 'What does section 1 say?', 'stream': False}).json()
+    assert answer['response'].strip()
+    assert client.delete('/users/api_chat_user/conversations/c1').json() == {'deleted': 'c1'}
+    assert client.delete('/users/api_chat_user/conversations/c1').status_code == 404
+
+
+def test_invalid_requests_rejected(client):
+    assert client.put('/users/api_user/pdfs/paper.txt', content=b'text', headers={'Content-Type': 'text/plain'}).status_code == 400
+    assert client.put('/users/api_user/pdfs/paper.pdf', content=make_pdf_bytes(1), headers=PDF_HEADERS, params={'tags': ['physics']}).status_code == 400
+    # User ids name chroma collections
+    assert client.get('/users/a/tags').status_code == 422
+
+
+def test_deleted_pdf(client):
+    _upload(client, 'api_delete_user', 'paper.pdf', make_pdf_bytes(1, lines_per_page=10))
+    assert client.delete('/users/api_delete_user/pdfs/paper.pdf').json() == {'deleted': 'paper.pdf'}
+    assert client.get('/users/api_delete_user/pdfs').json() == {'pdfs': []}
+    assert client.delete('/users/api_delete_user/pdfs/paper.pdf').status_code == 404
+
+
+def test_unreadable_pdf_rejected_before_a_job_is_created(client):
+    response = client.put('/users/api_user/pdfs/broken.pdf', content=b'%PDF-1.4 truncated', headers=PDF_HEADERS)
+    assert response.status_code == 400
+    assert 'broken.pdf' not in [job['file_name'] for job in client.get('/users/api_user/jobs').json()]
@@ -0,0 +1,79 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from bulk_ingest import BulkCheckpoint, BulkIngestion, list_pdfs, parse_tags
+
+
+@pytest.fixture
+def library(tmp_path, sample_pdf):
+    # Directory of 3 PDFs, one of them in a subdirectory
+    (tmp_path / 'library' / 'optics').mkdir(parents=True)
+    sample_pdf(1, seed=1, name='library/a.pdf')
+    sample_pdf(2, seed=2, name='library/b.pdf')
+    sample_pdf(1, seed=3, name='library/optics/c.pdf')
+    (tmp_path / 'library' / 'notes.txt').write_text('not a pdf')
+    return tmp_path / 'library'
+
+
+def _ingestion(session, checkpoint_path, **kwargs):
+    return BulkIngestion(session, ThreadPoolExecutor(max_workers=2), BulkCheckpoint(str(checkpoint_path)), window=2, **kwargs)
+
+
+def test_tags_and_file_names(library):
+    assert parse_tags(['topic::physics', 'lab::optics']) == [{'topic': 'physics'}, {'lab': 'optics'}]
+    with pytest.raises(ValueError):
+        parse_tags(['physics'])
+    assert list_pdfs(str(library)) == ['a.pdf', 'b.pdf']
+    assert list_pdfs(str(library), recursive=True) == ['a.pdf', 'b.pdf', 'optics/c.pdf']
+
+
+def test_checkpoint_survives_a_cut_line(tmp_path):
+    checkpoint = BulkCheckpoint(str(tmp_path / 'bulk.jsonl'))
+    checkpoint.record('a.pdf', 'hash_a', pages=1, chunks=1)
+    with open(tmp_path / 'bulk.jsonl', 'a') as f:
+        f.write('{"file_name": "b.pdf", "cont')
+    reloaded = BulkCheckpoint(str(tmp_path / 'bulk.jsonl'))
+    assert reloaded.is_completed('a.pdf', 'hash_a')
+    assert not reloaded.is_completed('b.pdf', 'hash_b')
+
+
+def test_directory_ingested_then_skipped_on_rerun(tmp_path, library, new_session):
+    session = new_session('bulk_user')
+    file_names = list_pdfs(str(library), recursive=True)
+    stats = _ingestion(session, tmp_path / 'bulk.jsonl', tags=[{'topic': 'physics'}]).run(str(library), file_names, progress=lambda message: None)
+    assert (stats['files'], stats['pages'], stats['failed']) == (3, 4, 0)
+    assert session.get_user_pdfs(tagged_with_all=[{'topic': 'physics'}]) == ['a.pdf', 'b.pdf', 'optics/c.pdf']
+    stored = session.chroma_collection.get(include=['metadatas'])['metadatas']
+    assert len(stored) == stats['chunks']
+    assert {metadata['file_name'] for metadata in stored} == set(file_names)
+
+    # Completed files are skipped, as files already in the catalog with the same content
+    rerun = _ingestion(session, tmp_path / 'bulk.jsonl').run(str(library), file_names, progress=lambda message: None)
+    assert (rerun['files'], rerun['skipped']) == (0, 3)
+    assert _ingestion(session, tmp_path / 'other.jsonl').run(str(library), file_names, progress=lambda message: None)['skipped'] == 3
+    assert session.chroma_collection.count() == stats['chunks']
+
+
+def test_changed_files_replaced_on_request(tmp_path, library, sample_pdf, new_session):
+    session = new_session('bulk_replace_user')
+    _ingestion(session, tmp_path / 'bulk.jsonl').run(str(library), ['a.pdf'], progress=lambda message: None)
+    sample_pdf(2, seed=1, name='library/a.pdf')
+    assert _ingestion(session, tmp_path / 'bulk.jsonl').run(str(library), ['a.pdf'], progress=lambda message: None)['skipped'] == 1
+    stats = _ingestion(session, tmp_path / 'bulk_replace.jsonl', replace=True).run(str(library), ['a.pdf'], progress=lambda message: None)
+    assert stats['replaced'] == 1
+    assert session.chroma_collection.count() == 2
+
+
+def test_pdf_without_text_counted_as_failed(tmp_path, library, new_session):
+    from pypdf import PdfWriter
+    writer = PdfWriter()
+    writer.add_blank_page(width=595, height=842)
+    writer.write(str(library / 'scan.pdf'))
+    session = new_session('bulk_failure_user')
+    stats = _ingestion(session, tmp_path / 'bulk.jsonl').run(str(library), ['a.pdf', 'scan.pdf'], progress=lambda message: None)
+    assert (stats['files'], stats['failed']) == (1, 1)
+    # Not in the catalog nor the checkpoint: tried again by the next run
+    assert session.get_user_pdfs() == ['a.pdf']
+    scan_hash = session.ingestion_cache.hash_pdf((library / 'scan.pdf').read_bytes())
+    assert not BulkCheckpoint(str(tmp_path / 'bulk.jsonl')).is_completed('scan.pdf', scan_hash)
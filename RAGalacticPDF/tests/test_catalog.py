@@ -0,0 +1,83 @@
+import json
+
+import pytest
+
+from catalog import PDFCatalog
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    catalog = PDFCatalog(str(tmp_path / 'catalog' / 'catalog.db'))
+    catalog.add_file('alice', 'optics.pdf', tags=[{'topic': 'physics'}, {'year': 2020}], content_hash='h1')
+    catalog.add_file('alice', 'quantum.pdf', tags=[{'topic': 'physics'}, {'year': 2021}], content_hash='h2')
+    catalog.add_file('alice', 'cells.pdf', tags=[{'topic': 'biology'}, {'year': 2020}], content_hash='h3')
+    catalog.add_file('bob', 'optics.pdf', tags=[{'topic': 'physics'}], content_hash='h1')
+    return catalog
+
+
+def test_files_and_tags_are_per_user(catalog):
+    assert catalog.get_files('alice') == ['cells.pdf', 'optics.pdf', 'quantum.pdf']
+    assert catalog.get_files('bob') == ['optics.pdf']
+    assert catalog.get_files('carol') is None
+    assert catalog.get_tags('bob') == [{'topic': 'physics'}]
+    # Tag values are stored as text
+    assert catalog.get_file_tags('alice', 'optics.pdf') == [{'topic': 'physics'}, {'year': '2020'}]
+
+
+def test_add_file_keeps_existing_entry(catalog):
+    assert not catalog.add_file('alice', 'optics.pdf', tags=[{'topic': 'chemistry'}], content_hash='other')
+    assert catalog.get_file_tags('alice', 'optics.pdf') == [{'topic': 'physics'}, {'year': '2020'}]
+    assert catalog.get_content_hash('alice', 'optics.pdf') == 'h1'
+
+
+def test_tagged_with_all(catalog):
+    assert catalog.get_files('alice', tagged_with_all=[{'topic': 'physics'}, {'year': 2020}]) == ['optics.pdf']
+    assert catalog.get_files('alice', tagged_with_all=[{'topic': 'physics'}]) == ['optics.pdf', 'quantum.pdf']
+    # Repeated tags count once
+    assert catalog.get_files('alice', tagged_with_all=[{'topic': 'physics'}, {'topic': 'physics'}]) == ['optics.pdf', 'quantum.pdf']
+    assert catalog.get_files('alice', tagged_with_all=[{'topic': 'biology'}, {'year': 2021}]) == []
+
+
+def test_tagged_with_at_least_one(catalog):
+    assert catalog.get_files('alice', tagged_with_at_least_one=[{'topic': 'biology'}, {'year': 2021}]) == ['cells.pdf', 'quantum.pdf']
+    assert catalog.get_files('bob', tagged_with_at_least_one=[{'year': 2020}]) == []
+
+
+def test_fingerprint_changes_with_the_file_set(catalog):
+    fingerprint = catalog.get_files_fingerprint('alice')
+    subset_fingerprint = catalog.get_files_fingerprint('alice', ['optics.pdf'])
+    assert catalog.get_files_fingerprint('alice') == fingerprint
+
+    # Another file of the user: the subset is untouched
+    catalog.update_file('alice', 'cells.pdf', content_hash='h3bis')
+    assert catalog.get_files_fingerprint('alice') != fingerprint
+    assert catalog.get_files_fingerprint('alice', ['optics.pdf']) == subset_fingerprint
+
+    catalog.remove_file('alice', 'optics.pdf')
+    assert catalog.get_files_fingerprint('alice', ['optics.pdf']) != subset_fingerprint
+    assert not catalog.has_file('alice', 'optics.pdf')
+    assert catalog.has_file('bob', 'optics.pdf')
+
+
+def test_migrate_from_json(tmp_path):
+    json_path = tmp_path / 'json_ids.json'
+    json_path.write_text(json.dumps({
+        'alice': {'files': ['a.pdf', 'b.pdf'], 'tags': [[{'topic': 'physics'}], []]},
+        'bob': {'files': ['c.pdf'], 'tags': [[{'topic': 'biology'}, {'year': '2020'}]]},
+    }))
+    catalog = PDFCatalog(str(tmp_path / 'catalog.db'))
+
+    assert catalog.migrate_from_json(str(json_path)) == 3
+    assert catalog.get_files('alice') == ['a.pdf', 'b.pdf']
+    assert catalog.get_file_tags('alice', 'a.pdf') == [{'topic': 'physics'}]
+    assert catalog.get_file_tags('alice', 'b.pdf') is None
+    assert catalog.get_files('bob', tagged_with_all=[{'topic': 'biology'}, {'year': '2020'}]) == ['c.pdf']
+    # One-shot: a second run (e.g. next app start) imports nothing
+    assert catalog.migrate_from_json(str(json_path)) == 0
+    assert catalog.get_files('alice') == ['a.pdf', 'b.pdf']
+
+
+def test_migrate_without_json_file(tmp_path):
+    catalog = PDFCatalog(str(tmp_path / 'catalog.db'))
+    assert catalog.migrate_from_json(str(tmp_path / 'missing.json')) == 0
+    assert catalog.get_files('alice') is None
@@ -0,0 +1,82 @@
+import pytest
+
+from llama_index.core.llms import ChatMessage, MessageRole, MockLLM
+from llama_index.core.memory import ChatMemoryBuffer
+from llama_index.core.bridge.pydantic import PrivateAttr
+
+from chat_memory import RollingSummaryMemory, new_chat_memory
+
+
+class _SummaryLLM(MockLLM):
+    # Records the summary prompts, answers with a fixed summary
+    _prompts: list = PrivateAttr(default_factory=list)
+
+    @property
+    def prompts(self):
+        return self._prompts
+
+    def complete(self, prompt, formatted=False, **kwargs):
+        self._prompts.append(prompt)
+        return super().complete('summary of the earlier turns', formatted=formatted, **kwargs)
+
+
+def _turn(i:int):
+    return [ChatMessage(role=MessageRole.USER, content=f'question {i}'), ChatMessage(role=MessageRole.ASSISTANT, content=f'answer {i}')]
+
+
+@pytest.fixture
+def llm():
+    return _SummaryLLM()
+
+
+def test_recent_turns_kept_verbatim(llm):
+    memory = RollingSummaryMemory.from_defaults(llm=llm, recent_turns=2)
+    for i in range(2):
+        for message in _turn(i):
+            memory.put(message)
+    assert memory.wait_idle(timeout=5)
+    assert [message.content for message in memory.get()] == ['question 0', 'answer 0', 'question 1', 'answer 1']
+    assert llm.prompts == []
+
+
+def test_older_turns_folded_into_summary(llm):
+    memory = RollingSummaryMemory.from_defaults(llm=llm, recent_turns=2)
+    for i in range(4):
+        for message in _turn(i):
+            memory.put(message)
+    assert memory.wait_idle(timeout=5)
+
+    messages = memory.get()
+    assert messages[0].role == MessageRole.SYSTEM
+    assert 'summary of the earlier turns' in messages[0].content
+    assert [message.content for message in messages[1:]] == ['question 2', 'answer 2', 'question 3', 'answer 3']
+    # Every evicted message went through the summarizer
+    assert all(f'question {i}' in ''.join(llm.prompts) for i in range(2))
+
+
+def test_reset_drops_summary_and_history(llm):
+    memory = RollingSummaryMemory.from_defaults(llm=llm, recent_turns=1, chat_history=[*_turn(0), *_turn(1)])
+    assert memory.wait_idle(timeout=5)
+    assert memory.get()[0].role == MessageRole.SYSTEM
+    memory.reset()
+    assert memory.get() == []
+
+
+def test_new_chat_memory_modes(llm):
+    assert isinstance(new_chat_memory('buffer'), ChatMemoryBuffer)
+    assert isinstance(new_chat_memory('rolling_summary', llm=llm), RollingSummaryMemory)
+    with pytest.raises(ValueError):
+        new_chat_memory('unknown')
+
+
+def test_conversation_only_restarts_when_the_mode_or_knowledge_base_changes(new_session):
+    session = new_session('chat_memory_user')
+    session._set_engine_feature(engine_mode='Conversation', llm_knowledge_base=False, streaming=True)
+    session.manage_chat_history(to_append=('user', 'What is the photoelectric effect?'))
+    # Reruns of the app set the same features again
+    session._set_engine_feature(engine_mode='Conversation')
+    session._set_engine_feature(llm_knowledge_base=False)
+    session._set_engine_feature(streaming=False)
+    assert [message.content for message in session.chat_history] == ['What is the photoelectric effect?']
+    session._set_engine_feature(llm_knowledge_base=True)
+    assert session.chat_history == []
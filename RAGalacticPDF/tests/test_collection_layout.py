@@ -0,0 +1,55 @@
+import chromadb
+import pytest
+
+from catalog import PDFCatalog
+from collection_layout import migrate, check_layout, LAYOUT_META_KEY
+
+
+def _add_user_nodes(client, user_id:str, n:int):
+    collection = client.get_or_create_collection(user_id)
+    collection.add(ids=[f'{user_id}_{i}' for i in range(n)], embeddings=[[float(i), 1.0] for i in range(n)],
+                   documents=[f'chunk {i} of {user_id}' for i in range(n)], metadatas=[{'file_name': 'paper.pdf'} for _ in range(n)])
+
+
+def test_nodes_migrated_to_the_shared_collection_and_back(tmp_path):
+    client = chromadb.PersistentClient(path=str(tmp_path / 'chroma'))
+    catalog = PDFCatalog(str(tmp_path / 'catalog.sqlite3'))
+    _add_user_nodes(client, 'alice', 3)
+    _add_user_nodes(client, 'bob', 2)
+
+    assert migrate('shared', client=client, catalog=catalog, batch_size=2, progress=lambda message: None) == (2, 5)
+    assert [collection.name for collection in client.list_collections()] == ['ragalactic_shared']
+    shared = client.get_collection('ragalactic_shared')
+    alice = shared.get(where={'user_id': 'alice'}, include=['documents', 'embeddings'])
+    assert sorted(alice['documents']) == ['chunk 0 of alice', 'chunk 1 of alice', 'chunk 2 of alice']
+    assert catalog.get_meta(LAYOUT_META_KEY) == 'shared'
+
+    assert migrate('per_user', client=client, catalog=catalog, progress=lambda message: None) == (2, 5)
+    assert sorted(collection.name for collection in client.list_collections()) == ['alice', 'bob']
+    bob = client.get_collection('bob').get(include=['metadatas'])
+    assert sorted(bob['ids']) == ['bob_0', 'bob_1']
+    assert all(metadata == {'file_name': 'paper.pdf', 'user_id': 'bob'} for metadata in bob['metadatas'])
+
+
+def test_source_collections_kept_on_request(tmp_path):
+    client = chromadb.PersistentClient(path=str(tmp_path / 'chroma'))
+    _add_user_nodes(client, 'alice', 2)
+    migrate('shared', client=client, keep_source=True, progress=lambda message: None)
+    assert sorted(collection.name for collection in client.list_collections()) == ['alice', 'ragalactic_shared']
+    # Running it again (e.g. after an interruption) does not duplicate the nodes
+    migrate('shared', client=client, progress=lambda message: None)
+    assert client.get_collection('ragalactic_shared').count() == 2
+
+
+def test_layout_recorded_on_first_start(tmp_path, caplog):
+    catalog = PDFCatalog(str(tmp_path / 'catalog.sqlite3'))
+    check_layout(catalog, 'per_user')
+    assert catalog.get_meta(LAYOUT_META_KEY) == 'per_user'
+    check_layout(catalog, 'shared')
+    assert 'collection_layout.py --to shared' in caplog.text
+    assert catalog.get_meta(LAYOUT_META_KEY) == 'per_user'
+
+
+def test_unknown_layout():
+    with pytest.raises(ValueError):
+        migrate('per_file')
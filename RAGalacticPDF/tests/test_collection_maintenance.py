@@ -0,0 +1,50 @@
+import chromadb
+import numpy as np
+import pytest
+
+from collection_layout import hnsw_metadata, get_or_create_collection
+from collection_maintenance import rebuild, maintain, vector_segment, REBUILD_SUFFIX
+
+
+@pytest.fixture
+def client(tmp_path):
+    return chromadb.PersistentClient(path=str(tmp_path / 'chroma'))
+
+
+def _add_nodes(collection, n:int):
+    vectors = np.random.default_rng(0).standard_normal((n, 8)).astype(np.float32)
+    collection.add(ids=[str(i) for i in range(n)], embeddings=vectors.tolist(), documents=[f'chunk {i}' for i in range(n)],
+                   metadatas=[{'file_name': 'paper.pdf'} for _ in range(n)])
+
+
+def test_existing_collection_keeps_its_parameters(client):
+    created = get_or_create_collection(client, 'alice', metadata=hnsw_metadata(m=8))
+    assert created.metadata['hnsw:M'] == 8
+    assert get_or_create_collection(client, 'alice', metadata=hnsw_metadata(m=32)).metadata['hnsw:M'] == 8
+
+
+def test_rebuild_applies_the_new_parameters_and_keeps_the_nodes(tmp_path, client):
+    collection = get_or_create_collection(client, 'alice', metadata=hnsw_metadata(m=8))
+    _add_nodes(collection, 50)
+    rebuilt = rebuild(client, 'alice', hnsw_metadata(m=32, search_ef=64), batch_size=20)
+    assert rebuilt.metadata['hnsw:M'] == 32
+    assert vector_segment(str(tmp_path / 'chroma'), rebuilt)[1]['hnsw:M'] == 32
+    stored = rebuilt.get(ids=['7'], include=['documents', 'metadatas'])
+    assert (rebuilt.count(), stored['documents'], stored['metadatas']) == (50, ['chunk 7'], [{'file_name': 'paper.pdf'}])
+    assert [collection.name for collection in client.list_collections()] == ['alice']
+
+
+def test_interrupted_rebuild_resumed(client):
+    # Interrupted once the copy was complete and the original deleted
+    _add_nodes(get_or_create_collection(client, f'alice{REBUILD_SUFFIX}', metadata=hnsw_metadata(m=32)), 10)
+    assert rebuild(client, 'alice', hnsw_metadata(m=32)).count() == 10
+    assert [collection.name for collection in client.list_collections()] == ['alice']
+
+
+def test_report_measures_recall_without_rebuilding(tmp_path, client):
+    _add_nodes(get_or_create_collection(client, 'alice'), 50)
+    result = maintain(client, 'alice', report_only=True, chroma_dir=str(tmp_path / 'chroma'), n_queries=10, progress=lambda message: None)
+    assert result['before']['nodes'] == 50
+    # Small collection: the HNSW search is exact
+    assert result['before']['recall@5'] == 1.0
+    assert 'after' not in result
@@ -0,0 +1,80 @@
+import asyncio
+
+import pytest
+
+from llama_index.core import PromptTemplate
+from llama_index.core.llms import ChatMessage, MessageRole
+
+from condense import QuestionCondenser, is_self_contained
+
+
+PROMPT = PromptTemplate('{chat_history}\nRewrite: {question}')
+
+
+class _CondenseLLM():
+    # Stand-in of the condense LLM: records the questions it rewrote
+    def __init__(self):
+        self.questions = []
+
+    def predict(self, prompt, question:str, chat_history:str):
+        self.questions.append(question)
+        return f'standalone {question}'
+
+    async def apredict(self, prompt, question:str, chat_history:str):
+        return self.predict(prompt, question, chat_history)
+
+
+def _history(question:str='What is the photoelectric effect?', answer:str='Electrons emitted by light.'):
+    return [ChatMessage(role=MessageRole.USER, content=question), ChatMessage(role=MessageRole.ASSISTANT, content=answer)]
+
+
+def test_self_contained_questions():
+    assert is_self_contained('What is the rest energy of an electron?')
+    assert not is_self_contained('Why?')
+    assert not is_self_contained('And what about the mass of the proton?')
+    assert not is_self_contained('Can you elaborate on the second result of the paper?')
+    assert not is_self_contained('Who discovered it in the first place?')
+
+
+def test_always_strategy_rewrites_every_follow_up():
+    llm = _CondenseLLM()
+    condenser = QuestionCondenser(llm, strategy='always')
+    # First question of a conversation: nothing to condense against
+    assert condenser.condense([], 'Who discovered it?', PROMPT) == 'Who discovered it?'
+    assert condenser.condense(_history(), 'What is the rest energy of an electron?', PROMPT) == 'standalone What is the rest energy of an electron?'
+    assert llm.questions == ['What is the rest energy of an electron?']
+
+
+def test_heuristic_strategy_skips_self_contained_questions():
+    llm = _CondenseLLM()
+    condenser = QuestionCondenser(llm, strategy='heuristic')
+    assert condenser.condense(_history(), 'What is the rest energy of an electron?', PROMPT) == 'What is the rest energy of an electron?'
+    assert condenser.condense(_history(), 'Who discovered it?', PROMPT) == 'standalone Who discovered it?'
+    assert condenser.condense(_history(), 'Who discovered it?', PROMPT) == 'standalone Who discovered it?'
+    assert llm.questions == ['Who discovered it?', 'Who discovered it?']
+    metrics = condenser.metrics()['heuristic']
+    assert (metrics['turns'], metrics['llm_calls'], metrics['skipped']) == (3, 2, 1)
+
+
+def test_cached_strategy_reuses_rewrites_of_the_same_exchange():
+    llm = _CondenseLLM()
+    condenser = QuestionCondenser(llm, strategy='cached')
+    assert condenser.condense(_history(), 'Who discovered it?', PROMPT) == 'standalone Who discovered it?'
+    assert asyncio.run(condenser.acondense(_history(), 'who discovered it', PROMPT)) == 'standalone Who discovered it?'
+    # Another last exchange: rewritten again
+    condenser.condense(_history(answer='Light ejecting electrons.'), 'Who discovered it?', PROMPT)
+    assert llm.questions == ['Who discovered it?', 'Who discovered it?']
+    assert condenser.metrics()['cached']['cache_hits'] == 1
+
+
+def test_time_to_first_token_recorded():
+    condenser = QuestionCondenser(_CondenseLLM(), strategy='cached')
+    assert list(condenser.timed_stream(iter(['a', 'b']), started_at=0.0)) == ['a', 'b']
+    metrics = condenser.metrics()['cached']
+    assert metrics['avg_ttft_ms'] > 0
+    assert metrics['max_ttft_ms'] == metrics['avg_ttft_ms']
+
+
+def test_unknown_strategy():
+    with pytest.raises(ValueError):
+        QuestionCondenser(_CondenseLLM(), strategy='never')
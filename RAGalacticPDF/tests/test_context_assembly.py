@@ -0,0 +1,73 @@
+from llama_index.core.schema import NodeWithScore, TextNode, NodeRelationship, RelatedNodeInfo, QueryBundle
+
+from context_assembly import TokenBudgetPostprocessor, hybrid_scores
+
+
+def _node(text:str, score:float, doc_id:str='doc', start:int=None, node_id:str=None):
+    node = TextNode(text=text, start_char_idx=start, end_char_idx=None if start is None else start + len(text))
+    if node_id is not None:
+        node.id_ = node_id
+    node.relationships[NodeRelationship.SOURCE] = RelatedNodeInfo(node_id=doc_id)
+    return NodeWithScore(node=node, score=score)
+
+
+def _words(n:int, word:str='photon'):
+    return ' '.join([word] * n)
+
+
+def test_hybrid_scores_favour_the_query_terms():
+    texts = ['The cat sat on the mat.', 'Energy conservation holds in a closed system.', 'Dogs bark.']
+    # Vector scores almost tied: the chunk with the query terms comes first
+    scores = hybrid_scores('Is energy conservation valid?', texts, [0.80, 0.79, 0.50])
+    assert scores[1] > scores[0] > scores[2]
+    # Without lexical weight, the vector order is kept
+    assert hybrid_scores('Is energy conservation valid?', texts, [0.80, 0.79, 0.50], lexical_weight=0.0)[0] == 1.0
+
+
+def test_best_chunks_kept_within_the_token_budget():
+    postprocessor = TokenBudgetPostprocessor(token_budget=25, baseline_top_k=3)
+    nodes = [_node(_words(10, word), score, doc_id=word) for word, score in [('energy', 0.9), ('mass', 0.8), ('spin', 0.7), ('charge', 0.6)]]
+    kept = postprocessor.postprocess_nodes(nodes, query_bundle=QueryBundle('energy and mass'))
+    assert sorted(node.node.get_content().split()[0] for node in kept) == ['energy', 'mass']
+    stats = postprocessor.stats()
+    assert stats['sent_tokens'] <= 25 < stats['baseline_tokens']
+
+
+def test_near_duplicates_are_dropped():
+    embeddings = {'a': [1.0, 0.0], 'b': [0.999, 0.01], 'c': [0.0, 1.0]}
+    postprocessor = TokenBudgetPostprocessor(embedding_lookup=lambda node_ids: {node_id: embeddings[node_id] for node_id in node_ids},
+                                             token_budget=1000, baseline_top_k=3)
+    nodes = [_node('energy is conserved', 0.9, doc_id='1', node_id='a'), _node('energy is conserved.', 0.8, doc_id='2', node_id='b'),
+             _node('spin is quantized', 0.7, doc_id='3', node_id='c')]
+    kept = postprocessor.postprocess_nodes(nodes)
+    assert sorted(node.node.node_id for node in kept) == ['a', 'c']
+
+
+def test_overlapping_chunks_of_a_document_are_merged():
+    postprocessor = TokenBudgetPostprocessor(token_budget=1000, baseline_top_k=2)
+    first = _node('Energy is conserved in a closed system.', 0.9, start=0)
+    # Overlaps the end of the first chunk ("closed system.")
+    second = _node('closed system. It cannot be created.', 0.8, start=25)
+    kept = postprocessor.postprocess_nodes([second, first])
+    assert [node.node.get_content() for node in kept] == ['Energy is conserved in a closed system. It cannot be created.']
+    assert kept[0].score == 0.9
+
+
+def test_context_never_exceeds_the_baseline():
+    # No lower budget: small over-retrieved chunks must not add up to more than the baseline top 2 chunks
+    postprocessor = TokenBudgetPostprocessor(token_budget=0, baseline_top_k=2)
+    nodes = [_node(_words(5, word), 0.9 - i / 100, doc_id=word) for i, word in enumerate(['energy', 'mass', 'spin', 'charge', 'parity', 'isospin'])]
+    kept = postprocessor.postprocess_nodes(nodes)
+    assert len(kept) == 2
+    stats = postprocessor.stats()
+    assert stats['sent_tokens'] == stats['baseline_tokens']
+    assert stats['tokens_saved'] == 0
+
+
+def test_oversized_first_chunk_truncated_on_a_copy():
+    postprocessor = TokenBudgetPostprocessor(token_budget=10, baseline_top_k=1)
+    node = _node(_words(50), 0.9)
+    kept = postprocessor.postprocess_nodes([node])
+    assert 0 < len(kept[0].node.get_content().split()) < 50
+    # The retrieved node itself is left unchanged
+    assert node.node.get_content() == _words(50)
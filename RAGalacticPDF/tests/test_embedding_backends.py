@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+
+from embedding_backends import _CPUTransformerEmbedding, _query_instruction, get_embedding_model, BGE_QUERY_INSTRUCTION
+
+
+class _CharTokenizer():
+    # One token per character, padded to the longest text of the batch (token id: character code)
+    def __call__(self, texts, padding='longest', truncation=True, max_length=512, return_tensors='np'):
+        length = min(max_length, max(len(text) for text in texts))
+        input_ids = np.zeros((len(texts), length), dtype=np.int64)
+        for row, text in enumerate(texts):
+            input_ids[row, :len(text[:length])] = [ord(char) for char in text[:length]]
+        return {'input_ids': input_ids}
+
+
+class _CountingBackend(_CPUTransformerEmbedding):
+    # Hidden state of the first token: [1, number of characters, 0], records the shape of the batches run
+    _batches: list = PrivateAttr(default_factory=list)
+
+    def __init__(self, embed_batch_size:int=2):
+        BaseEmbedding.__init__(self, model_name='BAAI/bge-small-en-v1.5', embed_batch_size=embed_batch_size,
+                               query_instruction=_query_instruction('BAAI/bge-small-en-v1.5'))
+        self._tokenizer = _CharTokenizer()
+
+    @property
+    def batches(self):
+        return self._batches
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CountingBackend"
+
+    def _forward(self, encoded):
+        input_ids = encoded['input_ids']
+        self._batches.append(input_ids.shape)
+        hidden = np.zeros((*input_ids.shape, 3), dtype=np.float32)
+        hidden[:, 0, 0] = 1.0
+        hidden[:, 0, 1] = (input_ids > 0).sum(axis=1)
+        return hidden
+
+
+def test_query_instruction_of_the_english_bge_models():
+    assert _query_instruction('BAAI/bge-small-en-v1.5') == BGE_QUERY_INSTRUCTION
+    assert _query_instruction('BAAI/bge-small-zh-v1.5') == ''
+    assert _query_instruction('sentence-transformers/all-MiniLM-L6-v2') == ''
+
+
+def test_texts_batched_by_length_and_normalized():
+    model = _CountingBackend(embed_batch_size=2)
+    texts = ['a' * 30, 'b', 'c' * 29, 'dd']
+    embeddings = model._get_text_embeddings(texts)
+    # Batches of similar lengths: ('b', 'dd') then the two long texts, padded to their own longest
+    assert model.batches == [(2, 2), (2, 30)]
+    assert all(np.linalg.norm(embedding) == pytest.approx(1.0) for embedding in embeddings)
+    # Results in the order of the input texts
+    assert [round(embedding[1] / embedding[0]) for embedding in embeddings] == [30, 1, 29, 2]
+
+
+def test_query_gets_the_instruction():
+    model = _CountingBackend()
+    model.get_query_embedding('energy?')
+    assert model.batches == [(1, len(BGE_QUERY_INSTRUCTION) + len('energy?'))]
+
+
+def test_backends_implement_forward():
+    class _NoForward(_CPUTransformerEmbedding):
+        pass
+    with pytest.raises(TypeError):
+        _NoForward('BAAI/bge-small-en-v1.5')
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        get_embedding_model('tensorrt', 'BAAI/bge-small-en-v1.5')
@@ -0,0 +1,107 @@
+import threading
+from typing import List
+
+import pytest
+
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+
+from embedding_service import BatchingEmbeddingService, ServiceEmbedding
+from query_cache import QueryEmbeddingCache
+
+
+class _CountingEmbedding(BaseEmbedding):
+    # Embeds a text as [its length, 1 for queries else 0], records the size of each model call
+    _calls: list = PrivateAttr(default_factory=list)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CountingEmbedding"
+
+    @property
+    def calls(self):
+        return self._calls
+
+    def _get_query_embedding(self, query:str) -> List[float]:
+        self._calls.append(1)
+        return [float(len(query)), 1.0]
+
+    async def _aget_query_embedding(self, query:str) -> List[float]:
+        return self._get_query_embedding(query)
+
+    def _get_text_embedding(self, text:str) -> List[float]:
+        return self._get_text_embeddings([text])[0]
+
+    def _get_text_embeddings(self, texts:List[str]) -> List[List[float]]:
+        self._calls.append(len(texts))
+        return [[float(len(text)), 0.0] for text in texts]
+
+
+def test_concurrent_requests_are_batched():
+    model = _CountingEmbedding(model_name='counting')
+    service = BatchingEmbeddingService(model, max_batch_size=64, max_wait_ms=200)
+    results, barrier = {}, threading.Barrier(8)
+
+    def embed(i):
+        barrier.wait()
+        results[i] = service.embed(['x' * i], kind='text')
+
+    threads = [threading.Thread(target=embed, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=5)
+
+    # Each caller gets its own embeddings back, computed in fewer model calls than requests
+    assert results == {i: [[float(i), 0.0]] for i in range(8)}
+    assert len(model.calls) < 8
+    metrics = service.metrics()
+    assert (metrics['requests'], metrics['texts']) == (8, 8)
+
+
+def test_large_request_is_split_in_model_batches():
+    model = _CountingEmbedding(model_name='counting')
+    service = BatchingEmbeddingService(model, max_batch_size=4, max_wait_ms=1)
+    assert len(service.embed(['text'] * 10)) == 10
+    assert model.calls == [4, 4, 2]
+
+
+def test_service_embedding_goes_through_the_service():
+    model = _CountingEmbedding(model_name='counting')
+    service = BatchingEmbeddingService(model, max_wait_ms=1)
+    embed_model = ServiceEmbedding(service)
+    assert embed_model.model_name == 'counting'
+    assert embed_model.get_query_embedding('What is the energy?') == [19.0, 1.0]
+    assert embed_model.get_text_embedding_batch(['ab', 'abc']) == [[2.0, 0.0], [3.0, 0.0]]
+    assert service.metrics()['requests'] == 2
+
+
+def test_service_embedding_caches_query_embeddings():
+    model = _CountingEmbedding(model_name='counting')
+    embed_model = ServiceEmbedding(BatchingEmbeddingService(model, max_wait_ms=1), query_cache=QueryEmbeddingCache())
+    assert embed_model.get_query_embedding('What is the energy?') == [19.0, 1.0]
+    assert embed_model.get_query_embedding('what is the energy') == [19.0, 1.0]
+    assert model.calls == [1]
+
+
+def test_model_built_in_the_background():
+    built = threading.Event()
+
+    def build():
+        built.wait()
+        return _CountingEmbedding(model_name='counting')
+
+    service = BatchingEmbeddingService(build, max_wait_ms=1)
+    future = service.submit(['queued while loading'])
+    assert not future.done()
+    built.set()
+    assert future.result(timeout=5) == [[20.0, 0.0]]
+
+
+def test_model_loading_error_fails_the_requests():
+    def build():
+        raise OSError('model weights not found')
+
+    service = BatchingEmbeddingService(build, max_wait_ms=1)
+    with pytest.raises(OSError):
+        service.embed(['text'])
@@ -0,0 +1,66 @@
+import time
+
+from engine_cache import EngineCache, TTLLRUCache
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = TTLLRUCache(max_size=2, ttl_s=None)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert (cache.get('a'), cache.get('c')) == (1, 3)
+    assert len(cache) == 2
+
+
+def test_entries_expire_after_ttl():
+    cache = TTLLRUCache(max_size=8, ttl_s=0.05)
+    cache.set('a', 1)
+    assert cache.get('a') == 1
+    time.sleep(0.1)
+    assert cache.get('a', default='expired') == 'expired'
+    assert len(cache) == 0
+
+
+def test_get_or_create_builds_once():
+    cache = TTLLRUCache(max_size=8, ttl_s=None)
+    built = []
+    factory = lambda: built.append('engine') or 'engine'
+    assert cache.get_or_create('key', factory) == 'engine'
+    assert cache.get_or_create('key', factory) == 'engine'
+    assert built == ['engine']
+    assert cache.stats()['hits'] == 1
+
+
+def test_engine_key_ignores_file_order():
+    assert EngineCache.engine_key('alice', ['a.pdf', 'b.pdf'], 'Query') == EngineCache.engine_key('alice', ['b.pdf', 'a.pdf'], 'Query')
+    # None (every file of the user) is not the empty selection
+    assert EngineCache.engine_key('alice', None, 'Query') != EngineCache.engine_key('alice', [], 'Query')
+    assert EngineCache.engine_key('alice', None, 'Query', top_k=3) != EngineCache.engine_key('alice', None, 'Query', top_k=5)
+
+
+def test_invalidate_user_drops_only_their_indexes_and_engines():
+    cache = EngineCache(max_engines=8, ttl_s=None)
+    cache.collections.set('alice', 'collection')
+    cache.indexes.set(('alice',), 'alice index')
+    cache.indexes.set(('bob',), 'bob index')
+    cache.engines.set(EngineCache.engine_key('alice', None, 'Query'), 'alice engine')
+    cache.engines.set(EngineCache.engine_key('bob', None, 'Query'), 'bob engine')
+
+    cache.invalidate_user('alice')
+
+    assert cache.indexes.get(('alice',)) is None
+    assert cache.engines.get(EngineCache.engine_key('alice', None, 'Query')) is None
+    assert cache.indexes.get(('bob',)) == 'bob index'
+    assert cache.engines.get(EngineCache.engine_key('bob', None, 'Query')) == 'bob engine'
+    # The collection setup does not depend on the files
+    assert cache.collections.get('alice') == 'collection'
+
+
+def test_setdefault_keeps_the_first_value_stored():
+    cache = TTLLRUCache(max_size=8, ttl_s=None)
+    first, second = object(), object()
+    assert cache.setdefault('conversation', first) is first
+    assert cache.setdefault('conversation', second) is first
+    assert len(cache) == 1
@@ -0,0 +1,111 @@
+import chromadb
+import numpy as np
+import pytest
+
+from llama_index.core.schema import TextNode
+from llama_index.vector_stores.chroma import ChromaVectorStore
+from llama_index.core.vector_stores.types import VectorStoreQuery, MetadataFilter, MetadataFilters, FilterCondition
+
+from catalog import PDFCatalog
+from exact_search import ExactSearchTier, ExactSearchVectorStore, parse_where, parse_filters
+
+
+@pytest.fixture
+def store(tmp_path):
+    # 'alice' collection (per_user layout) of 60 random vectors over 3 files, her files in the catalog
+    client = chromadb.PersistentClient(path=str(tmp_path / 'chroma'))
+    collection = client.create_collection('alice')
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((60, 8)).astype(np.float32)
+    file_names = [f'file_{i % 3}.pdf' for i in range(60)]
+    # Written as the app does (node content in the metadata)
+    ChromaVectorStore(chroma_collection=collection).add([TextNode(id_=str(i), text=f'chunk {i}', embedding=vectors[i].tolist(), metadata={'file_name': file_name})
+                                                         for i, file_name in enumerate(file_names)])
+    catalog = PDFCatalog(str(tmp_path / 'catalog.sqlite3'))
+    for i in range(3):
+        catalog.add_file('alice', f'file_{i}.pdf', content_hash=str(i))
+    return collection, catalog, vectors, file_names
+
+
+def _brute_force(vectors, file_names, query, top_k:int, selected=None):
+    distances = ((vectors - query) ** 2).sum(axis=1)
+    rows = [row for row in np.argsort(distances) if selected is None or file_names[row] in selected]
+    return [str(row) for row in rows[:top_k]]
+
+
+def test_where_clauses_of_the_app():
+    assert parse_where({'user_id': 'alice'}) == ('alice', None)
+    assert parse_where({'$and': [{'user_id': 'alice'}, {'file_name': {'$in': ['a.pdf', 'b.pdf']}}]}) == ('alice', ['a.pdf', 'b.pdf'])
+    assert parse_where({'file_name': {'$eq': 'a.pdf'}}) == (None, ['a.pdf'])
+    for where in [{'$or': [{'user_id': 'alice'}, {'user_id': 'bob'}]}, {'file_name': {'$ne': 'a.pdf'}}, {'topic': 'physics'}]:
+        with pytest.raises(ValueError):
+            parse_where(where)
+
+
+def test_metadata_filters_of_the_app():
+    filters = MetadataFilters(filters=[MetadataFilter(key='file_name', value='a.pdf'), MetadataFilter(key='file_name', value='b.pdf')],
+                              condition=FilterCondition.OR)
+    assert parse_filters(filters) == ['a.pdf', 'b.pdf']
+    with pytest.raises(ValueError):
+        parse_filters(MetadataFilters(filters=[MetadataFilter(key='topic', value='physics')]))
+
+
+def test_exact_search_matches_brute_force(tmp_path, store):
+    collection, catalog, vectors, file_names = store
+    tier = ExactSearchTier(str(tmp_path / 'exact_search'), catalog, max_vectors=100)
+    partition = tier.get_partition(collection, 'alice')
+    query = np.random.default_rng(1).standard_normal(8).astype(np.float32)
+    assert [node_id for node_id, _ in partition.search(query.tolist(), 5)] == _brute_force(vectors, file_names, query, 5)
+    selected = ['file_0.pdf', 'file_2.pdf']
+    assert [node_id for node_id, _ in partition.search(query.tolist(), 5, file_names=selected)] == _brute_force(vectors, file_names, query, 5, selected)
+    assert partition.search(query.tolist(), 5, file_names=['unknown.pdf']) == []
+
+
+def test_copy_rebuilt_when_the_files_change(tmp_path, store):
+    collection, catalog, _, _ = store
+    tier = ExactSearchTier(str(tmp_path / 'exact_search'), catalog, max_vectors=100)
+    first = tier.get_partition(collection, 'alice')
+    assert tier.get_partition(collection, 'alice') is first
+    catalog.update_file('alice', 'file_0.pdf', content_hash='new')
+    assert tier.get_partition(collection, 'alice') is not first
+    assert tier.stats()['builds'] == 2
+    # Only the copy of the current files is kept on disk
+    assert len(list((tmp_path / 'exact_search' / 'alice').glob('alice.*.json'))) == 1
+
+
+def test_users_above_the_threshold_go_to_chroma(tmp_path, store):
+    collection, catalog, _, _ = store
+    tier = ExactSearchTier(str(tmp_path / 'exact_search'), catalog, max_vectors=10)
+    assert tier.get_partition(collection, 'alice') is None
+
+    vector_store = ExactSearchVectorStore(chroma_collection=collection, tier=tier)
+    result = vector_store.query(VectorStoreQuery(query_embedding=[0.0] * 8, similarity_top_k=3))
+    assert len(result.ids) == 3
+    assert (tier.stats()['searches'], tier.stats()['fallbacks']) == (0, 1)
+
+
+def test_vector_store_queries_served_by_the_tier(tmp_path, store):
+    collection, catalog, vectors, file_names = store
+    tier = ExactSearchTier(str(tmp_path / 'exact_search'), catalog, max_vectors=100)
+    vector_store = ExactSearchVectorStore(chroma_collection=collection, tier=tier)
+    query = np.random.default_rng(2).standard_normal(8).astype(np.float32)
+    filters = MetadataFilters(filters=[MetadataFilter(key='file_name', value='file_1.pdf')])
+    result = vector_store.query(VectorStoreQuery(query_embedding=query.tolist(), similarity_top_k=4, filters=filters))
+    assert result.ids == _brute_force(vectors, file_names, query, 4, ['file_1.pdf'])
+    assert [node.get_content() for node in result.nodes] == [f'chunk {node_id}' for node_id in result.ids]
+    assert all(0 < similarity <= 1 for similarity in result.similarities)
+    assert (tier.stats()['searches'], tier.stats()['fallbacks']) == (1, 0)
+
+
+def test_copy_above_the_user_budget_not_loaded(tmp_path, store):
+    collection, catalog, _, _ = store
+    tier = ExactSearchTier(str(tmp_path / 'exact_search'), catalog, max_vectors=100, user_memory_mb=0)
+    assert tier.get_partition(collection, 'alice') is None
+    # Remembered for the current files: not copied again on the next queries
+    assert tier.get_partition(collection, 'alice') is None
+    assert (tier.stats()['oversized'], tier.stats()['builds'], tier.stats()['loaded_partitions']) == (1, 1, 0)
+
+
+def test_tier_is_opt_in(resources):
+    # EXACT_SEARCH_MAX_VECTORS not set: every query goes through chroma
+    assert resources.exact_search is None
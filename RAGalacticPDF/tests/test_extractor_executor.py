@@ -0,0 +1,68 @@
+import os
+from typing import Dict, List, Sequence
+
+import pytest
+
+from llama_index.core.extractors import BaseExtractor
+from llama_index.core.schema import BaseNode, TextNode
+from llama_index.core.bridge.pydantic import PrivateAttr
+
+from extractor_executor import ExtractorExecutor
+
+
+class _FirstWordExtractor(BaseExtractor):
+    # First word of each node, fails on the nodes whose text contains fail_on. Records the texts it was called on.
+    fail_on: str = ''
+
+    _calls: list = PrivateAttr(default_factory=list)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "FirstWordExtractor"
+
+    @property
+    def calls(self):
+        return self._calls
+
+    async def aextract(self, nodes:Sequence[BaseNode]) -> List[Dict]:
+        self._calls.extend(node.get_content() for node in nodes)
+        if self.fail_on and any(self.fail_on in node.get_content() for node in nodes):
+            raise RuntimeError('LLM call failed')
+        return [{'first_word': node.get_content().split()[0]} for node in nodes]
+
+
+def _nodes():
+    return [TextNode(text=f'{word} is a chunk') for word in ['energy', 'mass', 'spin', 'charge']]
+
+
+def test_metadata_of_every_extractor_added_to_the_nodes(tmp_path):
+    executor = ExtractorExecutor(str(tmp_path / 'checkpoints'), llm_concurrency=2)
+    nodes = executor.run(_nodes(), [_FirstWordExtractor()], checkpoint_key='a')
+    assert [node.metadata['first_word'] for node in nodes] == ['energy', 'mass', 'spin', 'charge']
+    assert executor.last_report['0_FirstWordExtractor']['units'] == 4
+    # Checkpoints are removed once the results are part of the nodes
+    assert not os.path.exists(tmp_path / 'checkpoints' / 'a')
+
+
+def test_interrupted_run_resumes_from_its_checkpoints(tmp_path):
+    executor = ExtractorExecutor(str(tmp_path / 'checkpoints'), llm_concurrency=1)
+    failing = _FirstWordExtractor(fail_on='charge')
+    with pytest.raises(RuntimeError):
+        executor.run(_nodes(), [failing], checkpoint_key='a')
+    assert 'charge is a chunk' in failing.calls
+
+    # Units run one at a time (no LLM: local pool), the 3 first ones were checkpointed and only the last one runs again
+    extractor = _FirstWordExtractor()
+    nodes = executor.run(_nodes(), [extractor], checkpoint_key='a')
+    assert [node.metadata['first_word'] for node in nodes] == ['energy', 'mass', 'spin', 'charge']
+    assert extractor.calls == ['charge is a chunk']
+    assert executor.last_report['0_FirstWordExtractor']['resumed_units'] == 3
+
+
+def test_checkpoints_of_an_ingestion_keyed_by_user_and_file(new_session):
+    alice, bob = new_session('checkpoint_alice'), new_session('checkpoint_bob')
+    key = alice._checkpoint_key('paper.pdf', 'pdf_hash', 'local_hash_custom')
+    assert key == alice._checkpoint_key('paper.pdf', 'pdf_hash', 'local_hash_custom')
+    # Same PDF uploaded by another user or under another name: never the same checkpoints
+    assert key != bob._checkpoint_key('paper.pdf', 'pdf_hash', 'local_hash_custom')
+    assert key != alice._checkpoint_key('copy.pdf', 'pdf_hash', 'local_hash_custom')
@@ -0,0 +1,85 @@
+import os
+
+import pytest
+
+from llama_index.core import Document
+from llama_index.core.schema import TextNode, NodeRelationship, RelatedNodeInfo
+
+from ingestion_cache import IngestionCache
+
+
+def _docs(text:str='Energy is conserved in a closed system.'):
+    return [Document(text=text, metadata={'file_name': 'a.pdf', 'page_label': '1'})]
+
+
+def _nodes():
+    first, second = TextNode(text='first chunk', embedding=[1.0, 0.0]), TextNode(text='second chunk', embedding=[0.0, 1.0])
+    first.relationships[NodeRelationship.NEXT] = RelatedNodeInfo(node_id=second.node_id)
+    second.relationships[NodeRelationship.PREVIOUS] = RelatedNodeInfo(node_id=first.node_id)
+    return [first, second]
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return IngestionCache(str(tmp_path / 'ingestion_cache'))
+
+
+def test_keyed_by_content_hash():
+    assert IngestionCache.hash_pdf(b'%PDF-1.4 a') == IngestionCache.hash_pdf(b'%PDF-1.4 a')
+    assert IngestionCache.hash_pdf(b'%PDF-1.4 a') != IngestionCache.hash_pdf(b'%PDF-1.4 b')
+
+
+def test_documents_are_keyed_by_parser_backend(cache):
+    pdf_hash = cache.hash_pdf(b'%PDF-1.4 a')
+    assert cache.get_documents(pdf_hash, parser_backend='local') is None
+
+    cache.put_documents(pdf_hash, _docs(), parser_backend='local')
+    docs = cache.get_documents(pdf_hash, parser_backend='local')
+    assert [doc.text for doc in docs] == ['Energy is conserved in a closed system.']
+    assert docs[0].metadata['file_name'] == 'a.pdf'
+    assert cache.get_documents(pdf_hash, parser_backend='llamaparse') is None
+    assert cache.get_documents(cache.hash_pdf(b'%PDF-1.4 b'), parser_backend='local') is None
+
+
+def test_nodes_are_keyed_by_flavour_and_get_fresh_ids(cache):
+    pdf_hash = cache.hash_pdf(b'%PDF-1.4 a')
+    nodes = _nodes()
+    cache.put_nodes(pdf_hash, nodes, flavour='default')
+    assert cache.get_nodes(pdf_hash, flavour='custom_transforms') is None
+
+    cached = cache.get_nodes(pdf_hash, flavour='default')
+    assert [node.text for node in cached] == ['first chunk', 'second chunk']
+    assert [node.embedding for node in cached] == [[1.0, 0.0], [0.0, 1.0]]
+    # New ids on every hit, prev / next links follow them
+    assert {node.node_id for node in cached}.isdisjoint(node.node_id for node in nodes)
+    assert cached[0].relationships[NodeRelationship.NEXT].node_id == cached[1].node_id
+    assert cached[1].relationships[NodeRelationship.PREVIOUS].node_id == cached[0].node_id
+
+
+def test_empty_results_are_not_cached(cache):
+    pdf_hash = cache.hash_pdf(b'%PDF-1.4 empty')
+    with pytest.raises(ValueError):
+        cache.put_documents(pdf_hash, [], parser_backend='local')
+    with pytest.raises(ValueError):
+        cache.put_nodes(pdf_hash, [])
+    assert cache.get_documents(pdf_hash, parser_backend='local') is None
+    assert cache.get_nodes(pdf_hash) is None
+
+
+def test_least_recently_used_entries_are_evicted(cache):
+    hash_a, hash_b, hash_c = (cache.hash_pdf(data) for data in (b'a', b'b', b'c'))
+    cache.put_documents(hash_a, _docs(), parser_backend='local')
+    cache.put_documents(hash_b, _docs(), parser_backend='local')
+    # Room for two entries
+    entry_size = cache._entry_size(cache._entry_path(hash_a))
+    cache.max_bytes = int(2.5 * entry_size)
+    os.utime(cache._entry_path(hash_a), (1000, 1000))
+    os.utime(cache._entry_path(hash_b), (2000, 2000))
+
+    # Reading a marks it as recently used: b is now the least recently used entry
+    assert cache.get_documents(hash_a, parser_backend='local') is not None
+    cache.put_documents(hash_c, _docs(), parser_backend='local')
+
+    assert cache.get_documents(hash_b, parser_backend='local') is None
+    assert cache.get_documents(hash_a, parser_backend='local') is not None
+    assert cache.get_documents(hash_c, parser_backend='local') is not None
@@ -0,0 +1,127 @@
+import time
+import threading
+
+import pytest
+
+from jobs import IngestionJobManager, QUEUED, RUNNING, DONE, FAILED
+
+
+def _wait_for(condition, timeout:float=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise TimeoutError('condition not met')
+        time.sleep(0.005)
+
+
+def _wait_finished(manager, job):
+    _wait_for(lambda: manager.get_job(job['job_id'])['status'] in (DONE, FAILED))
+    return manager.get_job(job['job_id'])
+
+
+@pytest.fixture
+def manager():
+    return IngestionJobManager(max_concurrent_jobs=2)
+
+
+def test_job_reports_stage_progress(manager):
+    release = threading.Event()
+
+    def work(progress):
+        progress('embed', 5, 10)
+        release.wait()
+
+    job = manager.submit('alice', 'a.pdf', 'h1', work)
+    _wait_for(lambda: manager.get_job(job['job_id'])['stage'] == 'embed')
+    running = manager.get_job(job['job_id'])
+    assert running['status'] == RUNNING
+    # Embedding is the 4th of the 5 stages, half done
+    assert running['fraction'] == pytest.approx(3.5 / 5)
+    release.set()
+    done = _wait_finished(manager, job)
+    assert (done['status'], done['fraction'], done['error']) == (DONE, 1.0, None)
+
+
+def test_resubmitted_upload_returns_the_existing_job(manager):
+    calls = []
+    job = manager.submit('alice', 'a.pdf', 'h1', calls.append)
+    _wait_finished(manager, job)
+    assert manager.submit('alice', 'a.pdf', 'h1', calls.append)['job_id'] == job['job_id']
+    # Another content, file or user is another job
+    assert manager.submit('alice', 'a.pdf', 'h2', calls.append)['job_id'] != job['job_id']
+    assert manager.submit('bob', 'a.pdf', 'h1', calls.append)['job_id'] != job['job_id']
+    _wait_for(lambda: len(calls) == 3)
+
+
+def test_failed_job_is_only_run_again_on_retry(manager):
+    def work(progress):
+        raise RuntimeError('parser unavailable')
+
+    failed = _wait_finished(manager, manager.submit('alice', 'a.pdf', 'h1', work))
+    assert (failed['status'], failed['error']) == (FAILED, 'parser unavailable')
+    assert manager.submit('alice', 'a.pdf', 'h1', lambda progress: None)['job_id'] == failed['job_id']
+
+    retried = _wait_finished(manager, manager.submit('alice', 'a.pdf', 'h1', lambda progress: None, retry=True))
+    assert retried['job_id'] != failed['job_id']
+    assert retried['status'] == DONE
+
+
+def test_concurrent_jobs_are_bounded(manager):
+    release = threading.Event()
+    jobs = [manager.submit('alice', f'{i}.pdf', 'h', lambda progress: release.wait()) for i in range(4)]
+    _wait_for(lambda: len(manager.get_user_jobs('alice', active_only=True)) == 4 and manager.queue_depth() == 2)
+    assert [manager.get_job(job['job_id'])['status'] for job in jobs].count(RUNNING) == 2
+    release.set()
+    for job in jobs:
+        _wait_finished(manager, job)
+    assert manager.get_user_jobs('alice', active_only=True) == []
+    assert len(manager.get_user_jobs('alice')) == 4
+
+
+def test_finished_jobs_are_purged_after_retention():
+    manager = IngestionJobManager(max_concurrent_jobs=1, retention_s=0.05)
+    job = _wait_finished(manager, manager.submit('alice', 'a.pdf', 'h1', lambda progress: None))
+    time.sleep(0.1)
+    # Purged on the next submission: the same upload is a new job
+    assert manager.submit('alice', 'b.pdf', 'h2', lambda progress: None)['job_id'] != job['job_id']
+    assert manager.get_job(job['job_id']) is None
+
+
+def test_jobs_of_a_file_run_one_after_the_other(manager):
+    release, events = threading.Event(), []
+
+    def work(version):
+        def run(progress):
+            events.append(f'start {version}')
+            if version == 'v1':
+                release.wait()
+            events.append(f'end {version}')
+        return run
+
+    first = manager.submit('alice', 'a.pdf', 'h1', work('v1'))
+    _wait_for(lambda: events == ['start v1'])
+    second = manager.submit('alice', 'a.pdf', 'h2', work('v2'))
+    # A free worker is left, the new version still waits for the running one
+    time.sleep(0.05)
+    assert manager.get_job(second['job_id'])['status'] == QUEUED
+    release.set()
+    _wait_finished(manager, first)
+    _wait_finished(manager, second)
+    assert events == ['start v1', 'end v1', 'start v2', 'end v2']
+
+
+def test_forgotten_file_is_ingested_again(manager):
+    calls = []
+    v1 = _wait_finished(manager, manager.submit('alice', 'a.pdf', 'h1', calls.append))
+    v2 = _wait_finished(manager, manager.submit('alice', 'a.pdf', 'h2', calls.append))
+
+    # Replaced by h2: uploading h1 again is a new job, h2 is still the loaded version
+    manager.forget_file('alice', 'a.pdf', keep_hash='h2')
+    assert manager.submit('alice', 'a.pdf', 'h2', calls.append)['job_id'] == v2['job_id']
+    again = _wait_finished(manager, manager.submit('alice', 'a.pdf', 'h1', calls.append))
+    assert again['job_id'] != v1['job_id']
+
+    # Deleted: every version is ingested again
+    manager.forget_file('alice', 'a.pdf')
+    assert manager.submit('alice', 'a.pdf', 'h2', calls.append)['job_id'] != v2['job_id']
+    _wait_for(lambda: len(calls) == 4)
@@ -0,0 +1,170 @@
+import time
+import threading
+
+import pytest
+
+from llm_scheduler import LLMScheduler, INTERACTIVE, CONDENSE, BACKGROUND
+
+
+def _wait_for(condition, timeout:float=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise TimeoutError('condition not met')
+        time.sleep(0.005)
+
+
+def _start(target, *args):
+    thread = threading.Thread(target=target, args=args, daemon=True)
+    thread.start()
+    return thread
+
+
+def test_waiting_calls_served_by_priority_then_arrival():
+    scheduler = LLMScheduler(max_concurrency=1)
+    release = threading.Event()
+    served = []
+    threads = [_start(scheduler.run, release.wait, None, INTERACTIVE)]
+    _wait_for(lambda: scheduler.metrics()['running'] == 1)
+
+    # Queued while the only slot is busy
+    for name, priority in [('background', BACKGROUND), ('interactive 1', INTERACTIVE), ('condense', CONDENSE), ('interactive 2', INTERACTIVE)]:
+        threads.append(_start(scheduler.run, lambda name=name: served.append(name), None, priority))
+        n_waiting = len(threads) - 1
+        _wait_for(lambda: scheduler.metrics()['waiting'] == n_waiting)
+    release.set()
+    for thread in threads:
+        thread.join(timeout=5)
+
+    assert served == ['interactive 1', 'interactive 2', 'condense', 'background']
+    metrics = scheduler.metrics()
+    assert (metrics['running'], metrics['waiting']) == (0, 0)
+    assert (metrics['interactive']['requests'], metrics['condense']['requests'], metrics['background']['requests']) == (3, 1, 1)
+
+
+def test_concurrency_is_bounded():
+    scheduler = LLMScheduler(max_concurrency=2)
+    lock, running, max_running = threading.Lock(), [0], [0]
+
+    def call():
+        with lock:
+            running[0] += 1
+            max_running[0] = max(max_running[0], running[0])
+        time.sleep(0.02)
+        with lock:
+            running[0] -= 1
+
+    threads = [_start(scheduler.run, call) for _ in range(8)]
+    for thread in threads:
+        thread.join(timeout=5)
+    assert max_running[0] == 2
+
+
+def test_identical_concurrent_calls_are_coalesced():
+    scheduler = LLMScheduler(max_concurrency=2)
+    release = threading.Event()
+    calls, results = [], []
+
+    def call():
+        calls.append(1)
+        release.wait()
+        return 'answer'
+
+    leader = _start(lambda: results.append(scheduler.run(call, key='same prompt')))
+    _wait_for(lambda: scheduler.metrics()['running'] == 1)
+    follower = _start(lambda: results.append(scheduler.run(call, key='same prompt')))
+    _wait_for(lambda: scheduler.metrics()['interactive']['coalesced'] == 1)
+    release.set()
+    leader.join(timeout=5)
+    follower.join(timeout=5)
+
+    assert calls == [1]
+    assert results == ['answer', 'answer']
+    # Once finished, the same call runs again
+    assert scheduler.run(call, key='same prompt') == 'answer'
+    assert len(calls) == 2
+
+
+def test_calls_of_other_priorities_are_not_coalesced():
+    scheduler = LLMScheduler(max_concurrency=2)
+    release = threading.Event()
+    calls = []
+
+    def call():
+        calls.append(1)
+        release.wait()
+
+    threads = [_start(scheduler.run, call, 'same prompt', INTERACTIVE)]
+    _wait_for(lambda: scheduler.metrics()['running'] == 1)
+    threads.append(_start(scheduler.run, call, 'same prompt', BACKGROUND))
+    _wait_for(lambda: scheduler.metrics()['running'] == 2)
+    release.set()
+    for thread in threads:
+        thread.join(timeout=5)
+    assert len(calls) == 2
+
+
+def test_failure_is_shared_with_coalesced_callers():
+    scheduler = LLMScheduler(max_concurrency=1)
+    release = threading.Event()
+    errors = []
+
+    def call():
+        release.wait()
+        raise RuntimeError('server error')
+
+    def caller():
+        try:
+            scheduler.run(call, key='same prompt')
+        except RuntimeError as e:
+            errors.append(str(e))
+
+    leader = _start(caller)
+    _wait_for(lambda: scheduler.metrics()['running'] == 1)
+    follower = _start(caller)
+    _wait_for(lambda: scheduler.metrics()['interactive']['coalesced'] == 1)
+    release.set()
+    leader.join(timeout=5)
+    follower.join(timeout=5)
+
+    assert errors == ['server error', 'server error']
+    assert scheduler.metrics()['interactive']['failed'] == 1
+    # The slot was released
+    with pytest.raises(RuntimeError):
+        scheduler.run(call, key='same prompt')
+
+
+def test_stream_holds_the_slot_until_exhausted():
+    scheduler = LLMScheduler(max_concurrency=1)
+    stream = scheduler.stream(lambda: iter(['a', 'b']), priority=INTERACTIVE)
+    assert next(stream) == 'a'
+    assert scheduler.metrics()['running'] == 1
+    assert list(stream) == ['b']
+    assert scheduler.metrics()['running'] == 0
+
+
+def test_cancelled_stream_is_closed_and_frees_its_slot():
+    scheduler = LLMScheduler(max_concurrency=1)
+    closed, cancel = [], threading.Event()
+
+    def tokens():
+        try:
+            yield from ['a', 'b', 'c']
+        finally:
+            closed.append(True)
+    stream = scheduler.stream(tokens, priority=INTERACTIVE, cancel=cancel)
+    assert next(stream) == 'a'
+    # Cancelled by another thread (client gone): the stream ends at its next chunk
+    cancel.set()
+    assert list(stream) == []
+    assert closed == [True]
+    assert scheduler.metrics()['running'] == 0
+
+
+def test_stream_cancelled_while_waiting_never_starts():
+    scheduler = LLMScheduler(max_concurrency=1)
+    started, cancel = [], threading.Event()
+    cancel.set()
+    assert list(scheduler.stream(lambda: started.append(True) or iter(['a']), priority=INTERACTIVE, cancel=cancel)) == []
+    assert started == []
+    assert scheduler.metrics()['running'] == 0
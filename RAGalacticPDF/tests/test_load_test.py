@@ -0,0 +1,16 @@
+from argparse import Namespace
+
+from load_test import percentiles, run_level
+
+
+def test_percentiles():
+    assert percentiles([]) == {}
+    stats = percentiles([i / 1000 for i in range(1, 101)])
+    assert (stats['count'], stats['p50_ms'], stats['p95_ms'], stats['p99_ms']) == (100, 51.0, 96.0, 100.0)
+
+
+def test_simulated_users_upload_and_chat(resources):
+    result = run_level(2, Namespace(turns=2, pages=1, distinct_pdfs=1, arrival_s=0.0))
+    assert (result['error_rate'], result['failed_users']) == (0.0, 0)
+    assert result['latency']['upload_until_ready']['count'] == 2
+    assert result['latency']['chat_turn']['count'] == 4
@@ -0,0 +1,21 @@
+from offline import HashEmbedding
+
+
+def test_hash_embedding_is_close_for_shared_words():
+    model = HashEmbedding(embed_dim=64)
+    energy, conserved, spin = (model.get_text_embedding(text) for text in ['energy is conserved', 'the energy is conserved', 'spin'])
+    similarity = lambda a, b: sum(x * y for x, y in zip(a, b))
+    assert similarity(energy, conserved) > similarity(energy, spin)
+
+
+def test_pdf_ingested_and_answered_offline(new_session, uploaded_pdf):
+    session = new_session('offline_user')
+    session._set_engine_feature(engine_mode='Query', llm_knowledge_base=False, streaming=True)
+    engine = session.load_new_pdf(uploaded_pdf('physics.pdf', 2))
+    assert session.get_user_pdfs() == ['physics.pdf']
+    assert session.chroma_collection.count() > 0
+
+    response = session.run_query(engine, 'What does section 1 say?')
+    # Streamed by the fake Ollama server
+    assert ''.join(response.response_gen).strip()
+    assert {node.node.metadata['file_name'] for node in response.source_nodes} == {'physics.pdf'}
@@ -0,0 +1,33 @@
+import pytest
+
+from parsers import LocalPDFParser, get_parser, _page_text_to_markdown
+
+
+def test_page_text_to_markdown():
+    text = _page_text_to_markdown('1. Introduction\nThe wave func-\ntion collapses.\n\nRESULTS AND DISCUSSION\nDone.')
+    assert text == '## 1. Introduction\n\nThe wave function collapses.\n\n## RESULTS AND DISCUSSION\n\nDone.'
+
+
+def test_one_document_per_page(sample_pdf):
+    docs = LocalPDFParser(max_workers=1).load_data(sample_pdf(3), extra_info={'file_name': 'sample.pdf'})
+    assert [doc.metadata['page_label'] for doc in docs] == ['1', '2', '3']
+    assert all(doc.metadata['file_name'] == 'sample.pdf' for doc in docs)
+    assert docs[1].text.startswith('## 2. SECTION 2')
+
+
+def test_page_ranges_extracted_in_parallel_give_the_same_documents(sample_pdf):
+    path = sample_pdf(5)
+    parser = LocalPDFParser(max_workers=2, pages_per_task=2)
+    try:
+        assert parser._page_ranges(5) == [(0, 2), (2, 4), (4, 5)]
+        parallel = parser.load_data(path)
+    finally:
+        parser.shutdown()
+    sequential = LocalPDFParser(max_workers=1).load_data(path)
+    assert [(doc.text, doc.metadata) for doc in parallel] == [(doc.text, doc.metadata) for doc in sequential]
+
+
+def test_unknown_backend():
+    assert isinstance(get_parser('local'), LocalPDFParser)
+    with pytest.raises(ValueError):
+        get_parser('ocr')
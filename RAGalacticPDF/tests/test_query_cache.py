@@ -0,0 +1,92 @@
+import pytest
+
+from llama_index.core.base.response.schema import Response, StreamingResponse
+from llama_index.core.schema import NodeWithScore, TextNode
+
+from catalog import PDFCatalog
+from query_cache import AnswerCache, QueryEmbeddingCache, normalize_query
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    catalog = PDFCatalog(str(tmp_path / 'catalog.db'))
+    catalog.add_file('alice', 'a.pdf', content_hash='h1')
+    catalog.add_file('alice', 'b.pdf', content_hash='h2')
+    return catalog
+
+
+def _answer(text:str):
+    return Response(response=text, source_nodes=[NodeWithScore(node=TextNode(text='E = 42 J', metadata={'file_name': 'a.pdf'}), score=0.9)])
+
+
+def _key(catalog, query:str, pdf_names=None):
+    return AnswerCache.key('alice', pdf_names, 'Query', False, query, catalog.get_files_fingerprint('alice', pdf_names))
+
+
+def test_normalize_query():
+    assert normalize_query('  Summarize   this paper ?') == normalize_query('summarize this paper')
+
+
+def test_answer_served_for_the_same_question(catalog):
+    cache = AnswerCache()
+    cache.record(_key(catalog, 'What is the energy?'), _answer('42 joules'))
+    cached = cache.get(_key(catalog, 'what is the energy'))
+    assert cached.response == '42 joules'
+    assert ''.join(cached.response_gen) == '42 joules'
+    assert cache.get(_key(catalog, 'What is the mass?')) is None
+
+
+def test_streamed_answer_stored_once_consumed(catalog):
+    cache = AnswerCache()
+    key = _key(catalog, 'What is the energy?')
+    streamed = cache.record(key, StreamingResponse(response_gen=iter(['42 ', 'joules']), source_nodes=_answer('').source_nodes))
+    assert cache.get(key) is None
+    assert ''.join(streamed.response_gen) == '42 joules'
+    assert str(streamed) == '42 joules'
+    assert cache.get(key).response == '42 joules'
+
+
+def test_query_embeddings_keyed_by_normalized_query():
+    cache = QueryEmbeddingCache(max_size=8)
+    cache.set('What is the energy?', [0.1, 0.2])
+    assert cache.get('what is the   energy') == [0.1, 0.2]
+    assert cache.get('What is the mass?') is None
+
+
+def test_empty_answers_are_not_cached(catalog):
+    cache = AnswerCache()
+    cache.record(_key(catalog, 'What is the energy?'), _answer('  '))
+    assert cache.get(_key(catalog, 'What is the energy?')) is None
+
+
+def test_answers_without_retrieved_nodes_are_not_cached(catalog):
+    cache = AnswerCache()
+    # Retrieval returned nothing (e.g. the files are being written): llama_index answers 'Empty Response'
+    cache.record(_key(catalog, 'What is the energy?'), Response(response='Empty Response', source_nodes=[]))
+    cache.record(_key(catalog, 'What is the mass?'), Response(response='12 kg', source_nodes=[]))
+    assert cache.get(_key(catalog, 'What is the energy?')) is None
+    assert cache.get(_key(catalog, 'What is the mass?')) is None
+
+
+def test_file_change_invalidates_answers(catalog):
+    cache = AnswerCache()
+    cache.record(_key(catalog, 'What is the energy?'), _answer('42 joules'))
+    cache.record(_key(catalog, 'What is the energy?', ['b.pdf']), _answer('12 joules'))
+
+    # New content of a.pdf: the fingerprint of the file sets including it changes
+    catalog.update_file('alice', 'a.pdf', content_hash='h1bis')
+
+    assert cache.get(_key(catalog, 'What is the energy?')) is None
+    assert cache.get(_key(catalog, 'What is the energy?', ['b.pdf'])).response == '12 joules'
+
+
+def test_invalidate_user(catalog):
+    cache = AnswerCache()
+    key = _key(catalog, 'What is the energy?')
+    cache.record(key, _answer('42 joules'))
+    bob_key = AnswerCache.key('bob', None, 'Query', False, 'What is the energy?', 'fingerprint')
+    cache.record(bob_key, _answer('7 joules'))
+
+    assert cache.invalidate_user('alice') == 1
+    assert cache.get(key) is None
+    assert cache.get(bob_key).response == '7 joules'
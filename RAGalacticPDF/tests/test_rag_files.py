@@ -0,0 +1,65 @@
+import time
+
+import pytest
+
+
+def _wait_done(session, job):
+    deadline = time.monotonic() + 60
+    while job['status'] in ('queued', 'running'):
+        assert time.monotonic() < deadline
+        time.sleep(0.02)
+        job = session.get_ingestion_job(job['job_id'])
+    return job
+
+
+def _stored(session, file_name:str):
+    stored = session.chroma_collection.get(where={'file_name': file_name}, include=['documents'])
+    return dict(zip(stored['ids'], stored['documents']))
+
+
+def test_deleted_pdf_removed_from_the_store_and_the_catalog(new_session, uploaded_pdf):
+    session = new_session('delete_user')
+    session.load_new_pdf(uploaded_pdf('first.pdf', 2), tags=[{'topic': 'physics'}])
+    session.load_new_pdf(uploaded_pdf('second.pdf', 1, seed=1))
+    assert session.delete_pdf('first.pdf')
+    assert session.get_user_pdfs() == ['second.pdf']
+    assert _stored(session, 'first.pdf') == {}
+    assert _stored(session, 'second.pdf')
+    assert not session.delete_pdf('first.pdf')
+
+
+def test_replaced_pdf_keeps_its_unchanged_chunks(new_session, uploaded_pdf):
+    session = new_session('replace_user')
+    session.load_new_pdf(uploaded_pdf('paper.pdf', 2), tags=[{'topic': 'physics'}])
+    before = _stored(session, 'paper.pdf')
+    # Same first pages (same seed), one more page: one chunk per page
+    session.replace_pdf(uploaded_pdf('paper.pdf', 3))
+    after = _stored(session, 'paper.pdf')
+    assert len(after) == 3
+    assert set(before.items()) < set(after.items())
+    assert session.get_users_tags() == [{'topic': 'physics'}]
+
+    # Shorter version: the chunk of the removed page is deleted
+    session.replace_pdf(uploaded_pdf('paper.pdf', 1))
+    assert len(_stored(session, 'paper.pdf')) == 1
+
+
+def test_replacement_submitted_as_a_job(new_session, uploaded_pdf):
+    session = new_session('replace_job_user')
+    session.load_new_pdf(uploaded_pdf('paper.pdf', 1))
+    assert session.submit_new_pdf(uploaded_pdf('paper.pdf', 2)) is None
+    job = _wait_done(session, session.submit_new_pdf(uploaded_pdf('paper.pdf', 2), replace=True))
+    assert job['status'] == 'done'
+    assert len(_stored(session, 'paper.pdf')) == 2
+
+
+def test_deleted_pdf_uploaded_again_is_ingested_again(new_session, uploaded_pdf):
+    session = new_session('reupload_user')
+    first_job = _wait_done(session, session.submit_new_pdf(uploaded_pdf('paper.pdf', 1)))
+    session.delete_pdf('paper.pdf')
+    # Same bytes: a new job, not the finished job of the deleted file
+    job = _wait_done(session, session.submit_new_pdf(uploaded_pdf('paper.pdf', 1)))
+    assert job['job_id'] != first_job['job_id']
+    assert job['status'] == 'done'
+    assert session.get_user_pdfs() == ['paper.pdf']
+    assert _stored(session, 'paper.pdf')
@@ -0,0 +1,23 @@
+import time
+import threading
+
+import resources
+
+
+def test_shared_resources_built_once_for_concurrent_sessions(monkeypatch):
+    built = []
+
+    class _Resources():
+        def __init__(self):
+            time.sleep(0.05)
+            built.append(self)
+    monkeypatch.setattr(resources, 'SharedResources', _Resources)
+    monkeypatch.setattr(resources, '_shared_resources', None)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(resources.get_shared_resources())) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(built) == 1
+    assert all(result is built[0] for result in results)
@@ -0,0 +1,36 @@
+import sys
+import time
+import builtins
+
+from startup_profile import StartupProfiler
+
+
+def test_first_imports_and_components_timed(monkeypatch):
+    # The profiler replaces builtins.__import__, restored after the test
+    monkeypatch.setattr(builtins, '__import__', builtins.__import__)
+    monkeypatch.delitem(sys.modules, 'wave', raising=False)
+    profiler = StartupProfiler()
+    profiler.enable()
+    import wave  # noqa: F401
+    assert profiler.timed('embedding model', lambda: time.sleep(0.02) or 'model') == 'model'
+    report = profiler.report(min_import_ms=0.0)
+    assert '  wave ' in report
+    assert '  embedding model ' in report
+
+
+def test_disabled_profiler_records_nothing():
+    profiler = StartupProfiler()
+    assert profiler.timed('parser', lambda: 'parser') == 'parser'
+    assert profiler._components == []
+
+
+def test_heavy_components_built_on_first_use(resources, monkeypatch):
+    # Forget the components other tests may have built (restored after the test)
+    for name in ('custom transforms', 'reranker'):
+        monkeypatch.delitem(resources._lazy_components, name, raising=False)
+    assert not {'custom transforms', 'reranker'} & set(resources._lazy_components)
+    transforms = resources.custom_transforms
+    assert resources.custom_transforms is transforms
+    # No reranker model configured
+    assert resources.reranker is None
+    assert {'custom transforms', 'reranker'} <= set(resources._lazy_components)
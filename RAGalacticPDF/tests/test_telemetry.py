@@ -0,0 +1,79 @@
+import urllib.request
+
+import pytest
+
+from llama_index.core.callbacks import CBEventType, EventPayload
+
+from telemetry import MetricsRegistry, TelemetryCallbackHandler, start_metrics_server
+
+
+class _StreamedAnswer():
+    def __init__(self, chunks):
+        self.response_gen = iter(chunks)
+        self.source_nodes = []
+
+
+def test_prometheus_export():
+    registry = MetricsRegistry(event_sample_rate=0.0)
+    registry.inc('ragalactic_answers_total', mode='Query')
+    registry.inc('ragalactic_answers_total', 2, mode='Query')
+    registry.observe('ragalactic_latency_seconds', 0.02, buckets=(0.01, 0.1), cached=False)
+    registry.observe('ragalactic_latency_seconds', 0.5, buckets=(0.01, 0.1), cached=False)
+    registry.register_collector('answer_cache', lambda: {'hits': 3, 'ratio': {'users': 0.5}})
+    lines = registry.export_prometheus().splitlines()
+
+    assert '# TYPE ragalactic_answers_total counter' in lines
+    assert 'ragalactic_answers_total{mode="Query"} 3.0' in lines
+    # Cumulative buckets, observations above the last bound only in +Inf
+    assert 'ragalactic_latency_seconds_bucket{cached="false",le="0.01"} 0' in lines
+    assert 'ragalactic_latency_seconds_bucket{cached="false",le="0.1"} 1' in lines
+    assert 'ragalactic_latency_seconds_bucket{cached="false",le="+Inf"} 2' in lines
+    assert 'ragalactic_latency_seconds_count{cached="false"} 2' in lines
+    assert 'ragalactic_answer_cache_hits 3.0' in lines
+    assert 'ragalactic_answer_cache_users{group="ratio"} 0.5' in lines
+
+
+def test_span_records_duration_and_errors():
+    registry = MetricsRegistry(event_sample_rate=0.0)
+    with registry.span('parse_pdf', backend='local'):
+        pass
+    with pytest.raises(RuntimeError):
+        with registry.span('parse_pdf', backend='local'):
+            raise RuntimeError('unreadable')
+    snapshot = registry.snapshot()
+    assert snapshot['histograms']['ragalactic_span_duration_seconds{backend="local",span="parse_pdf"}']['count'] == 2
+    assert snapshot['counters']['ragalactic_span_errors_total{backend="local",span="parse_pdf"}'] == 1
+
+
+def test_streamed_answer_measured_once_consumed():
+    registry = MetricsRegistry(event_sample_rate=0.0)
+    response = registry.instrument_response(_StreamedAnswer(['Energy ', 'is ', 'conserved.']), started_at=0.0, streamed=True, mode='Query')
+    assert registry.snapshot()['histograms'] == {}
+    assert ''.join(response.response_gen) == 'Energy is conserved.'
+    histograms = registry.snapshot()['histograms']
+    assert histograms['ragalactic_time_to_first_token_seconds{mode="Query"}']['count'] == 1
+    assert histograms['ragalactic_stream_chunks{mode="Query"}']['max'] == 3
+    assert registry.snapshot()['counters']['ragalactic_generated_tokens_total{mode="Query"}'] > 0
+
+
+def test_callback_handler_times_retrievals():
+    registry = MetricsRegistry(event_sample_rate=0.0)
+    handler = TelemetryCallbackHandler(registry)
+    handler.on_event_start(CBEventType.RETRIEVE, event_id='1')
+    handler.on_event_end(CBEventType.RETRIEVE, payload={EventPayload.NODES: ['a', 'b']}, event_id='1')
+    histograms = registry.snapshot()['histograms']
+    assert histograms['ragalactic_span_duration_seconds{span="retrieve"}']['count'] == 1
+    assert histograms['ragalactic_retrieved_chunks']['max'] == 2
+
+
+def test_metrics_served_over_http():
+    registry = MetricsRegistry(event_sample_rate=0.0)
+    registry.inc('ragalactic_answers_total')
+    server = start_metrics_server(registry, port=0, host='127.0.0.1')
+    try:
+        host, port = server.server_address[:2]
+        with urllib.request.urlopen(f'http://{host}:{port}/metrics', timeout=5) as response:
+            assert 'ragalactic_answers_total 1.0' in response.read().decode('utf-8')
+    finally:
+        server.shutdown()
+        server.server_close()